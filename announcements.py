@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""announcements.py
+
+Udacity conference server-side Python App Engine "nearly sold out"
+announcement
+
+$Id$
+
+The conferences with at most NEARLY_SOLD_OUT seats left are kept in a
+single AnnouncementIndex entity, updated as seat changes move a
+conference across the threshold (see seats._afterChange), and the
+announcement built from it is mirrored in a TwoTierCache, which
+instances serve from memory for up to ANNOUNCEMENT_LOCAL_TTL seconds.
+Seat changes that don't cross the threshold cost one (cached) get of
+the index. The
+set_announcement cron job only reconciles the index with the seat
+counts, and a memcache miss is served by rebuilding from the index.
+
+"""
+
+from google.appengine.ext import ndb
+
+from cache import TwoTierCache
+from models import AnnouncementIndex
+from models import Conference
+import metrics
+import seats
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+NEARLY_SOLD_OUT = 5
+ANNOUNCEMENT_LOCAL_TTL = 5
+
+_INDEX_KEY = ndb.Key(AnnouncementIndex, 'nearlySoldOut')
+_announcements = TwoTierCache('announcements', max_size=1,
+                              local_ttl=ANNOUNCEMENT_LOCAL_TTL)
+
+
+def _nearlySoldOut(available):
+    return 0 < (available or 0) <= NEARLY_SOLD_OUT
+
+
+def _format(conferences):
+    """Return the announcement for conferences ({websafe key: name})."""
+    if not conferences:
+        return ""
+    return '%s %s' % (
+        'Last chance to attend! The following conferences '
+        'are nearly sold out:',
+        ', '.join(sorted(conferences.values())))
+
+
+def _publish(conferences):
+    """Cache the announcement for conferences; return it."""
+    announcement = _format(conferences)
+    # cache empty announcements too, so they don't hit the datastore
+    _announcements.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
+
+
+@metrics.transactional('announcements.update')
+def _update(wsck, name):
+    """List conference wsck under name, or unlist it when name is None;
+    return the updated {websafe key: name}, or None if nothing changed."""
+    index = _INDEX_KEY.get() or AnnouncementIndex(key=_INDEX_KEY)
+    conferences = dict(index.conferences or {})
+    if conferences.get(wsck) == name:
+        return None
+    if name:
+        conferences[wsck] = name
+    else:
+        del conferences[wsck]
+    index.conferences = conferences
+    index.put()
+    return conferences
+
+
+@metrics.transactional('announcements.replace')
+def _replace(conferences):
+    AnnouncementIndex(key=_INDEX_KEY, conferences=conferences).put()
+
+
+def seats_changed(conf, available):
+    """Record that Conference conf now has available seats, updating the
+    index and the announcement if conf entered or left the nearly sold
+    out set (or was renamed while in it)."""
+    wsck = conf.key.urlsafe()
+    index = _INDEX_KEY.get()
+    listed = (index.conferences or {}).get(wsck) if index else None
+    wanted = conf.name if _nearlySoldOut(available) else None
+    if wanted == listed:
+        return
+    conferences = _update(wsck, wanted)
+    if conferences is not None:
+        _publish(conferences)
+
+
+def _load():
+    index = _INDEX_KEY.get()
+    return _format(index.conferences if index else {})
+
+
+def get_announcement():
+    """Return the current announcement, rebuilding it from the index
+    when memcache lost it."""
+    return _announcements.get(MEMCACHE_ANNOUNCEMENTS_KEY, loader=_load)
+
+
+def refresh():
+    """Rebuild the announcement from the index; return it."""
+    announcement = _load()
+    _announcements.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
+
+
+def reconcile():
+    """Rebuild the index from the seat counts, catching changes the
+    incremental updates missed; return the announcement.
+
+    Conference.seatsAvailable is a synced snapshot of the seat shards,
+    so candidates are narrowed down with it, together with whatever is
+    listed already, and then checked against the live figures.
+    """
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= NEARLY_SOLD_OUT,
+        Conference.seatsAvailable > 0)
+    ).fetch()
+    index = _INDEX_KEY.get()
+    found = set(conf.key for conf in confs)
+    listed = [ndb.Key(urlsafe=wsck) for wsck in
+              (index.conferences or {} if index else {})]
+    confs.extend(conf for conf in
+                 ndb.get_multi([key for key in listed if key not in found])
+                 if conf)
+    available = seats.get_seats_available_multi(confs)
+    conferences = dict((conf.key.urlsafe(), conf.name) for conf in confs
+                       if _nearlySoldOut(available[conf.key]))
+    if not index or (index.conferences or {}) != conferences:
+        _replace(conferences)
+    return _publish(conferences)
@@ -0,0 +1,14 @@
+"""appengine_config.py
+
+Udacity conference server-side Python App Engine configuration
+
+$Id$
+
+Third-party libraries not provided by the runtime are vendored under
+lib/, from requirements-vendor.txt.
+
+"""
+
+from google.appengine.ext import vendor
+
+vendor.add('lib')
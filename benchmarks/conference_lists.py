@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""conference_lists.py -- RPCs and wall time of a conference list page,
+two-pass versus the single-pass async pipeline
+
+The two-pass rendering is the one queryConferences had: run the query
+to collect the organizers' Profile keys, get_multi them, then run the
+query again to build the forms. The pipeline
+(ConferenceApi._conferenceFormsAsync) runs the query once and starts
+each distinct organizer's Profile get as its first conference arrives.
+All conferences predate the denormalized organizerDisplayName, so both
+read the Profiles.
+
+"""
+
+from benchmarks import harness
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+import conference
+import converters
+
+CONFERENCES = 500
+ORGANIZERS = 50
+PAGE_SIZE = 100
+RUNS = 5
+LATENCY_MS = 20
+
+
+def _twoPass(query):
+    organizers = [ndb.Key(Profile, conf.organizerUserId)
+                  for conf in query.iter(limit=PAGE_SIZE)]
+    profiles = ndb.get_multi(organizers)
+    names = dict((prof.key.id(), prof.displayName) for prof in profiles)
+    return [converters.to_message(conf, ConferenceForm,
+                organizerDisplayName=names[conf.organizerUserId],
+                seatsAvailable=conf.seatsAvailable)
+            for conf in query.iter(limit=PAGE_SIZE)]
+
+
+def _singlePass(api, query):
+    return api._conferenceFormsAsync(
+        query.iter(limit=PAGE_SIZE + 1, produce_cursors=True),
+        PAGE_SIZE).get_result()[0]
+
+
+def _cold(fn, *args):
+    # every run starts from an empty in-context cache
+    ndb.get_context().clear_cache()
+    return fn(*args)
+
+
+def main():
+    bed = harness.activate()
+    try:
+        profiles = [Profile(id='organizer%d' % i, displayName='Organizer %d' % i)
+                    for i in range(ORGANIZERS)]
+        ndb.put_multi(profiles)
+        confs = []
+        for i in range(CONFERENCES):
+            organizer = profiles[i % ORGANIZERS].key
+            confs.append(Conference(
+                parent=organizer, name='Conference %03d' % i,
+                organizerUserId=organizer.id(), seatsAvailable=100))
+        ndb.put_multi(confs)
+        harness.add_latency(LATENCY_MS)
+
+        query = Conference.query().order(Conference.name)
+        api = conference.ConferenceApi()
+        assert [f.organizerDisplayName for f in _cold(_twoPass, query)] == \
+            [f.organizerDisplayName for f in _cold(_singlePass, api, query)]
+
+        print '%d of %d conferences, %d organizers, %d ms per RPC, best of %d' % (
+            PAGE_SIZE, CONFERENCES, ORGANIZERS, LATENCY_MS, RUNS)
+        harness.report('two passes, blocking get_multi',
+                       *harness.best_of(RUNS, _cold, _twoPass, query))
+        harness.report('single pass, async organizer gets',
+                       *harness.best_of(RUNS, _cold, _singlePass, api, query))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
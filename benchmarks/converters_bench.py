@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""converters_bench.py -- converting 10k Sessions and Conferences to
+their forms, reflectively versus with the converters.py plans
+
+The reflective conversions are the _copySessionToForm and
+_copyConferenceToForm the API had, less the print of every Session:
+a walk over form.all_fields() with hasattr/getattr/setattr and name
+checks, per entity. No RPC is made; entities are built in memory.
+
+"""
+
+from datetime import date
+from datetime import time
+
+from benchmarks import harness
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+import converters
+
+ENTITIES = 10000
+RUNS = 3
+
+
+def _reflectiveConference(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == 'websafeKey':
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def _reflectiveSession(session):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name in ['startDate', 'startTime']:
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            elif field.name == 'duration':
+                setattr(sf, field.name, int(getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+    setattr(sf, 'sessionKey', str(session.key.urlsafe()))
+    sf.check_initialized()
+    return sf
+
+
+def _entities():
+    conf_key = ndb.Key(Conference, 1)
+    confs = [Conference(key=ndb.Key(Conference, i + 1), name='Conference %d' % i,
+                        description='About things', topics=['Web', 'Python'],
+                        city='Paris', startDate=date(2026, 5, 1),
+                        endDate=date(2026, 5, 3), month=5, maxAttendees=500,
+                        seatsAvailable=250)
+             for i in range(ENTITIES)]
+    sessions = [Session(key=ndb.Key(Session, i + 1), name='Session %d' % i,
+                        speaker='Jane Doe', typeOfSession='lecture',
+                        duration=45, startDate=date(2026, 5, 1),
+                        startTime=time(9, 30), highlights=['one', 'two'],
+                        conference=conf_key)
+                for i in range(ENTITIES)]
+    return confs, sessions
+
+
+def _convertAll(convert, entities):
+    return [convert(entity) for entity in entities]
+
+
+def main():
+    bed = harness.activate()
+    try:
+        confs, sessions = _entities()
+        print '%d entities of each kind, best of %d' % (ENTITIES, RUNS)
+        for label, convert, entities in (
+                ('Conference, reflective', _reflectiveConference, confs),
+                ('Conference, converters.to_message',
+                 lambda conf: converters.to_message(conf, ConferenceForm),
+                 confs),
+                ('Session, reflective', _reflectiveSession, sessions),
+                ('Session, converters.to_message',
+                 lambda session: converters.to_message(session, SessionForm),
+                 sessions)):
+            elapsed_ms, _ = harness.best_of(RUNS, _convertAll, convert, entities)
+            harness.report(label, elapsed_ms,
+                           us_per_entity='%.1f' % (elapsed_ms * 1000 / ENTITIES))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""facets_bench.py -- a queryConferences page with inequalities on three
+fields, from the facet index versus the datastore, at 100k conferences
+
+The datastore can only take one of the inequalities
+(maxAttendees > 100); without the facet index the others would be
+applied to the whole entities it returns, which then have to be sorted
+by name for the page. The facet index is measured loading (once per
+instance and RELOAD_INTERVAL) and warm.
+
+Takes the number of conferences as an optional argument:
+
+    python -m benchmarks.facets_bench 10000
+
+"""
+
+import random
+import sys
+
+from benchmarks import harness
+
+from google.appengine.ext import ndb
+
+from models import Conference
+import facets
+
+CONFERENCES = 100000
+PAGE_SIZE = 20
+PUT_BATCH_SIZE = 500
+FETCH_BATCH_SIZE = 1000
+LATENCY_MS = 10
+CITIES = ['City %d' % i for i in range(20)]
+TOPICS = ['Topic %d' % i for i in range(10)]
+FILTERS = [
+    {'field': 'maxAttendees', 'operator': '>', 'value': 100},
+    {'field': 'month', 'operator': '<', 'value': 6},
+    {'field': 'city', 'operator': '!=', 'value': CITIES[0]},
+]
+
+
+def _populate(count):
+    rand = random.Random(0)
+    for start in range(0, count, PUT_BATCH_SIZE):
+        ndb.put_multi([Conference(
+            name='Conference %06d' % i,
+            city=rand.choice(CITIES),
+            topics=rand.sample(TOPICS, rand.randint(1, 3)),
+            month=rand.randint(1, 12),
+            maxAttendees=rand.randint(10, 1000))
+            for i in range(start, min(start + PUT_BATCH_SIZE, count))])
+
+
+def _datastorePage():
+    matches = []
+    for conf in Conference.query(Conference.maxAttendees > 100).iter(
+            batch_size=FETCH_BATCH_SIZE):
+        if conf.month < 6 and conf.city != CITIES[0]:
+            matches.append(conf)
+    matches.sort(key=lambda conf: (conf.name, conf.key.urlsafe()))
+    return [conf.key for conf in matches[:PAGE_SIZE]]
+
+
+def _facetPage():
+    return facets.query(FILTERS, PAGE_SIZE)[0]
+
+
+def _coldFacetPage():
+    facets._index.loaded_at = None
+    return _facetPage()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else CONFERENCES
+    bed = harness.activate()
+    try:
+        _populate(count)
+        harness.add_latency(LATENCY_MS)
+        assert _datastorePage() == _coldFacetPage()
+
+        print '%d conferences, page of %d, %d ms per RPC' % (
+            count, PAGE_SIZE, LATENCY_MS)
+        harness.report('datastore, one inequality',
+                       *harness.best_of(1, _datastorePage))
+        harness.report('facet index, loading',
+                       *harness.best_of(1, _coldFacetPage))
+        harness.report('facet index, warm',
+                       *harness.best_of(5, _facetPage))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""handler_latency.py -- wall time of ConferenceApi handlers with their
+independent RPCs overlapped by tasklets, versus made one after another
+
+Every RPC takes LATENCY_MS, so a handler costs about as many latencies
+as it has RPCs in a row. The serial variants make the same lookups as
+the handlers, in the order the handlers made them before they were
+tasklets. The user id comes from memcache in both, as it does for most
+requests.
+
+"""
+
+import os
+
+from benchmarks import harness
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+import conference
+import identity
+import seats
+
+LATENCY_MS = 20
+RUNS = 5
+TOKEN = 'ya29.benchmark'
+USER_ID = 'organizer'
+
+
+def _newRequest():
+    # a new request on a warm instance: the user id is in memcache
+    identity.reset()
+    ndb.get_context().clear_cache()
+
+# - - - serial variants - - - - - - - - - - - - - - - - - - - -
+
+def _serialGetConference(api, request):
+    conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+    available = seats.get_seats_available(conf)
+    prof = conf.key.parent().get()
+    return api._copyConferenceToForm(conf, prof.displayName, available)
+
+
+def _serialGetConferencesCreated(api, request):
+    p_key = ndb.Key(Profile, identity.get_user_id())
+    confs = Conference.query(ancestor=p_key).fetch()
+    prof = p_key.get()
+    return [api._copyConferenceToForm(conf, prof.displayName)
+            for conf in confs]
+
+
+def _serialUpdateConference(api, request):
+    user_id = identity.get_user_id()
+    conf = api._updateConferenceObject(
+        ndb.Key(urlsafe=request.websafeConferenceKey), user_id,
+        api._conferenceChanges(request)).get_result()
+    prof = ndb.Key(Profile, user_id).get()
+    return api._copyConferenceToForm(conf, prof.displayName,
+                                     seats.get_seats_available(conf))
+
+
+def _serialCreateSession(api, request):
+    user_id = identity.get_user_id()
+    conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+    assert user_id == conf.organizerUserId
+    return api._createSessionObject(request)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _run(fn, *args):
+    _newRequest()
+    return fn(*args)
+
+
+def main():
+    bed = harness.activate()
+    backend = identity.set_tokeninfo_backend(identity.StubTokenInfo(
+        {TOKEN: {'user_id': USER_ID, 'expires_in': 3600}}))
+    try:
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = 'organizer@example.com'
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % TOKEN
+        p_key = Profile(id=USER_ID, displayName='Organizer').put()
+        # written before organizerDisplayName, so the Profile is read too
+        conf = seats.ensure_sharded(Conference(
+            parent=p_key, name='PyCon', organizerUserId=USER_ID,
+            maxAttendees=100, seatsAvailable=100).put().get())
+        wsck = conf.key.urlsafe()
+        identity.get_user_id()
+        harness.add_latency(LATENCY_MS)
+
+        api = conference.ConferenceApi()
+        sessions = iter(range(10 * RUNS))
+
+        def sessionRequest():
+            return conference.SESSION_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck, name='Session %d' % next(sessions),
+                speaker='Jane Doe', startDate='2026-05-01', startTime='09:00',
+                duration=45)
+
+        cases = [
+            ('getConference', api.getConference, _serialGetConference,
+             lambda: conference.CONF_GET_REQUEST.combined_message_class(
+                 websafeConferenceKey=wsck)),
+            ('getConferencesCreated', api.getConferencesCreated,
+             _serialGetConferencesCreated,
+             conference.CONF_LIST_REQUEST.combined_message_class),
+            ('updateConference', api.updateConference,
+             _serialUpdateConference,
+             lambda: conference.CONF_POST_REQUEST.combined_message_class(
+                 websafeConferenceKey=wsck, city='Paris')),
+            ('createSession', api.createSession, _serialCreateSession,
+             sessionRequest),
+        ]
+        print '%d ms per RPC, best of %d' % (
+            LATENCY_MS, RUNS)
+        for name, handler, serial, request in cases:
+            harness.report(name + ', serial',
+                           *harness.best_of(RUNS, lambda: _run(serial, api, request())))
+            harness.report(name + ', tasklets',
+                           *harness.best_of(RUNS, lambda: _run(handler, request())))
+    finally:
+        identity.set_tokeninfo_backend(backend)
+        identity.reset()
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""harness.py
+
+Udacity conference server-side Python App Engine benchmark harness
+
+$Id$
+
+Benchmarks run against the same testbed stubs as the tests (see
+tests/testbase.py) and print one line per measured variant: its wall
+time and the RPCs it made, by service, as counted by metrics.py's
+apiproxy hook. The stubs answer in microseconds, which hides what
+matters in production, so add_latency() can make every RPC of a
+service take a fixed time; RPCs issued together then overlap like real
+ones do, and wall time tells serial RPCs from concurrent ones.
+
+Run from the application directory, e.g.
+
+    python -m benchmarks.seat_contention
+
+"""
+
+import time
+
+from tests import testbase     # first: puts the SDK and lib/ on the path
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub_map
+
+import metrics
+
+DEFAULT_LATENCY_MS = 20
+SERVICES = ('datastore_v3', 'memcache', 'urlfetch', 'taskqueue')
+
+
+def activate():
+    """Activate fresh stubs; return the Testbed, to deactivate()."""
+    return testbase.activate()
+
+# - - - latency - - - - - - - - - - - - - - - - - - - - - - - -
+
+class _SlowRPC(apiproxy_rpc.RPC):
+    """An RPC answered no sooner than latency seconds after it was made;
+    waiting on one doesn't delay those made before it."""
+
+    latency = 0
+
+    def _MakeCallImpl(self):
+        self._ready = time.time() + self.latency
+        super(_SlowRPC, self)._MakeCallImpl()
+
+    def _WaitImpl(self):
+        time.sleep(max(0, self._ready - time.time()))
+        return super(_SlowRPC, self)._WaitImpl()
+
+
+class _SlowStub(object):
+    """Wraps a stub so that its RPCs take latency seconds."""
+
+    def __init__(self, stub, latency):
+        self._stub = stub
+        self._latency = latency
+
+    def __getattr__(self, name):
+        return getattr(self._stub, name)
+
+    def CreateRPC(self):
+        rpc = _SlowRPC(stub=self._stub)
+        rpc.latency = self._latency
+        return rpc
+
+    def MakeSyncCall(self, service, call, request, response):
+        time.sleep(self._latency)
+        self._stub.MakeSyncCall(service, call, request, response)
+
+
+def add_latency(ms=DEFAULT_LATENCY_MS, services=SERVICES):
+    """Make every RPC to services take ms milliseconds, until the
+    Testbed is deactivated."""
+    for service in services:
+        stub = apiproxy_stub_map.apiproxy.GetStub(service)
+        if stub is not None:
+            apiproxy_stub_map.apiproxy.ReplaceStub(
+                service, _SlowStub(stub, ms / 1000.0))
+
+# - - - measurements - - - - - - - - - - - - - - - - - - - - -
+
+def measure(fn, *args, **kwargs):
+    """Call fn(*args, **kwargs); return (result, elapsed ms, {service:
+    RPCs}) for the calls made from this thread."""
+    metrics._request.rpcs = {}
+    metrics._request.deferred = {}
+    start = time.time()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        elapsed_ms = (time.time() - start) * 1000
+        rpcs, metrics._request.rpcs = metrics._request.rpcs, None
+        metrics._request.deferred = None
+    return result, elapsed_ms, rpcs
+
+
+def best_of(runs, fn, *args, **kwargs):
+    """Return (elapsed ms, {service: RPCs}) of the fastest of runs calls."""
+    best = None
+    for _ in range(runs):
+        _, elapsed_ms, rpcs = measure(fn, *args, **kwargs)
+        if best is None or elapsed_ms < best[0]:
+            best = (elapsed_ms, rpcs)
+    return best
+
+
+def report(label, elapsed_ms, rpcs=None, **extra):
+    """Print one result line."""
+    line = '%-36s %9.1f ms' % (label, elapsed_ms)
+    if rpcs is not None:
+        line += '  rpcs: %3d %s' % (sum(rpcs.values()), ' '.join(
+            '%s=%d' % (service, count)
+            for service, count in sorted(rpcs.items())))
+    for name, value in sorted(extra.items()):
+        line += '  %s: %s' % (name, value)
+    print line
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""seat_contention.py -- registrations racing for the seats of one
+conference, with seatsAvailable on the Conference versus SeatShards
+
+USERS users register from THREADS threads at once, each in the
+registration transaction: the Registration plus one seat, taken from
+the Conference entity or from a SeatShard. Transactions that collide
+are retried by ndb; those still colliding after its retries fail, like
+a 500 to the client. Prints the attempts per registration, the failures
+and whether any seat was sold twice.
+
+"""
+
+import random
+import threading
+
+from benchmarks import harness
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Registration
+import registration
+import seats
+
+USERS = 200
+SEATS = 150
+THREADS = 20
+LATENCY_MS = 10
+
+
+class SoldOut(Exception):
+    pass
+
+
+def _unsharded(p_key, conf_key, attempts):
+    """The registration transaction with the seats on the Conference."""
+    attempts.append(1)
+    conf = conf_key.get()
+    if conf.seatsAvailable <= 0:
+        raise SoldOut()
+    conf.seatsAvailable -= 1
+    ndb.put_multi([conf, Registration(
+        key=registration.registration_key(p_key, conf_key),
+        conference=conf_key)])
+
+
+def _sharded(p_key, conf_key, attempts):
+    """The registration transaction with the seats on SeatShards."""
+    attempts.append(1)
+    conf = conf_key.get()
+    if not seats.claim_seat(conf):
+        raise SoldOut()
+    Registration(key=registration.registration_key(p_key, conf_key),
+                 conference=conf_key).put()
+
+
+def _run(label, txn, sharded):
+    bed = harness.activate()
+    try:
+        harness.add_latency(LATENCY_MS)
+        conf = Conference(name='Popular', maxAttendees=SEATS,
+                          seatsAvailable=SEATS)
+        conf.put()
+        if sharded:
+            conf = seats.ensure_sharded(conf)
+        p_keys = [ndb.Key(Profile, 'user%d' % i) for i in range(USERS)]
+        random.shuffle(p_keys)
+        attempts = []
+        outcome = {'registered': 0, 'sold_out': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not p_keys:
+                        return
+                    p_key = p_keys.pop()
+                try:
+                    ndb.transaction(lambda: txn(p_key, conf.key, attempts),
+                                    xg=True)
+                    result = 'registered'
+                except SoldOut:
+                    result = 'sold_out'
+                except datastore_errors.TransactionFailedError:
+                    result = 'failed'
+                with lock:
+                    outcome[result] += 1
+
+        def race():
+            threads = [threading.Thread(target=worker)
+                       for _ in range(THREADS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        _, elapsed_ms, _ = harness.measure(race)
+        if sharded:
+            left = sum(shard.seats for shard in ndb.get_multi(
+                seats._shardKeys(conf.key, conf.seatShards)))
+        else:
+            left = conf.key.get().seatsAvailable
+        registered = Registration.query().count()
+        harness.report(label, elapsed_ms,
+            attempts_per_txn='%.2f' % (float(len(attempts)) / USERS),
+            failed=outcome['failed'], registered=registered,
+            oversold=registered + left != SEATS)
+    finally:
+        bed.deactivate()
+
+
+def main():
+    print '%d users, %d seats, %d threads, %d ms per RPC' % (
+        USERS, SEATS, THREADS, LATENCY_MS)
+    _run('seatsAvailable on the Conference', _unsharded, False)
+    _run('%d SeatShards' % seats.NUM_SHARDS, _sharded, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Udacity conference server-side Python App Engine instance-local caching
+helpers shared by the API and the task handlers
+
+$Id$
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+_CACHES = {}    # TwoTierCache instances by namespace, for stats()
+
+
+class LocalLRUCache(object):
+    """LocalLRUCache -- bounded, TTL'd, thread-safe cache living in the
+    memory of a single instance. Entries are evicted least recently used
+    first once max_size is reached, and ignored once they are older than
+    their ttl (seconds)."""
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing/expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return default
+            # re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds (defaults to self.ttl)."""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop key from the cache, if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry and reset the hit/miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TwoTierCache(object):
+    """TwoTierCache -- LocalLRUCache in front of memcache, for hot keys
+    read by every instance on every request.
+
+    Values live in memcache under '<namespace>:<generation>:<key>'.
+    invalidate() bumps the namespace generation, orphaning every key at
+    once; set() and delete() update memcache directly. Each instance
+    keeps values, and the generation, for at most local_ttl seconds, so
+    writes made elsewhere are seen within local_ttl; with local_ttl=0
+    every read goes to memcache and is never stale.
+    """
+
+    def __init__(self, namespace, max_size=1000, local_ttl=5, ttl=0):
+        self.namespace = namespace
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.memcache_hits = 0
+        self.memcache_misses = 0
+        self._local = LocalLRUCache(max_size=max_size, ttl=local_ttl)
+        self._generation = None
+        self._generation_expires = 0
+        _CACHES[namespace] = self
+
+    def _genKey(self):
+        return self.namespace + ':gen'
+
+    def generation(self):
+        """Return the current generation of the namespace."""
+        if self._generation_expires < time.time():
+            gen = memcache.get(self._genKey())
+            if gen is None:
+                # start from the clock, so a generation evicted from
+                # memcache never brings back keys orphaned before
+                memcache.add(self._genKey(), int(time.time()))
+                gen = memcache.get(self._genKey()) or 0
+            self._generation = gen
+            self._generation_expires = time.time() + self.local_ttl
+        return self._generation
+
+    def memcache_key(self, key, generation=None):
+        """Return the memcache key holding key in generation (by default
+        the current one)."""
+        if generation is None:
+            generation = self.generation()
+        return '%s:%d:%s' % (self.namespace, generation, key)
+
+    def get(self, key, loader=None):
+        """Return the value of key, from the instance if possible and from
+        memcache otherwise. On a miss of both, return loader() (None
+        without a loader) and cache it unless it is None."""
+        gen = self.generation()
+        if self.local_ttl:
+            value = self._local.get((gen, key))
+            if value is not None:
+                return value
+        value = memcache.get(self.memcache_key(key, gen))
+        if value is not None:
+            self.memcache_hits += 1
+        else:
+            self.memcache_misses += 1
+            if loader is None:
+                return None
+            value = loader()
+            if value is None:
+                return None
+            # under the generation read before loading: if it was bumped
+            # meanwhile, the loaded value is orphaned rather than served
+            memcache.set(self.memcache_key(key, gen), value, self.ttl)
+        if self.local_ttl:
+            self._local.set((gen, key), value)
+        return value
+
+    def set(self, key, value):
+        """Store value under key in memcache and in this instance."""
+        memcache.set(self.memcache_key(key), value, self.ttl)
+        if self.local_ttl:
+            self._local.set((self.generation(), key), value)
+
+    def set_versioned(self, key, version, value, retries=5):
+        """Store (version, value) under key unless memcache already holds
+        a version at least as new. Writes go through compare-and-set, so
+        concurrent writers finishing out of order can't go back in time;
+        if every attempt loses a race, key is dropped instead."""
+        client = memcache.Client()
+        gen = self.generation()
+        mkey = self.memcache_key(key, gen)
+        for _ in range(retries):
+            cached = client.gets(mkey)
+            if cached is None:
+                if client.add(mkey, (version, value), self.ttl):
+                    break
+            elif cached[0] >= version:
+                return
+            elif client.cas(mkey, (version, value), self.ttl):
+                break
+        else:
+            client.delete(mkey)
+            return
+        if self.local_ttl:
+            self._local.set((gen, key), (version, value))
+
+    def delete(self, key):
+        """Drop key from memcache and from this instance."""
+        memcache.delete(self.memcache_key(key))
+        self._local.delete((self.generation(), key))
+
+    def invalidate(self):
+        """Orphan every key of the namespace by bumping its generation."""
+        self._generation = _bumpGeneration(self.namespace)
+        # re-read the generation on next use if memcache failed
+        self._generation_expires = \
+            time.time() + self.local_ttl if self._generation else 0
+
+    def stats(self):
+        """Return hit counts and ratios of both tiers; local figures are
+        those of this instance only."""
+        def tier(hits, misses):
+            total = hits + misses
+            return {'hits': hits, 'misses': misses,
+                    'hit_ratio': float(hits) / total if total else None}
+        return {
+            'generation': self._generation,
+            'local': tier(self._local.hits, self._local.misses),
+            'memcache': tier(self.memcache_hits, self.memcache_misses),
+        }
+
+
+def _bumpGeneration(namespace):
+    return memcache.incr(namespace + ':gen', initial_value=int(time.time()))
+
+
+def invalidate(namespace):
+    """Bump the generation of a TwoTierCache namespace, also from code
+    that doesn't hold the cache itself."""
+    if namespace in _CACHES:
+        _CACHES[namespace].invalidate()
+    else:
+        _bumpGeneration(namespace)
+
+
+def stats():
+    """Return {namespace: stats} for every TwoTierCache of the instance."""
+    return dict((namespace, cache.stats())
+                for namespace, cache in _CACHES.items())
@@ -13,21 +13,38 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+import bisect
 from datetime import datetime
-import json
-import os
-import time
+import hashlib
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
 from google.appengine.api import memcache
+from google.appengine.api import datastore_errors
 from google.appengine.api import taskqueue
-from google.appengine.api import urlfetch
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+import announcements
+import cache
+import converters
+import facets
+import fulltext
+import featured
+import identity
+import indexes
+import metrics
+import projections
+import registration
+import schedule
+import seats
+import speakers
+import sync
+
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
@@ -40,17 +57,42 @@ from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
+from models import Registration
+from models import RegistrationTicket
+from models import RegistrationStatusForm
 
 from models import Session, SessionForm, SessionForms, FeaturedSpeakerForm, FeaturedSpeakerMessage
+from models import SpeakerForm, SpeakerForms
+from models import SessionBatchForm, SessionResultForm, SessionResultForms
+from models import ScheduleForm
+from models import ChangesForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
+from settings import QUERY_CACHE_ENABLED
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+ORGANIZER_BATCH_SIZE = 100
+MAX_WISHLIST_SIZE = 100
+MEMCACHE_WISHLIST_PREFIX = 'wishlist:'
+WISHLIST_TTL = 600
+WISHLIST_LOCK = 10          # seconds a changed wishlist can't be re-cached
+MAX_SESSION_BATCH = 500
+SESSION_PUT_BATCH_SIZE = 100
+CONFERENCE_QUERY_TTL = 600
+
+# queryConferences pages, orphaned whenever a Conference changes (also see
+# seats.sync_conference: seat counts may trail by SYNC_INTERVAL seconds);
+# no local tier, so a page orphaned by one instance is never served
+_conferenceQueries = cache.TwoTierCache(Conference._get_kind(), local_ttl=0,
+    ttl=CONFERENCE_QUERY_TTL)
+QUERY_CACHE_HITS = metrics.Counter('queryConferences:cacheHits')
+QUERY_CACHE_MISSES = metrics.Counter('queryConferences:cacheMisses')
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -92,9 +134,32 @@ SESSION_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSION_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2),
+)
+
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fields=messages.StringField(1),
+)
+
 SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speakerName=messages.StringField(2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    cursor=messages.StringField(4),
+)
+
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionBatchForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SPEAKER_FIND_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1),
 )
 
 
@@ -107,6 +172,7 @@ TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     sessionType=messages.StringField(2),
+    fields=messages.StringField(3),
 )
 
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
@@ -118,39 +184,53 @@ HIGHLIGHT_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     highlight=messages.StringField(2),
+    fields=messages.StringField(3),
 )
 
 DATE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     conferenceDate=messages.StringField(2),
+    fields=messages.StringField(3),
+)
+
+REGISTRATION_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    requestId=messages.StringField(1),
+)
+
+CHANGES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    kind=messages.StringField(1),
+    since=messages.StringField(2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    cursor=messages.StringField(4),
+)
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    cursor=messages.StringField(3),
 )
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
 def _getUserId():
-    """A workaround implementation for getting userid."""
-    auth = os.getenv('HTTP_AUTHORIZATION')
-    bearer, token = auth.split()
-    token_type = 'id_token'
-    if 'OAUTH_USER_ID' in os.environ:
-        token_type = 'access_token'
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-           % (token_type, token))
-    user = {}
-    wait = 1
-    for i in range(3):
-        resp = urlfetch.fetch(url)
-        if resp.status_code == 200:
-            user = json.loads(resp.content)
-            break
-        elif resp.status_code == 400 and 'invalid_token' in resp.content:
-            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                   % ('access_token', token))
-        else:
-            time.sleep(wait)
-            wait = wait + i
-    return user.get('user_id', '')
+    """Return the user id of the current request (see identity.py)."""
+    return identity.get_user_id()
+
+
+def _getUserIdAsync():
+    """Return a future for the user id of the current request."""
+    return identity.get_user_id_async()
+
+
+def _forgetWishlist(user_id):
+    """Drop the cached wishlist of user_id, and keep readers that loaded
+    it before the change from caching it again for WISHLIST_LOCK
+    seconds (they cache with add())."""
+    memcache.delete(MEMCACHE_WISHLIST_PREFIX + user_id, seconds=WISHLIST_LOCK)
 
 
 @endpoints.api(name='conference', version='v1', audiences=[ANDROID_AUDIENCE],
@@ -161,22 +241,72 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName=None, seatsAvailable=None,
+                              fields=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return converters.to_message(conf, ConferenceForm, fields,
+            organizerDisplayName=displayName, seatsAvailable=seatsAvailable)
+
+
+    def _parseFields(self, fields, message_cls):
+        """Return the message_cls fields a list request selects (see
+        projections.py); bail if it names unknown ones."""
+        try:
+            return projections.parse_fields(fields, message_cls)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+
+    @ndb.tasklet
+    def _conferenceFormsAsync(self, source, page_size=None, fields=None):
+        """Render conferences to ConferenceForm objects in a single pass.
+
+        source is either a QueryIterator (read once, at most page_size
+        results) or a list of Conferences or Conference futures. Conferences carry their
+        organizer's display name; only for those written before it was
+        denormalized is a Profile get started, once per distinct organizer
+        and as soon as its first conference arrives. Forms only hold
+        fields, when given, and seats and organizers are only looked up
+        when selected.
+        Returns (forms, next_cursor).
+        """
+        confs = []
+        organizers = {}
+        wanted = lambda name: fields is None or name in fields
+
+        def _collect(conf):
+            if conf is None:
+                return
+            confs.append(conf)
+            if not wanted('organizerDisplayName') or conf.organizerDisplayName:
+                return
+            p_key = ndb.Key(Profile, conf.organizerUserId)
+            if p_key not in organizers:
+                organizers[p_key] = p_key.get_async()
+
+        next_cursor = None
+        if hasattr(source, 'has_next_async'):
+            while (page_size is None or len(confs) < page_size) and \
+                    (yield source.has_next_async()):
+                _collect(source.next())
+            if page_size and confs and source.probably_has_next():
+                next_cursor = source.cursor_after().urlsafe()
+        else:
+            for conf in source:
+                if isinstance(conf, ndb.Future):
+                    conf = yield conf
+                _collect(conf)
+
+        available = {}
+        if wanted('seatsAvailable'):
+            available = seats.get_seats_available_multi(confs)
+        profiles = yield organizers.values()
+        names = dict((prof.key.id(), prof.displayName) for prof in profiles if prof)
+        raise ndb.Return(
+            [self._copyConferenceToForm(c,
+                names.get(c.organizerUserId) if organizers else None,
+                available.get(c.key), fields) for c in confs],
+            next_cursor)
 
 
     def _createConferenceObject(self, request):
@@ -186,6 +316,8 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = _getUserId()
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get_async()
 
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
@@ -193,7 +325,6 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -213,17 +344,25 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
-        # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
+        # generate Conference ID based on Profile key
+        # get Conference key from ID
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            getattr(prof.get_result(), 'displayName', None) or user.nickname()
+        data['seatShards'] = seats.NUM_SHARDS
+
+        # create Conference (seats first, spread over shards), send email
+        # to organizer confirming creation & return (modified) ConferenceForm
+        ndb.put_multi(seats.create_shards(c_key, data['seatsAvailable']))
+        conf = Conference(**data)
+        conf.put()
+        cache.invalidate(Conference._get_kind())
+        facets.record_change(c_key)
+        fulltext.enqueue(c_key)
+        announcements.seats_changed(conf, conf.seatsAvailable)
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
@@ -231,22 +370,35 @@ class ConferenceApi(remote.Service):
         return request
 
 
-    @ndb.transactional()
-    def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = _getUserId()
+    def _conferenceChanges(self, request):
+        """Return {field: value} of the Conference fields a ConferenceForm
+        sets, with dates converted."""
+        changes = {}
+        for field in request.all_fields():
+            if field.name == 'organizerDisplayName':
+                # kept in sync with the organizer's Profile
+                continue
+            data = getattr(request, field.name)
+            # only copy fields where we get data
+            if data not in (None, []):
+                # special handling for dates (convert string to Date)
+                if field.name in ('startDate', 'endDate'):
+                    data = datetime.strptime(data, "%Y-%m-%d").date()
+                    if field.name == 'startDate':
+                        changes['month'] = data.month
+                changes[field.name] = data
+        return changes
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+    @metrics.transactional_tasklet('conference.updateConference')
+    def _updateConferenceObject(self, conf_key, user_id, changes):
+        """Apply changes to the Conference conf_key owned by user_id;
+        return a future for the updated Conference."""
+        conf = yield conf_key.get_async()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % conf_key.urlsafe())
 
         # check that user is owner
         if user_id != conf.organizerUserId:
@@ -254,25 +406,31 @@ class ConferenceApi(remote.Service):
                 'Only the owner can update the conference.')
 
         # Not getting all the fields, so don't create a new object; just
-        # copy relevant fields from ConferenceForm to Conference object
-        for field in request.all_fields():
-            data = getattr(request, field.name)
-            # only copy fields where we get data
-            if data not in (None, []):
-                # special handling for dates (convert string to Date)
-                if field.name in ('startDate', 'endDate'):
-                    data = datetime.strptime(data, "%Y-%m-%d").date()
-                    if field.name == 'startDate':
-                        conf.month = data.month
-                # write to Conference object
-                setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # copy relevant fields onto the Conference object
+        maxAttendees = conf.maxAttendees
+        for name, data in changes.items():
+            if name == 'seatsAvailable' and conf.seatShards:
+                # owned by the seat shards, see maxAttendees below
+                continue
+            setattr(conf, name, data)
+        yield conf.put_async()
+        delta = (conf.maxAttendees or 0) - (maxAttendees or 0)
+
+        def _afterCommit():
+            if conf.seatShards and delta:
+                # seats follow maxAttendees once the update is committed
+                seats.adjust_seats(conf.key, conf.seatShards, delta)
+            cache.invalidate(Conference._get_kind())
+            facets.record_change(conf.key)
+            fulltext.enqueue(conf.key)
+            announcements.seats_changed(conf, seats.get_seats_available(conf))
+        ndb.get_context().call_on_commit(_afterCommit)
+        raise ndb.Return(conf)
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @metrics.instrument
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -281,71 +439,118 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @metrics.instrument
+    @ndb.toplevel
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        # authorize and parse outside of the transaction
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id_future = _getUserIdAsync()
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        changes = self._conferenceChanges(request)
+        user_id = yield user_id_future
+
+        conf = yield self._updateConferenceObject(conf_key, user_id, changes)
+        conf_future = ndb.Future()
+        conf_future.set_result(conf)
+        available = seats.get_seats_available_async(conf_key, conf_future)
+        prof = None
+        if not conf.organizerDisplayName:
+            prof, available = yield ndb.Key(Profile, user_id).get_async(), available
+        else:
+            available = yield available
+        raise ndb.Return(self._copyConferenceToForm(conf,
+            getattr(prof, 'displayName', None), available))
 
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @metrics.instrument
+    @ndb.toplevel
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # get Conference object from request, and the seats available
+        # alongside it; bail if not found
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf_future = conf_key.get_async()
+        available = seats.get_seats_available_async(conf_key, conf_future)
+        conf = yield conf_future
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        prof = None
+        if not conf.organizerDisplayName:
+            # written before the organizer name was denormalized
+            prof, available = yield conf_key.parent().get_async(), available
+        else:
+            available = yield available
 
-        print str(prof)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        raise ndb.Return(self._copyConferenceToForm(conf,
+            getattr(prof, 'displayName', None), available))
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @metrics.instrument
+    @ndb.toplevel
     def getConferencesCreated(self, request):
-        """Return conferences created by user."""
+        """Return conferences created by user, with the fields selected."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
+        fields = self._parseFields(request.fields, ConferenceForm)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, _getUserId()))
-        prof = ndb.Key(Profile, _getUserId()).get()
+        p_key = ndb.Key(Profile, (yield _getUserIdAsync()))
+        query = Conference.query(ancestor=p_key)
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
-
-
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+        items, _ = yield projections.run_async(ConferenceForm, fields,
+            lambda **options: self._conferenceFormsAsync(
+                query.iter(**options), fields=fields),
+            'getConferencesCreated')
+        raise ndb.Return(ConferenceForms(items=items))
+
+
+    def _getQuery(self, inequality_filter, filters):
+        """Return the datastore query for the formatted filters, or None
+        when it would need a composite index that index.yaml lacks.
+
+        Conferences are returned in name order, after the inequality
+        field if there is one. Filtered queries need a composite index
+        (equality fields, inequality field, name); those the app's
+        filters use are declared in index.yaml, others are left to the
+        facet index. The key is always the last sort order so that page
+        cursors are stable on ties.
+        """
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
+        equality = set(f["field"] for f in filters if f["operator"] == "=")
+        ordered = [(inequality_filter, 'asc')] if inequality_filter else []
+        ordered.append(('name', 'asc'))
+        if filters and not indexes.has_composite(Conference._get_kind(),
+                equality, ordered):
+            return None
+        if inequality_filter:
             q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        q = q.order(Conference.name, Conference.key)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
 
 
     def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters.
+        Returns the fields with inequality filters, in order of
+        appearance, and the formatted filters."""
         formatted_filters = []
-        inequality_field = None
+        inequality_fields = []
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -356,60 +561,113 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value of '%s' must be a number." % filtr["field"])
+
+            # Every operation except "=" is an inequality; the datastore
+            # allows them on one field only, more go to the facet index
+            if filtr["operator"] != "=" and filtr["field"] not in inequality_fields:
+                inequality_fields.append(filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return (inequality_fields, formatted_filters)
+
+
+    def _queryCacheKey(self, filters, page_size, cursor, fields):
+        """Return the cache key of a queryConferences page: its filters in
+        canonical order, the page size, the cursor and the fields."""
+        canonical = set((filtr["field"], filtr["operator"], filtr["value"])
+                        for filtr in filters)
+        return hashlib.sha1(repr(
+            (sorted(canonical), page_size, cursor or '',
+             sorted(fields or [])))).hexdigest()
+
+
+    def _queryConferencesPage(self, query, page_size, cursor, filters, fields):
+        # render the page, fetching organiser displayNames as results arrive
+        equality = [f["field"] for f in filters if f["operator"] == "="]
+        shape = 'queryConferences(%s)' % ', '.join(sorted(
+            set('%s %s' % (f["field"], f["operator"]) for f in filters)))
+        items, next_cursor = projections.run_async(ConferenceForm, fields,
+            lambda **options: self._conferenceFormsAsync(
+                query.iter(limit=page_size + 1, start_cursor=cursor,
+                           produce_cursors=True, **options),
+                page_size, fields),
+            shape, equality).get_result()
+        return ConferenceForms(items=items, nextCursor=next_cursor)
+
+
+    def _queryFacets(self, filters, page_size, cursor, fields):
+        """Serve a query the datastore can't, or couldn't without another
+        composite index, from the facet index."""
+        try:
+            keys, next_cursor = facets.query(filters, page_size, cursor)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid cursor: %s' % cursor)
+        items, _ = self._conferenceFormsAsync(
+            ndb.get_multi_async(keys), fields=fields).get_result()
+        return ConferenceForms(items=items, nextCursor=next_cursor)
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @metrics.instrument
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        """Query for conferences, one page at a time, with the fields
+        selected. Filter combinations without a composite index, such
+        as inequalities on several fields, are answered in name order
+        from the facet index, which may trail writes by a few seconds."""
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        fields = self._parseFields(request.fields, ConferenceForm)
+        inequality_fields, filters = self._formatFilters(request.filters)
+        query = None
+        if len(inequality_fields) < 2:
+            query = self._getQuery(
+                inequality_fields[0] if inequality_fields else None, filters)
+        if query is None:
+            # not cached: the facet index may trail the latest changes
+            return self._queryFacets(filters, page_size, request.cursor, fields)
+
+        try:
+            cursor = Cursor(urlsafe=request.cursor) if request.cursor else None
+        except Exception:
+            raise endpoints.BadRequestException(
+                'Invalid cursor: %s' % request.cursor)
+        if not QUERY_CACHE_ENABLED:
+            return self._queryConferencesPage(query, page_size, cursor,
+                                              filters, fields)
+
+        missed = []
+        def _load():
+            missed.append(True)
+            return protojson.encode_message(self._queryConferencesPage(
+                query, page_size, cursor, filters, fields))
+
+        page = _conferenceQueries.get(
+            self._queryCacheKey(filters, page_size, request.cursor, fields),
+            loader=_load)
+        # counted in the memcache RPC that records the call's metrics
+        metrics.defer_incr(
+            (QUERY_CACHE_MISSES if missed else QUERY_CACHE_HITS).name)
+        return protojson.decode_message(ConferenceForms, page)
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        # registrations are kept as Registration children of the Profile
+        return converters.to_message(prof, ProfileForm,
+            conferenceKeysToAttend=[
+                key.urlsafe() for key in registration.conference_keys(prof)])
 
 
     def _getProfileFromUser(self):
@@ -442,6 +700,7 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
 
         # if saveProfile(), process user-modifyable fields
+        displayName = prof.displayName
         if save_request:
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
@@ -453,6 +712,11 @@ class ConferenceApi(remote.Service):
                         #else:
                         #    setattr(prof, field, val)
                         prof.put()
+            if prof.displayName != displayName:
+                # copy the new name onto the user's conferences
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_name'
+                )
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -460,6 +724,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @metrics.instrument
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -467,180 +732,226 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @metrics.instrument
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 
-# - - - Announcements - - - - - - - - - - - - - - - - - - - -
-
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    def _updateOrganizerDisplayName(user_id, cursor=None):
+        """Copy Profile displayName onto one batch of the user's conferences;
+        used by the update_organizer_name task. Returns the cursor of the
+        next batch, or None when done.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        p_key = ndb.Key(Profile, user_id)
+        start = Cursor(urlsafe=cursor) if cursor else None
+        keys, next_cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            ORGANIZER_BATCH_SIZE, start_cursor=start, keys_only=True)
+
+        @metrics.transactional('conference.updateOrganizerDisplayName')
+        def _rename():
+            # all of the user's conferences share the Profile entity group
+            prof = p_key.get()
+            if not prof:
+                return
+            confs = [conf for conf in ndb.get_multi(keys)
+                     if conf and conf.organizerDisplayName != prof.displayName]
+            for conf in confs:
+                conf.organizerDisplayName = prof.displayName
+            ndb.put_multi(confs)
+
+        if keys:
+            _rename()
+            cache.invalidate(Conference._get_kind())
+        return next_cursor.urlsafe() if more and next_cursor else None
 
-        return announcement
 
+# - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @metrics.instrument
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return StringMessage(data=announcements.get_announcement())
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/put',
             http_method='GET', name='putAnnouncement')
+    @metrics.instrument
     def putAnnouncement(self, request):
         """Put Announcement into memcache"""
-        return StringMessage(data=self._cacheAnnouncement())
+        return StringMessage(data=announcements.refresh())
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
+    @ndb.tasklet
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
-
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf_future = ndb.Key(urlsafe=wsck).get_async()
+        # get user Profile (possibly creating it) outside of the transaction
+        prof = self._getProfileFromUser()
+        conf = yield conf_future
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # seats are held by SeatShards, so the Conference isn't rewritten
+        conf = seats.ensure_sharded(conf)
+        result = yield self._registrationTransaction(prof.key, wsck, conf, reg)
+        raise ndb.Return(result)
+
+
+    @metrics.transactional_tasklet('conference.registration', xg=True)
+    def _registrationTransaction(self, p_key, wsck, conf, reg):
+        """Write the user's Registration for conf and one SeatShard of conf."""
+        retval = None
+        reg_key = registration.registration_key(p_key, conf.key)
+        prof, registered = yield p_key.get_async(), reg_key.get_async()
+        # profiles not migrated yet still list conferences themselves
+        legacy = wsck in prof.conferenceKeysToAttend
+
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if legacy or registered:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # take away one seat, if any is available
+            claimed = yield seats.claim_seat_async(conf)
+            if not claimed:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            # register user
+            yield Registration(key=reg_key, conference=conf.key).put_async()
             retval = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if legacy or registered:
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
+                writes = [reg_key.delete_async(), seats.release_seat_async(conf)]
+                if legacy:
+                    prof.conferenceKeysToAttend.remove(wsck)
+                    writes.append(prof.put_async())
+                yield writes
                 retval = True
             else:
                 retval = False
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        raise ndb.Return(BooleanMessage(data=retval))
+
+
+    def _copyTicketToForm(self, ticket):
+        """Copy relevant fields from RegistrationTicket to RegistrationStatusForm."""
+        return converters.to_message(ticket, RegistrationStatusForm)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationStatusForm,
+            path='conference/{websafeConferenceKey}/registrations',
+            http_method='POST', name='requestRegistration')
+    @metrics.instrument
+    def requestRegistration(self, request):
+        """Queue registration of user for selected conference; the outcome
+        is available from getRegistrationStatus."""
+        prof = self._getProfileFromUser() # get user Profile
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        ticket = registration.enqueue(prof.key.id(), conf.key)
+        return self._copyTicketToForm(ticket)
+
+
+    @endpoints.method(REGISTRATION_GET_REQUEST, RegistrationStatusForm,
+            path='registration/{requestId}',
+            http_method='GET', name='getRegistrationStatus')
+    @metrics.instrument
+    def getRegistrationStatus(self, request):
+        """Return status of a queued registration (by requestId)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        ticket = ndb.Key(RegistrationTicket, request.requestId).get()
+        if not ticket or ticket.userId != _getUserId():
+            raise endpoints.NotFoundException(
+                'No registration request found with id: %s' % request.requestId)
+        return self._copyTicketToForm(ticket)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @metrics.instrument
     def getConferencesToAttend(self, request):
-        """Get list of conferences that user has registered for."""
+        """Get list of conferences that user has registered for, with the
+        fields selected."""
+        fields = self._parseFields(request.fields, ConferenceForm)
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conf_keys = registration.conference_keys(prof)
+        # gets by key, which can't be projected
+        conferences = ndb.get_multi_async(conf_keys)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        items, _ = self._conferenceFormsAsync(
+            conferences, fields=fields).get_result()
+        return ConferenceForms(items=items)
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @metrics.instrument
+    @ndb.toplevel
     def registerForConference(self, request):
         """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        result = yield self._conferenceRegistration(request)
+        raise ndb.Return(result)
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @metrics.instrument
+    @ndb.toplevel
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        result = yield self._conferenceRegistration(request, reg=False)
+        raise ndb.Return(result)
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, session):
+    def _copySessionToForm(self, session, fields=None):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        print str(session)
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name in ['startDate', 'startTime'] :
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                elif field.name == 'duration':
-                    setattr(sf, field.name, int(getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-        if type(session) is Session:
-            # if Session object
-            setattr(sf, 'sessionKey', str(session.key.urlsafe()))
-        else:
-            # if request
-            setattr(sf, 'sessionKey', str(session.sessionKey))
-        sf.check_initialized()
-        return sf
+        return converters.to_message(session, SessionForm, fields)
 
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
+    def _fetchSessions(self, query, fields, shape, equality=()):
+        """Return the Sessions of a conference query finds, projected on
+        the fields selected when possible."""
+        return projections.run_async(SessionForm, fields, query.fetch_async,
+            shape, ('conference',) + tuple(equality)).get_result()
+
+    def _sessionFromForm(self, form, conf_key):
+        """Validate a SessionForm and return the (unsaved) Session for it."""
 
-        if not request.name or not request.speaker:
+        if not form.name or not speakers.normalize(form.speaker):
             raise endpoints.BadRequestException("Session 'name' and 'speaker' fields required")
 
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        data['conference'] = ndb.Key(urlsafe=request.websafeConferenceKey)
-        del data['websafeConferenceKey']
+        data = {field.name: getattr(form, field.name) for field in SessionForm.all_fields()}
+        data['conference'] = conf_key
         del data['sessionKey']
 
         # convert dates from strings
@@ -660,16 +971,33 @@ class ConferenceApi(remote.Service):
         except Exception:
             raise ValueError("'duration' needed. Has to be an integer (minutes) and cannot be void")
 
-        # creation of Session & return (modified) SessionForm
-        new_key = Session(**data).put()
-
-        taskqueue.add(params={'conferenceKey': request.websafeConferenceKey,
-            'speaker': data['speaker']},
-            url='/tasks/get_featured_speaker'
-        )
+        return Session(**data)
+
+    def _afterSessionsCreated(self, sessions):
+        """Record new sessions of one conference under their speakers and
+        enqueue the featured speaker and search index updates, in bulk."""
+        wsck = sessions[0].conference.urlsafe()
+        speakers.add_sessions(sessions)
+        tasks = []
+        for name in set(speakers.normalize(s.speaker) for s in sessions):
+            tasks.append(taskqueue.Task(params={'conferenceKey': wsck,
+                'speaker': name},
+                url='/tasks/get_featured_speaker'
+            ))
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+        fulltext.enqueue_multi([session.key for session in sessions])
+        schedule.rebuild_later(sessions[0].conference)
 
-        request.sessionKey = new_key.urlsafe()
-        return self._copySessionToForm(request)
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
+        # creation of Session & return SessionForm
+        session = self._sessionFromForm(request,
+            ndb.Key(urlsafe=request.websafeConferenceKey))
+        session.put()
+        self._afterSessionsCreated([session])
+        return self._copySessionToForm(session)
 
     def _get_sessions_in_a_conference(self, websafe_key):
         """Given a request with a websafeConferenceKey, returns all the sessions in the Conference"""
@@ -689,84 +1017,209 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm, path='sessions/create/{websafeConferenceKey}',
         http_method='POST', name='createSession')
+    @metrics.instrument
+    @ndb.toplevel
     def createSession(self, request):
         """Create new session for a conference."""
 
+        yield self._checkConferenceOwnerAsync(request.websafeConferenceKey)
+        raise ndb.Return(self._createSessionObject(request))
+
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionResultForms,
+            path='sessions/import/{websafeConferenceKey}',
+            http_method='POST', name='createSessions')
+    @metrics.instrument
+    def createSessions(self, request):
+        """Create many sessions for a conference at once, reporting the
+        outcome of each; invalid items don't stop the others."""
+        conf = self._checkConferenceOwner(request.websafeConferenceKey)
+        if len(request.items) > MAX_SESSION_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per call.' % MAX_SESSION_BATCH)
+
+        # validate everything before writing anything
+        results = []
+        valid = []
+        for i, form in enumerate(request.items):
+            result = SessionResultForm(index=i, created=False)
+            results.append(result)
+            try:
+                valid.append((result, self._sessionFromForm(form, conf.key)))
+            except (ValueError, endpoints.BadRequestException,
+                    datastore_errors.BadValueError) as e:
+                result.error = str(e)
+
+        created = []
+        for i in range(0, len(valid), SESSION_PUT_BATCH_SIZE):
+            chunk = valid[i:i + SESSION_PUT_BATCH_SIZE]
+            try:
+                keys = ndb.put_multi([session for _, session in chunk])
+            except datastore_errors.Error as e:
+                for result, _ in chunk:
+                    result.error = 'Not saved: %s' % e
+                continue
+            for (result, session), key in zip(chunk, keys):
+                result.created = True
+                result.sessionKey = key.urlsafe()
+                created.append(session)
+
+        if created:
+            self._afterSessionsCreated(created)
+        return SessionResultForms(items=results, created=len(created))
+
+    @ndb.tasklet
+    def _checkConferenceOwnerAsync(self, websafe_key):
+        """Return a future for the Conference, if the current user
+        organizes it."""
         # check if user is authorized
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # check if user is conference organizer
-        user_id = _getUserId()
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # check if user is conference organizer; the user id and the
+        # Conference are looked up at the same time
+        user_id, conf = yield (_getUserIdAsync(),
+            ndb.Key(urlsafe=websafe_key).get_async())
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafe_key)
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can create a session for this conference.')
+        raise ndb.Return(conf)
+
+    def _checkConferenceOwner(self, websafe_key):
+        """Return the Conference, if the current user organizes it."""
+        return self._checkConferenceOwnerAsync(websafe_key).get_result()
+
+    @endpoints.method(CONF_GET_REQUEST, ScheduleForm,
+            path='conference/{websafeConferenceKey}/schedule',
+            http_method='GET', name='getConferenceSchedule')
+    @metrics.instrument
+    def getConferenceSchedule(self, request):
+        """Return all the sessions of a conference grouped by date and ordered
+        by start time, from a cached schedule document"""
+        try:
+            conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'Invalid conference key: %s' % request.websafeConferenceKey)
+        form = None
+        if conf_key.kind() == Conference._get_kind():
+            form = schedule.get_schedule(conf_key)
+        if not form:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        return form
 
-        return self._createSessionObject(request)
-
-    @endpoints.method(SESSION_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_LIST_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}',
             http_method='GET', name='getConferenceSessions')
+    @metrics.instrument
     def getConferenceSessions(self, request):
         """Given a conference, return all sessions (by websafeConferenceKey)."""
-        sessions = self._get_sessions_in_a_conference(request.websafeConferenceKey).fetch()
+        fields = self._parseFields(request.fields, SessionForm)
+        sessions = self._fetchSessions(
+            self._get_sessions_in_a_conference(request.websafeConferenceKey),
+            fields, 'getConferenceSessions')
         if not sessions:
             return SessionForms(
                 items=[]
             )
         # return SessionForm
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session, fields) for session in sessions]
         )
 
     @endpoints.method(SPEAKER_GET_REQUEST, SessionForms,
             path='sessions/by/speaker/{speakerName}',
             http_method='GET', name='getSessionsBySpeaker')
+    @metrics.instrument
     def getSessionsBySpeaker(self, request):
-        """Given a speaker, returns all the sessions with that speaker"""
-        sessions = Session.get_sessions_by_speaker(request.speakerName).fetch()
-        if not sessions:
+        """Given a speaker, returns a page of the sessions with that speaker;
+        names are matched regardless of case and spacing"""
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        # the cursor is the key of the last session of the previous page
+        try:
+            after = ndb.Key(urlsafe=request.cursor) if request.cursor else None
+        except Exception:
+            raise endpoints.BadRequestException(
+                'Invalid cursor: %s' % request.cursor)
+        if not speakers.normalize(request.speakerName):
+            raise endpoints.BadRequestException("'speakerName' required")
+        keys = sorted(speakers.session_keys(request.speakerName))
+        if not keys:
             raise endpoints.NotFoundException(
                 'No sessions for this speaker or wrong speaker name: %s' % request.speakerName)
+        start = bisect.bisect_right(keys, after) if after else 0
+        page = keys[start:start + page_size]
+        next_cursor = None
+        if start + page_size < len(keys):
+            next_cursor = page[-1].urlsafe()
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session)
+                   for session in ndb.get_multi(page) if session],
+            nextCursor=next_cursor
         )
 
+    @endpoints.method(SPEAKER_FIND_REQUEST, SpeakerForms,
+            path='speakers',
+            http_method='GET', name='findSpeakers')
+    @metrics.instrument
+    def findSpeakers(self, request):
+        """Return the speakers whose name starts with prefix, regardless of
+        case"""
+        if not speakers.normalize(request.prefix):
+            raise endpoints.BadRequestException("'prefix' field required")
+        return SpeakerForms(items=[
+            SpeakerForm(name=speaker.name, sessionCount=sum(
+                len(entry.sessions) for entry in speaker.conferences))
+            for speaker in speakers.find(request.prefix, MAX_PAGE_SIZE)])
+
     @endpoints.method(TYPE_GET_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}/type/{sessionType}',
             http_method='GET', name='getConferenceSessionsByType')
+    @metrics.instrument
     def getConferenceSessionsByType(self, request):
         """Given a ConferenceKey and a sessionType, returns all the sessions of that type"""
+        fields = self._parseFields(request.fields, SessionForm)
         try:
-            sessions = self._get_sessions_in_a_conference(request.websafeConferenceKey).filter(Session.typeOfSession == request.sessionType).fetch()
-        except Exception:
+            query = self._get_sessions_in_a_conference(request.websafeConferenceKey).filter(Session.typeOfSession == request.sessionType)
+        except datastore_errors.BadValueError:
             # if type value is not among model's choices
             raise endpoints.NotFoundException(
                 'BadValueError: string must be of one of the given sessionType: %s' % request.sessionType)
+        sessions = self._fetchSessions(query, fields,
+            'getConferenceSessionsByType', ['typeOfSession'])
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session, fields) for session in sessions]
         )
 
     @endpoints.method(HIGHLIGHT_GET_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}/by/highlights/{highlight}',
             http_method='GET', name='getConferenceSessionsByHighlight')
+    @metrics.instrument
     def getConferenceSessionsByHighlight(self, request):
         """Get all the sessions in a Conference with the given highlight"""
         highlight = request.highlight
-        sessions = Session.query(Session.conference == ndb.Key(urlsafe=request.websafeConferenceKey)).filter(Session.highlights == highlight).fetch()
+        fields = self._parseFields(request.fields, SessionForm)
+        sessions = self._fetchSessions(
+            Session.query(Session.conference == ndb.Key(urlsafe=request.websafeConferenceKey)).filter(Session.highlights == highlight),
+            fields, 'getConferenceSessionsByHighlight', ['highlights'])
         if not sessions:
             raise endpoints.NotFoundException(
                 'No sessions with this conference/highlights couple: %s' % request.sessionType)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session, fields) for session in sessions]
         )
 
     @endpoints.method(DATE_GET_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}/by/date/{conferenceDate}',
             http_method='GET', name='getConferenceSessionsByDate')
+    @metrics.instrument
     def getConferenceSessionsByDate(self, request):
         """Get all the session for a Conference in a given date, order by startTime"""
         try:
@@ -775,18 +1228,22 @@ class ConferenceApi(remote.Service):
             # if date value is formatted wrongly
             raise endpoints.NotFoundException(
                 'Date has to be formatted Y-m-d: %s' % request.conferenceDate)
-        sessions = Session.query(Session.conference == ndb.Key(urlsafe=request.websafeConferenceKey)).filter(Session.startDate == date).order(Session.startTime).fetch()
+        fields = self._parseFields(request.fields, SessionForm)
+        sessions = self._fetchSessions(
+            Session.query(Session.conference == ndb.Key(urlsafe=request.websafeConferenceKey)).filter(Session.startDate == date).order(Session.startTime),
+            fields, 'getConferenceSessionsByDate', ['startDate'])
         if not sessions:
             raise endpoints.NotFoundException(
                 'No sessions in this day for this conference: %s' % date)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session, fields) for session in sessions]
         )
 
     @endpoints.method(SESSION_GET_REQUEST, FeaturedSpeakerMessage, path='conference/{websafeConferenceKey}/featuredSpeaker',
             http_method='GET', name='getFeaturedSpeaker')
+    @metrics.instrument
     def getFeaturedSpeaker(self, request):
-        """Get featured speaker of a given conference, using Memcache"""
+        """Get featured speakers of a given conference, using Memcache"""
 
         def _copyFeaturedToForm(data):
             """Copy relevant fields from Session to SessionForm."""
@@ -796,54 +1253,171 @@ class ConferenceApi(remote.Service):
             speaker_form.check_initialized()
             return speaker_form
 
-        mem_key = request.websafeConferenceKey + ':featured'
-        if memcache.get(mem_key) is None:
-            # there is no featured speaker for this conference so return a void structure
-            return FeaturedSpeakerMessage(featured=[], websafeKey=request.websafeConferenceKey)
-
-        data = memcache.get(mem_key)
-        print data
+        data = featured.get_featured(request.websafeConferenceKey)
+        metrics.log_sample('featuredSpeaker', conference=request.websafeConferenceKey,
+            speakers=len(data))
         return FeaturedSpeakerMessage(
             featured=[_copyFeaturedToForm(d) for d in data],
             websafeKey=request.websafeConferenceKey
         )
 
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _searchKeys(self, index_name, request):
+        """Return (keys, next cursor) of a page of full-text search results."""
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        try:
+            return fulltext.search_keys(index_name, request.query, page_size,
+                request.cursor)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+    @endpoints.method(SEARCH_GET_REQUEST, ConferenceForms,
+            path='conference/search',
+            http_method='GET', name='searchConferences')
+    @metrics.instrument
+    def searchConferences(self, request):
+        """Search conference names and descriptions, best matches first;
+        'word*' matches words starting with word."""
+        keys, next_cursor = self._searchKeys(fulltext.CONFERENCE_INDEX, request)
+        items, _ = self._conferenceFormsAsync(
+            ndb.get_multi_async(keys)).get_result()
+        return ConferenceForms(items=items, nextCursor=next_cursor)
+
+    @endpoints.method(SEARCH_GET_REQUEST, SessionForms,
+            path='sessions/search',
+            http_method='GET', name='searchSessions')
+    @metrics.instrument
+    def searchSessions(self, request):
+        """Search session names, highlights and speakers, best matches
+        first; 'word*' matches words starting with word."""
+        keys, next_cursor = self._searchKeys(fulltext.SESSION_INDEX, request)
+        return SessionForms(
+            items=[self._copySessionToForm(session)
+                   for session in ndb.get_multi(keys) if session],
+            nextCursor=next_cursor
+        )
+
+# - - - Delta sync - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(CHANGES_GET_REQUEST, ChangesForm,
+            path='changes/{kind}',
+            http_method='GET', name='changesSince')
+    @metrics.instrument
+    def changesSince(self, request):
+        """Return a page of the Conferences or Sessions (kind) written or
+        deleted after the watermark 'since' (see sync.py). Once there is
+        no nextCursor, sync from the watermark returned next time."""
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        try:
+            entities, deleted, next_cursor, watermark = sync.changes(
+                request.kind, request.since, page_size, request.cursor)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        conferences, sessions = [], []
+        if request.kind == Conference._get_kind():
+            conferences, _ = self._conferenceFormsAsync(entities).get_result()
+        else:
+            sessions = [self._copySessionToForm(session) for session in entities]
+        return ChangesForm(conferences=conferences, sessions=sessions,
+            deleted=[key.urlsafe() for key in deleted],
+            nextCursor=next_cursor, watermark=watermark)
+
+
 # - - - User's Wishlist - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+    def _wishlistKeys(self, prof):
+        """Return the Session keys in the Profile's wishlist, in order."""
+        keys = list(prof.sessionWishlist)
+        # websafe keys stored before the wishlist held typed keys
+        for wssk in prof.sessionKeysWishlist:
+            key = ndb.Key(urlsafe=wssk)
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+
+    @metrics.transactional('conference.updateWishlist')
+    def _updateWishlist(self, p_key, session_key, add=True):
+        """Add session_key to or remove it from the Profile's wishlist;
+        return False if there was nothing to remove."""
+        prof = p_key.get()
+        keys = self._wishlistKeys(prof)
+        if add:
+            if session_key in keys:
+                raise endpoints.NotFoundException(
+                    'Session already in the wishlist')
+            if len(keys) >= MAX_WISHLIST_SIZE:
+                raise ConflictException(
+                    'The wishlist is full (%d sessions)' % MAX_WISHLIST_SIZE)
+            keys.append(session_key)
+        elif session_key in keys:
+            keys.remove(session_key)
+        else:
+            return False
+        prof.sessionWishlist = keys
+        prof.sessionKeysWishlist = []
+        prof.put()
+        # the only invalidation: once committed, for WISHLIST_LOCK seconds
+        ndb.get_context().call_on_commit(lambda: _forgetWishlist(p_key.id()))
+        return True
+
+
+    def _getSessionKey(self, websafeSessionKey):
+        """Return the Session key for websafeSessionKey; bail if invalid."""
+        try:
+            key = ndb.Key(urlsafe=websafeSessionKey)
+        except Exception:
+            key = None
+        if not key or key.kind() != Session._get_kind():
+            raise endpoints.NotFoundException(
+                'This key is not a Session instance: %s' % websafeSessionKey)
+        return key
+
+
     @endpoints.method(WISHLIST_POST_REQUEST, BooleanMessage, path='wishlist/add/{websafeSessionKey}',
             http_method='POST', name='addSessionToWishlist')
+    @metrics.instrument
     def addSessionToWishlist(self, request):
         """Add a Session to user's wishlist"""
-        # check if user
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
         # get the profile
         prof = self._getProfileFromUser() # get user Profile
-        sessionKey = request.websafeSessionKey
+        sessionKey = self._getSessionKey(request.websafeSessionKey)
 
         # check if key is a Session
-        if not type(ndb.Key(urlsafe=sessionKey).get()) == Session:
+        if not sessionKey.get():
             raise endpoints.NotFoundException(
-                'This key is not a Session instance: %s' % sessionKey)
+                'This key is not a Session instance: %s' % request.websafeSessionKey)
 
         # add session to wishlist
-        if sessionKey not in prof.sessionKeysWishlist:
-            try:
-                prof.sessionKeysWishlist.append(sessionKey)
-                prof.put()
-            except Exception:
-                raise endpoints.InternalServerErrorException(
-                    'Error in storing the wishlist')
-        else:
-            raise endpoints.NotFoundException(
-                    'Session already in the wishlist')
+        try:
+            self._updateWishlist(prof.key, sessionKey)
+        except endpoints.ServiceException:
+            raise
+        except Exception:
+            raise endpoints.InternalServerErrorException(
+                'Error in storing the wishlist')
 
         return BooleanMessage(data=True)
 
+    @endpoints.method(WISHLIST_POST_REQUEST, BooleanMessage, path='wishlist/remove/{websafeSessionKey}',
+            http_method='DELETE', name='removeSessionFromWishlist')
+    @metrics.instrument
+    def removeSessionFromWishlist(self, request):
+        """Remove a Session from user's wishlist"""
+        prof = self._getProfileFromUser() # get user Profile
+        sessionKey = self._getSessionKey(request.websafeSessionKey)
+
+        removed = self._updateWishlist(prof.key, sessionKey, add=False)
+        return BooleanMessage(data=removed)
+
     @endpoints.method(message_types.VoidMessage, SessionForms, path='wishlist/get',
             http_method='GET', name='getSessionsInWishlist')
+    @metrics.instrument
     def getSessionsInWishlist(self, request):
         """Get user's wishlist"""
         # check if user
@@ -851,13 +1425,22 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
+        # served from memcache until the wishlist changes
+        cache_key = MEMCACHE_WISHLIST_PREFIX + _getUserId()
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return protojson.decode_message(SessionForms, cached)
+
         # query for the wishlist of the user
         prof = self._getProfileFromUser() # get user Profile
-        sessions = prof.sessionKeysWishlist
+        sessions = ndb.get_multi(self._wishlistKeys(prof))
 
-        return SessionForms(
-            items=[self._copySessionToForm(ndb.Key(urlsafe=session).get()) for session in sessions]
+        forms = SessionForms(
+            items=[self._copySessionToForm(session) for session in sessions if session]
         )
+        # add(), not set(): fails while a change holds the key locked
+        memcache.add(cache_key, protojson.encode_message(forms), WISHLIST_TTL)
+        return forms
 
 
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""converters.py
+
+Udacity conference server-side Python App Engine model to ProtoRPC
+message converters
+
+$Id$
+
+Each (model, message) pair gets one conversion function, built at import
+time: the fields both sides share are resolved up front together with
+their formatting (dates and times to strings, stored names to enum
+values), so converting an entity is a run over a precomputed plan
+instead of reflecting over form.all_fields() for every entity. A
+converter can also be limited to some fields, e.g. for projected
+entities, which lack the others (see projections.py).
+
+"""
+
+from operator import attrgetter
+
+from google.appengine.ext import ndb
+from protorpc import messages
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import RegistrationTicket
+from models import RegistrationStatusForm
+from models import Session
+from models import SessionForm
+
+_CONVERTERS = {}
+
+
+def _formatter(prop, field):
+    """Return the function formatting values of prop for field, or None
+    when values can be copied as they are."""
+    if isinstance(field, messages.EnumField):
+        enum = field.type
+        return lambda value: getattr(enum, value)
+    if isinstance(prop, ndb.DateTimeProperty) and \
+            isinstance(field, messages.StringField):
+        # also covers DateProperty and TimeProperty
+        return str
+    if field.repeated:
+        return list
+    if isinstance(field, messages.IntegerField):
+        return int
+    return None
+
+
+def register(model_cls, message_cls, **computed):
+    """Build and register the converter of model_cls entities to
+    message_cls; computed maps field names to functions of the entity for
+    fields without a matching property. Returns the converter."""
+    plan = []
+    for field in message_cls.all_fields():
+        if field.name in computed:
+            plan.append((field.name, computed[field.name], None))
+        elif field.name in model_cls._properties:
+            prop = model_cls._properties[field.name]
+            plan.append((field.name, attrgetter(prop._code_name),
+                         _formatter(prop, field)))
+    plan = tuple(plan)
+
+    def convert(entity, fields=None, **overrides):
+        """Return a message_cls holding the fields of entity, or only
+        those in fields; overrides that aren't None take precedence over
+        the entity's values."""
+        values = {}
+        for name, get, fmt in plan:
+            if fields is not None and name not in fields:
+                continue
+            value = get(entity)
+            if value is None or value == []:
+                continue
+            values[name] = fmt(value) if fmt else value
+        for name, value in overrides.iteritems():
+            if value is not None and (fields is None or name in fields):
+                values[name] = value
+        return message_cls(**values)
+
+    _CONVERTERS[(model_cls, message_cls)] = convert
+    return convert
+
+
+def to_message(entity, message_cls, fields=None, **overrides):
+    """Convert entity, or only its fields, to message_cls with the
+    registered converter."""
+    return _CONVERTERS[(type(entity), message_cls)](entity, fields,
+                                                      **overrides)
+
+
+def _urlsafeKey(entity):
+    return entity.key.urlsafe()
+
+
+register(Conference, ConferenceForm, websafeKey=_urlsafeKey)
+register(Session, SessionForm, sessionKey=_urlsafeKey)
+register(Profile, ProfileForm)
+register(RegistrationTicket, RegistrationStatusForm,
+         requestId=lambda ticket: ticket.key.id(),
+         websafeConferenceKey=lambda ticket: ticket.conference.urlsafe())
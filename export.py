@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Udacity conference server-side Python App Engine bulk export
+
+$Id$
+
+An export job dumps every Conference, Session and Registration, in that
+order, as NDJSON or CSV. Each /tasks/export run reads one batch of
+EXPORT_BATCH_SIZE entities from the cursor the ExportJob holds, writes
+it out as one self-contained chunk, e.g. '<job>/session-00003.csv', and
+advances the job and enqueues the next run in one transaction. A run
+never holds more than one batch, whatever the size of the datastore,
+and a retried or duplicated run rewrites the same chunk and then finds
+the job already advanced. The last run writes '<job>/manifest.json',
+listing the chunks.
+
+Chunks go to Google Cloud Storage, through the cloudstorage client
+library vendored under lib/ (see appengine_config.py). Tests and local
+runs can write them to a directory instead; see set_storage().
+
+"""
+
+import csv
+import json
+import logging
+import os
+import tempfile
+import uuid
+from cStringIO import StringIO
+from datetime import datetime
+
+from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ExportJob
+from models import Registration
+from models import Session
+import metrics
+
+try:
+    import cloudstorage
+except ImportError:
+    raise ImportError('export.py needs the Cloud Storage client library, '
+                      'vendored under lib/: pip install -t lib -r '
+                      'requirements-vendor.txt')
+
+EXPORT_BATCH_SIZE = 500
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'json': 'application/json',
+}
+LOCAL_EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'conference-exports')
+
+# kinds in export order, with their columns; 'key' is the websafe key
+# and 'userId' the id of the parent Profile
+COLUMNS = (
+    (Conference, ('key', 'name', 'description', 'organizerUserId',
+                  'topics', 'city', 'startDate', 'endDate', 'month',
+                  'maxAttendees', 'seatsAvailable', 'modified')),
+    (Session, ('key', 'conference', 'name', 'speaker', 'typeOfSession',
+               'startDate', 'startTime', 'duration', 'highlights',
+               'modified')),
+    (Registration, ('key', 'userId', 'conference', 'created')),
+)
+KINDS = [model._get_kind() for model, _ in COLUMNS]
+
+_COMPUTED = {
+    'key': lambda entity: entity.key,
+    'userId': lambda entity: entity.key.parent().id(),
+}
+
+# - - - storage - - - - - - - - - - - - - - - - - - - - - - - -
+
+class CloudStorage(object):
+    """CloudStorage -- chunks kept as objects of a Cloud Storage bucket,
+    the app's default bucket unless given"""
+
+    def __init__(self, bucket=None):
+        self.bucket = bucket
+
+    def write(self, name, data, content_type):
+        bucket = self.bucket or app_identity.get_default_gcs_bucket_name()
+        with cloudstorage.open('/%s/exports/%s' % (bucket, name), 'w',
+                               content_type=content_type) as f:
+            f.write(data)
+
+
+class LocalStorage(object):
+    """LocalStorage -- chunks kept as files under a directory; for tests
+    and local runs"""
+
+    def __init__(self, root=LOCAL_EXPORT_DIR):
+        self.root = root
+
+    def write(self, name, data, content_type):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+_storage = CloudStorage()
+
+
+def set_storage(storage):
+    """Replace the chunk storage, e.g. with a LocalStorage in tests."""
+    global _storage
+    _storage = storage
+
+# - - - chunks - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _value(entity, column):
+    """Return the JSON-ready value of column for entity."""
+    if column in _COMPUTED:
+        value = _COMPUTED[column](entity)
+    else:
+        value = getattr(entity, column)
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return _plain(value)
+
+
+def _plain(value):
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if hasattr(value, 'isoformat'):
+        # datetime, date and time
+        return value.isoformat()
+    return value
+
+
+def _csvCell(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = u';'.join(unicode(v) for v in value)
+    return unicode(value).encode('utf-8')
+
+
+def _chunk(entities, columns, fmt):
+    """Return entities as an NDJSON or CSV (with header) chunk."""
+    out = StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for entity in entities:
+            writer.writerow([_csvCell(_value(entity, column))
+                             for column in columns])
+    else:
+        for entity in entities:
+            out.write(json.dumps(dict((column, _value(entity, column))
+                                      for column in columns)))
+            out.write('\n')
+    return out.getvalue()
+
+
+def chunk_name(job_id, kind, n, fmt):
+    return '%s/%s-%05d.%s' % (job_id, kind.lower(), n, fmt)
+
+# - - - jobs - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _enqueue(job_id, transactional=False):
+    taskqueue.add(params={'job': job_id}, url='/tasks/export',
+                  transactional=transactional)
+
+
+def start(fmt='ndjson'):
+    """Create an ExportJob writing fmt ('ndjson' or 'csv') chunks and
+    enqueue its first run; return the job. Raises ValueError for
+    unknown formats."""
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format: %s' % fmt)
+    job = ExportJob(id=uuid.uuid4().hex, format=fmt, kind=KINDS[0],
+                    chunks={})
+    job.put()
+    _enqueue(job.key.id())
+    return job
+
+
+def _manifest(job_id, fmt, chunks, rows):
+    return json.dumps({
+        'job': job_id,
+        'format': fmt,
+        'rows': rows,
+        'chunks': [chunk_name(job_id, kind, n, fmt)
+                   for kind in KINDS for n in range(chunks.get(kind, 0))],
+    }, indent=2)
+
+
+@metrics.transactional('export.advance')
+def _advance(job_key, kind, n, next_cursor, chunks, rows):
+    """Move the job past chunk n of kind, now that it is written, and
+    enqueue its next run; return the job, or None if another run
+    already did."""
+    job = job_key.get()
+    if job.status != 'RUNNING' or job.kind != kind or \
+            (job.chunks or {}).get(kind, 0) != n:
+        return None
+    job.chunks = chunks
+    job.rows = rows
+    job.cursor = next_cursor
+    if not next_cursor:
+        i = KINDS.index(kind) + 1
+        job.kind = KINDS[i] if i < len(KINDS) else None
+    if job.kind:
+        _enqueue(job_key.id(), transactional=True)
+    else:
+        job.status = 'DONE'
+        job.finished = datetime.utcnow()
+    job.put()
+    return job
+
+
+def run(job_id):
+    """Export the next batch of job job_id."""
+    job = ndb.Key(ExportJob, job_id).get()
+    if not job or job.status != 'RUNNING':
+        return
+    model, columns = COLUMNS[KINDS.index(job.kind)]
+    start_cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=start_cursor)
+    next_cursor = next_cursor.urlsafe() if more and next_cursor else None
+
+    chunks = dict(job.chunks or {})
+    n = chunks.get(job.kind, 0)
+    if entities:
+        _storage.write(chunk_name(job_id, job.kind, n, job.format),
+                       _chunk(entities, columns, job.format),
+                       CONTENT_TYPES[job.format])
+        chunks[job.kind] = n + 1
+    rows = job.rows + len(entities)
+    last = not next_cursor and job.kind == KINDS[-1]
+    if last:
+        # written before the job is done, so that a failure is retried
+        _storage.write('%s/manifest.json' % job_id,
+                       _manifest(job_id, job.format, chunks, rows),
+                       CONTENT_TYPES['json'])
+    if _advance(job.key, job.kind, n, next_cursor, chunks, rows) and last:
+        logging.info('Export %s done: %d rows', job_id, rows)
+
+
+def status(job_id):
+    """Return the progress of job job_id as a dict, or None."""
+    job = ndb.Key(ExportJob, job_id).get()
+    if not job:
+        return None
+    return {
+        'job': job_id,
+        'format': job.format,
+        'status': job.status,
+        'kind': job.kind,
+        'rows': job.rows,
+        'chunks': job.chunks or {},
+        'created': _plain(job.created),
+        'finished': _plain(job.finished),
+    }
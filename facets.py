@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Udacity conference server-side Python App Engine in-memory conference
+facet index
+
+$Id$
+
+Serves the queryConferences filter combinations the datastore can't,
+such as inequalities on several fields. Each instance holds the
+queryable fields of every Conference, loaded with projection queries,
+as one column per field: a dictionary from each value to the bitmap (a
+Python long, bit n for row n) of the conferences holding it. Integer
+columns also keep their values sorted, so a range is a bisect away. A
+filter is the union of the bitmaps of the values it matches, which also
+gives repeated properties (topics) the datastore's "any value matches"
+semantics, and a query the intersection of its filters.
+
+record_change() appends changed conference keys to a change log in
+memcache. Instances apply it at most every REFRESH_INTERVAL seconds and
+reload everything when they fell behind the CHANGE_LOG_SIZE entries
+kept, or every RELOAD_INTERVAL seconds regardless. The first load is
+done by the warmup request (see warm()); reloads build a new table while
+queries are answered from the old one.
+
+"""
+
+import base64
+import binascii
+import bisect
+import json
+import operator
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+
+FACET_FIELDS = ('city', 'topics', 'month', 'maxAttendees')
+INTEGER_FIELDS = ('month', 'maxAttendees')
+LOAD_BATCH_SIZE = 1000
+REFRESH_INTERVAL = 5        # seconds between change log reads
+RELOAD_INTERVAL = 3600      # seconds between full reloads
+CHANGE_LOG_SIZE = 1000      # changes an instance may fall behind
+CHANGE_LOG_TTL = 3600
+MEMCACHE_FACETS_PREFIX = 'facets:'
+
+_SEQ_KEY = MEMCACHE_FACETS_PREFIX + 'seq'
+_COMPARE = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+
+def _changeKey(seq):
+    return '%schange:%d' % (MEMCACHE_FACETS_PREFIX, seq)
+
+
+def record_change(conf_key):
+    """Publish that Conference conf_key was created, updated or deleted."""
+    seq = memcache.incr(_SEQ_KEY, initial_value=0)
+    if seq:
+        memcache.set(_changeKey(seq), conf_key.urlsafe(), CHANGE_LOG_TTL)
+
+
+def _bitmap(rows):
+    """Return the bitmap of rows, built in one pass: or-ing the rows in
+    one at a time would copy the whole long for each of them."""
+    if not rows:
+        return 0
+    octets = bytearray(max(rows) // 8 + 1)
+    for row in rows:
+        octets[row >> 3] |= 1 << (row & 7)
+    octets.reverse()
+    return long(binascii.hexlify(octets), 16)
+
+
+def _scan(projection):
+    """Yield every Conference, projected."""
+    cursor, more = None, True
+    while more:
+        results, cursor, more = Conference.query().fetch_page(
+            LOAD_BATCH_SIZE, start_cursor=cursor, projection=projection)
+        for conf in results:
+            yield conf
+
+
+class _Column(object):
+    """_Column -- value to bitmap of the rows holding it, for one field"""
+
+    def __init__(self, integer=False):
+        self.bitmaps = {}
+        self.values = [] if integer else None    # sorted, integers only
+
+    def fill(self, value_rows):
+        """Set the bitmaps of an empty column from {value: [rows]}."""
+        for value, rows in value_rows.iteritems():
+            self.bitmaps[value] = _bitmap(rows)
+        if self.values is not None:
+            self.values = sorted(self.bitmaps)
+
+    def add(self, value, bit):
+        if value not in self.bitmaps:
+            self.bitmaps[value] = 0
+            if self.values is not None:
+                bisect.insort(self.values, value)
+        self.bitmaps[value] |= bit
+
+    def remove(self, value, bit):
+        bitmap = self.bitmaps[value] & ~bit
+        if bitmap:
+            self.bitmaps[value] = bitmap
+        else:
+            del self.bitmaps[value]
+            if self.values is not None:
+                self.values.remove(value)
+
+    def _matching(self, op, value):
+        """Return the values v of the column for which 'v op value'."""
+        if self.values is None:
+            compare = _COMPARE[op]
+            return [v for v in self.bitmaps if compare(v, value)]
+        values = self.values
+        if op == '>':
+            return values[bisect.bisect_right(values, value):]
+        if op == '>=':
+            return values[bisect.bisect_left(values, value):]
+        if op == '<':
+            return values[:bisect.bisect_left(values, value)]
+        if op == '<=':
+            return values[:bisect.bisect_right(values, value)]
+        return [v for v in values if v != value]
+
+    def match(self, op, value):
+        """Return the bitmap of the rows holding a value v for which
+        'v op value'."""
+        if op == '=':
+            return self.bitmaps.get(value, 0)
+        bitmap = 0
+        for v in self._matching(op, value):
+            bitmap |= self.bitmaps[v]
+        return bitmap
+
+
+class _Table(object):
+    """_Table -- the facet columns of a set of conferences"""
+
+    def __init__(self):
+        self.columns = dict((field, _Column(field in INTEGER_FIELDS))
+                            for field in FACET_FIELDS)
+        self.rows = {}          # websafe Conference key -> row
+        self.fields = []        # row -> {field: [values]}
+        self.sort_keys = []     # row -> (name, websafe key)
+        self.free = []          # rows of dropped conferences, for reuse
+        self.alive = 0          # bitmap of the rows in use
+
+    @classmethod
+    def load(cls):
+        """Return the table of every Conference. topics is projected on
+        its own: a projection on a repeated property returns nothing for
+        the entities where it is empty."""
+        table = cls()
+        single = [field for field in FACET_FIELDS if field != 'topics']
+        for conf in _scan([Conference.name] +
+                          [Conference._properties[f] for f in single]):
+            wsck = conf.key.urlsafe()
+            fields = dict((field, [getattr(conf, field)]) for field in single)
+            fields['topics'] = []
+            table.rows[wsck] = len(table.fields)
+            table.fields.append(fields)
+            table.sort_keys.append((conf.name, wsck))
+        # one result per value of topics
+        for conf in _scan([Conference.topics]):
+            row = table.rows.get(conf.key.urlsafe())
+            if row is not None:     # else created since the first scan
+                table.fields[row]['topics'].extend(conf.topics)
+        value_rows = dict((field, {}) for field in FACET_FIELDS)
+        for row, fields in enumerate(table.fields):
+            for field, values in fields.iteritems():
+                for value in set(values):
+                    if value is not None:
+                        value_rows[field].setdefault(value, []).append(row)
+        for field, column in table.columns.iteritems():
+            column.fill(value_rows[field])
+        table.alive = (1 << len(table.fields)) - 1
+        return table
+
+    def put(self, wsck, name, fields):
+        self.drop(wsck)
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = len(self.fields)
+            self.fields.append(None)
+            self.sort_keys.append(None)
+        bit = 1 << row
+        for field, values in fields.items():
+            for value in set(values):
+                if value is not None:
+                    self.columns[field].add(value, bit)
+        self.rows[wsck] = row
+        self.fields[row] = fields
+        self.sort_keys[row] = (name, wsck)
+        self.alive |= bit
+
+    def drop(self, wsck):
+        row = self.rows.pop(wsck, None)
+        if row is None:
+            return
+        bit = 1 << row
+        for field, values in self.fields[row].items():
+            for value in set(values):
+                if value is not None:
+                    self.columns[field].remove(value, bit)
+        self.fields[row] = self.sort_keys[row] = None
+        self.free.append(row)
+        self.alive &= ~bit
+
+    def match(self, filters):
+        """Return the sorted (name, websafe key) of the conferences
+        matching every filter."""
+        bitmap = self.alive
+        for filtr in filters:
+            if not bitmap:
+                break
+            bitmap &= self.columns[filtr['field']].match(
+                filtr['operator'], filtr['value'])
+        bits = bin(bitmap)[:1:-1]
+        return sorted(self.sort_keys[row]
+                      for row, bit in enumerate(bits) if bit == '1')
+
+
+class _FacetIndex(object):
+    """_FacetIndex -- the _Table of every Conference, kept up to date"""
+
+    def __init__(self):
+        self.lock = threading.Lock()            # guards table and seq
+        self._loading = threading.Lock()
+        self.table = _Table()
+        self.loaded_at = None
+        self.checked_at = 0
+        self.seq = 0
+        self._missing = None
+
+    def load(self):
+        """Rebuild the table from the datastore. The lock is held only
+        to swap the new table in, so queries keep being answered from
+        the old one meanwhile; a load already under way is not repeated,
+        but waited for when there is no table to answer from yet."""
+        loaded = self.loaded_at is not None
+        if not self._loading.acquire(not loaded):
+            return
+        try:
+            if loaded or self.loaded_at is None:
+                # changes logged while loading are applied again afterwards
+                seq = memcache.get(_SEQ_KEY) or 0
+                table = _Table.load()
+                with self.lock:
+                    self.table, self.seq, self._missing = table, seq, None
+                    self.loaded_at = self.checked_at = time.time()
+        finally:
+            self._loading.release()
+
+    def _apply(self, wscks):
+        """Re-read the conferences wscks from the datastore."""
+        confs = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in wscks])
+        for wsck, conf in zip(wscks, confs):
+            if conf is None:
+                self.table.drop(wsck)
+            else:
+                self.table.put(wsck, conf.name, dict(
+                    (field, conf.topics if field == 'topics'
+                     else [getattr(conf, field)]) for field in FACET_FIELDS))
+
+    def refresh(self):
+        """Catch up with the change log; return False when that's not
+        possible and the table needs reloading. Call with the lock
+        held."""
+        now = time.time()
+        if now < self.checked_at + REFRESH_INTERVAL:
+            return True
+        seq = memcache.get(_SEQ_KEY) or 0
+        if seq < self.seq or seq - self.seq > CHANGE_LOG_SIZE:
+            # the log was evicted or we fell too far behind
+            return False
+        wanted = range(self.seq + 1, seq + 1)
+        entries = memcache.get_multi([_changeKey(n) for n in wanted])
+        changed = []
+        for n in wanted:
+            wsck = entries.get(_changeKey(n))
+            if wsck is None:
+                # the entry may not be written yet; if it still isn't by
+                # the next refresh, it was evicted
+                if self._missing == n:
+                    return False
+                self._missing = n
+                break
+            changed.append(wsck)
+            self.seq = n
+        self._apply(list(set(changed)))
+        self.checked_at = now
+        return True
+
+    def query(self, filters):
+        """Return the sorted (name, websafe key) of the conferences
+        matching every filter."""
+        if self.loaded_at is None or \
+                time.time() > self.loaded_at + RELOAD_INTERVAL:
+            self.load()
+        with self.lock:
+            if self.refresh():
+                return self.table.match(filters)
+        self.load()
+        with self.lock:
+            return self.table.match(filters)
+
+_index = _FacetIndex()
+
+
+def _encodeToken(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(sort_key))
+
+
+def _decodeToken(token):
+    try:
+        name, wsck = json.loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: %s' % token)
+    return (name, wsck)
+
+
+def query(filters, page_size, cursor=None):
+    """Return (Conference keys, next cursor) for the page of conferences
+    matching filters, as formatted by ConferenceApi._formatFilters, in
+    name order. cursor is the one returned for the previous page; raises
+    ValueError when it is invalid."""
+    after = _decodeToken(cursor) if cursor else None
+    matches = _index.query(filters)
+    start = bisect.bisect_right(matches, after) if after else 0
+    page = matches[start:start + page_size]
+    next_cursor = None
+    if start + page_size < len(matches):
+        next_cursor = _encodeToken(page[-1])
+    return [ndb.Key(urlsafe=wsck) for name, wsck in page], next_cursor
+
+
+def warm():
+    """Load the index of this instance unless it has one already; for
+    warmup requests, so that no user request waits for it."""
+    if _index.loaded_at is None:
+        _index.load()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""featured.py
+
+Udacity conference server-side Python App Engine featured speakers
+
+$Id$
+
+A speaker is featured in a conference when they give more than one of
+its sessions, as listed by their Speaker entity (see speakers.py). The
+featured speakers of each conference are stored in a FeaturedSpeakers
+entity, updated by the /tasks/get_featured_speaker task in a transaction
+that also reads the Speaker, and mirrored in a TwoTierCache keyed by the
+websafe Conference key. The cached copy carries the entity version and
+is only ever replaced by a newer version (TwoTierCache.set_versioned),
+so concurrent tasks can't lose each other's updates, and it is rebuilt
+from the entity whenever it has been evicted. Instances serve their
+local copy for up to FEATURED_LOCAL_TTL seconds.
+
+"""
+
+from google.appengine.ext import ndb
+
+from cache import TwoTierCache
+from models import FeaturedSpeakers
+import metrics
+import speakers
+
+FEATURED_TTL = 36000
+FEATURED_LOCAL_TTL = 10
+
+_featured = TwoTierCache('featured', local_ttl=FEATURED_LOCAL_TTL,
+                         ttl=FEATURED_TTL)
+
+
+@ndb.non_transactional
+def _sessionNames(s_keys):
+    return [session.name for session in ndb.get_multi(s_keys) if session]
+
+
+def _entry(conf_key, speaker):
+    """Return the featured entry of speaker in conference conf_key, or None
+    if they don't give more than one of its sessions."""
+    found = speakers.speaker_key(speaker).get()
+    s_keys = found.session_keys(conf_key) if found else []
+    if len(s_keys) < 2:
+        return None
+    return {'speaker': found.name, 'sessions': _sessionNames(s_keys)}
+
+
+@metrics.transactional('featured.store', xg=True)
+def _store(wsck, speaker):
+    """Recompute the entry of speaker, in normalized form, in the
+    conference's FeaturedSpeakers; return the updated entity. The Speaker
+    is read in the transaction, so an update that commits later never
+    stores an older view of the speaker's sessions."""
+    key = ndb.Key(FeaturedSpeakers, wsck)
+    state = key.get() or FeaturedSpeakers(key=key)
+    entry = _entry(ndb.Key(urlsafe=wsck), speaker)
+    featured = list(state.speakers or [])
+    for i, s in enumerate(featured):
+        if speakers.normalize(s['speaker']) == speaker:
+            if entry:
+                featured[i] = entry
+            else:
+                del featured[i]
+            break
+    else:
+        if entry:
+            featured.append(entry)
+    state.speakers = featured
+    state.version += 1
+    state.put()
+    return state
+
+
+def _cache(wsck, state):
+    _featured.set_versioned(wsck, state.version, state.speakers or [])
+
+
+def update_speaker(wsck, speaker):
+    """Recompute whether speaker is featured in conference wsck."""
+    _cache(wsck, _store(wsck, speakers.normalize(speaker)))
+
+
+def get_featured(wsck):
+    """Return the featured speakers of conference wsck, as a list of
+    {'speaker': name, 'sessions': [session names]} dicts."""
+    cached = _featured.get(wsck)
+    if cached is not None:
+        return cached[1]
+    state = ndb.Key(FeaturedSpeakers, wsck).get()
+    if not state:
+        return []
+    _cache(wsck, state)
+    return state.speakers or []
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""fulltext.py
+
+Udacity conference server-side Python App Engine full-text search
+
+$Id$
+
+Conferences (name, description) and sessions (name, highlights,
+speaker) are kept in full-text indexes, updated by /tasks/index_document
+whenever one is created or changed. Searches are answered from the index
+alone, as ranked pages of keys. A query is a list of words that must all
+match; a word ending in '*' matches any word it is a prefix of.
+
+The index itself is a pluggable backend: SearchApiBackend (the App
+Engine Search API) by default, InProcessBackend for tests and local
+runs; see set_backend().
+
+"""
+
+import bisect
+import math
+import re
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+MIN_PREFIX = 2              # shortest prefix a '*' word may have
+MAX_PREFIX = 20             # longest prefix indexed for prefix search
+REINDEX_BATCH_SIZE = 100
+ENQUEUE_BATCH_SIZE = 100
+
+# the fields whole words are matched in, per index
+FIELDS = {
+    CONFERENCE_INDEX: ('name', 'description'),
+    SESSION_INDEX: ('name', 'highlights', 'speaker'),
+}
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _words(text):
+    return [word.lower() for word in _WORD.findall(text or u'')]
+
+
+def parse_query(query):
+    """Split query into (words, prefixes); raise ValueError when it has
+    nothing to search for."""
+    words, prefixes = [], []
+    for token in (query or u'').split():
+        prefix = token.endswith('*')
+        for word in _words(token):
+            (prefixes if prefix else words).append(word)
+    for prefix in prefixes:
+        if len(prefix) < MIN_PREFIX:
+            raise ValueError(
+                "Prefixes need at least %d characters: '%s*'" % (MIN_PREFIX, prefix))
+    if not words and not prefixes:
+        raise ValueError('Nothing to search for.')
+    return words, prefixes
+
+# - - - backends - - - - - - - - - - - - - - - - - - - - - - -
+
+class SearchApiBackend(object):
+    """SearchApiBackend -- indexes kept by the App Engine Search API.
+    The Search API has no prefix queries, so the prefixes of every word
+    are indexed in an extra field; whole words are searched for in the
+    FIELDS of the index only, so that they do not match those."""
+
+    def put(self, index_name, doc_id, fields):
+        prefixes = set()
+        for text in fields.values():
+            for word in _words(text):
+                for n in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1):
+                    prefixes.add(word[:n])
+        doc_fields = [search.TextField(name=name, value=text or u'')
+                      for name, text in fields.items()]
+        doc_fields.append(search.TextField(name='prefixes',
+                                           value=u' '.join(prefixes)))
+        search.Index(name=index_name).put(
+            search.Document(doc_id=doc_id, fields=doc_fields))
+
+    def delete(self, index_name, doc_id):
+        search.Index(name=index_name).delete(doc_id)
+
+    def query_string(self, index_name, words, prefixes):
+        """Return the Search API query for words and prefixes."""
+        terms = [u'(%s)' % u' OR '.join(u'%s:"%s"' % (field, word)
+                                        for field in FIELDS[index_name])
+                 for word in words]
+        terms.extend(u'prefixes:"%s"' % prefix[:MAX_PREFIX]
+                     for prefix in prefixes)
+        return u' '.join(terms)
+
+    def search(self, index_name, words, prefixes, limit, cursor=None):
+        query_string = self.query_string(index_name, words, prefixes)
+        try:
+            start = search.Cursor(web_safe_string=cursor) if cursor \
+                else search.Cursor()
+        except Exception:
+            raise ValueError('Invalid cursor: %s' % cursor)
+        options = search.QueryOptions(
+            limit=limit, cursor=start, ids_only=True,
+            sort_options=search.SortOptions(
+                match_scorer=search.MatchScorer(),
+                expressions=[search.SortExpression(
+                    expression='_score', default_value=0.0,
+                    direction=search.SortExpression.DESCENDING)]))
+        results = search.Index(name=index_name).search(
+            search.Query(query_string=query_string, options=options))
+        next_cursor = results.cursor.web_safe_string if results.cursor else None
+        return [doc.doc_id for doc in results.results], next_cursor
+
+
+class InProcessBackend(object):
+    """InProcessBackend -- inverted indexes in instance memory, ranked
+    by tf-idf; for tests and local runs."""
+
+    def __init__(self):
+        self._indexes = {}
+
+    def _index(self, index_name):
+        # postings: word -> {doc_id: term frequency}, terms: sorted words
+        return self._indexes.setdefault(
+            index_name, {'docs': {}, 'postings': {}, 'terms': []})
+
+    def put(self, index_name, doc_id, fields):
+        self.delete(index_name, doc_id)
+        index = self._index(index_name)
+        counts = {}
+        for text in fields.values():
+            for word in _words(text):
+                counts[word] = counts.get(word, 0) + 1
+        for word, count in counts.items():
+            if word not in index['postings']:
+                index['postings'][word] = {}
+                bisect.insort(index['terms'], word)
+            index['postings'][word][doc_id] = count
+        index['docs'][doc_id] = counts.keys()
+
+    def delete(self, index_name, doc_id):
+        index = self._index(index_name)
+        for word in index['docs'].pop(doc_id, []):
+            postings = index['postings'][word]
+            del postings[doc_id]
+            if not postings:
+                del index['postings'][word]
+                index['terms'].remove(word)
+
+    def _postings(self, index, prefix):
+        """Return {doc_id: term frequency} over the words with prefix."""
+        terms = index['terms']
+        merged = {}
+        for i in range(bisect.bisect_left(terms, prefix), len(terms)):
+            if not terms[i].startswith(prefix):
+                break
+            for doc_id, count in index['postings'][terms[i]].items():
+                merged[doc_id] = merged.get(doc_id, 0) + count
+        return merged
+
+    def search(self, index_name, words, prefixes, limit, cursor=None):
+        try:
+            offset = int(cursor or 0)
+        except ValueError:
+            raise ValueError('Invalid cursor: %s' % cursor)
+        index = self._index(index_name)
+        total = float(len(index['docs']) or 1)
+        matches = [index['postings'].get(word, {}) for word in words]
+        matches.extend(self._postings(index, prefix) for prefix in prefixes)
+        scores = None
+        for postings in matches:
+            idf = math.log(total / (len(postings) or 1)) + 1
+            if scores is None:
+                scores = dict((doc_id, 0.0) for doc_id in postings)
+            for doc_id in scores.keys():
+                if doc_id in postings:
+                    scores[doc_id] += postings[doc_id] * idf
+                else:
+                    del scores[doc_id]
+        ranked = sorted((scores or {}).items(),
+                        key=lambda item: (-item[1], item[0]))
+        page = [doc_id for doc_id, _ in ranked[offset:offset + limit]]
+        next_cursor = None
+        if offset + limit < len(ranked):
+            next_cursor = str(offset + limit)
+        return page, next_cursor
+
+
+_backend = SearchApiBackend()
+
+
+def set_backend(backend):
+    """Replace the index backend, e.g. with an InProcessBackend in tests."""
+    global _backend
+    _backend = backend
+
+# - - - documents - - - - - - - - - - - - - - - - - - - - - - -
+
+def _document(entity):
+    """Return (index name, fields) for a Conference or Session."""
+    if isinstance(entity, Conference):
+        return CONFERENCE_INDEX, {'name': entity.name,
+                                  'description': entity.description}
+    return SESSION_INDEX, {'name': entity.name,
+                           'highlights': u' '.join(entity.highlights),
+                           'speaker': entity.speaker}
+
+
+def _indexName(key):
+    return CONFERENCE_INDEX if key.kind() == Conference._get_kind() \
+        else SESSION_INDEX
+
+
+def enqueue(key):
+    """Have the Conference or Session key (re)indexed in the background."""
+    enqueue_multi([key])
+
+
+def enqueue_multi(keys):
+    """Have Conference or Session keys (re)indexed in the background,
+    ENQUEUE_BATCH_SIZE keys per task."""
+    for i in range(0, len(keys), ENQUEUE_BATCH_SIZE):
+        taskqueue.add(params={'key': [key.urlsafe()
+                                      for key in keys[i:i + ENQUEUE_BATCH_SIZE]]},
+            url='/tasks/index_document'
+        )
+
+
+def index_key(key):
+    """Bring the index entry of the Conference or Session key up to date."""
+    entity = key.get()
+    if entity is None:
+        _backend.delete(_indexName(key), key.urlsafe())
+        return
+    index_name, fields = _document(entity)
+    _backend.put(index_name, key.urlsafe(), fields)
+
+
+def reindex(kind, cursor=None):
+    """Index one batch of the entities of kind ('Conference' or 'Session');
+    return the cursor of the next batch, or None when done."""
+    model = Conference if kind == Conference._get_kind() else Session
+    start = Cursor(urlsafe=cursor) if cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=start)
+    for entity in entities:
+        index_name, fields = _document(entity)
+        _backend.put(index_name, entity.key.urlsafe(), fields)
+    return next_cursor.urlsafe() if more and next_cursor else None
+
+
+def search_keys(index_name, query, limit, cursor=None):
+    """Return (keys, next cursor) for a ranked page of the entities of
+    index_name matching query; raise ValueError for invalid queries and
+    cursors."""
+    words, prefixes = parse_query(query)
+    doc_ids, next_cursor = _backend.search(
+        index_name, words, prefixes, limit, cursor)
+    return [ndb.Key(urlsafe=doc_id) for doc_id in doc_ids], next_cursor
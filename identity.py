@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""identity.py
+
+Udacity conference server-side Python App Engine user identity layer;
+maps the bearer token of the current request to a Google user id
+
+$Id$
+
+Lookups go through three tiers before any outbound network call:
+  1. a per-request memo (repeat calls within one request are free)
+  2. an instance-local LRU, then memcache, both keyed by a hash of the
+     token so raw tokens are never stored
+  3. local signature verification of ID tokens against Google's certs
+Only when all of those miss is the tokeninfo backend consulted.
+get_user_id_async() does the same with asynchronous memcache and urlfetch
+calls, so handlers can overlap the lookup with their datastore work.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cache import LocalLRUCache
+from settings import WEB_CLIENT_ID
+from settings import ANDROID_CLIENT_ID
+from settings import IOS_CLIENT_ID
+
+try:
+    from endpoints import users_id_token
+except ImportError:
+    users_id_token = None
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+MEMCACHE_IDENTITY_PREFIX = 'identity:'
+IDENTITY_TTL = 600          # upper bound (seconds) on any cached identity
+LOCAL_IDENTITY_TTL = 60     # upper bound (seconds) for the instance cache
+LOCAL_ID_TOKEN_VERIFICATION = True
+
+ALLOWED_CLIENT_IDS = (WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID,
+                      endpoints.API_EXPLORER_CLIENT_ID)
+
+STATS = {
+    'request_hits': 0,
+    'local_hits': 0,
+    'memcache_hits': 0,
+    'verified': 0,
+    'tokeninfo': 0,
+    'misses': 0,
+}
+
+_local = LocalLRUCache(max_size=2000, ttl=LOCAL_IDENTITY_TTL)
+_request = threading.local()
+
+# - - - tokeninfo backends - - - - - - - - - - - - - - - - - -
+
+class UrlfetchTokenInfo(object):
+    """UrlfetchTokenInfo -- default backend, asks Google's tokeninfo endpoint"""
+
+    @ndb.tasklet
+    def fetch_async(self, token_type, token):
+        """Return a future for the tokeninfo dict of token, {} if it
+        can't be had."""
+        ctx = ndb.get_context()
+        url = TOKENINFO_URL % (token_type, token)
+        wait = 1
+        for i in range(3):
+            resp = yield ctx.urlfetch(url)
+            if resp.status_code == 200:
+                raise ndb.Return(json.loads(resp.content))
+            elif resp.status_code == 400 and 'invalid_token' in resp.content:
+                url = TOKENINFO_URL % ('access_token', token)
+            else:
+                yield ndb.sleep(wait)
+                wait = wait + i
+        raise ndb.Return({})
+
+    def fetch(self, token_type, token):
+        """Return the tokeninfo dict for token, or {} if it can't be had."""
+        return self.fetch_async(token_type, token).get_result()
+
+
+class StubTokenInfo(object):
+    """StubTokenInfo -- local backend answering from a token -> info dict;
+    counts calls so tests can assert how often tokeninfo was needed"""
+
+    def __init__(self, tokens=None):
+        self.tokens = dict(tokens or {})
+        self.calls = 0
+
+    def fetch(self, token_type, token):
+        self.calls += 1
+        return dict(self.tokens.get(token, {}))
+
+    @ndb.tasklet
+    def fetch_async(self, token_type, token):
+        raise ndb.Return(self.fetch(token_type, token))
+
+
+_backend = UrlfetchTokenInfo()
+
+
+def set_tokeninfo_backend(backend):
+    """Install backend for tokeninfo lookups; return the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+# - - - lookup - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _requestMemo():
+    """Return the memo dict of the request being served by this thread."""
+    request_id = os.environ.get('REQUEST_LOG_ID')
+    if getattr(_request, 'id', None) != request_id or \
+            not hasattr(_request, 'memo'):
+        _request.id = request_id
+        _request.memo = {}
+    return _request.memo
+
+
+def _bearerToken():
+    """Return the bearer token of the current request, or None."""
+    auth = os.getenv('HTTP_AUTHORIZATION')
+    if not auth:
+        return None
+    parts = auth.split()
+    if len(parts) != 2:
+        return None
+    return parts[1]
+
+
+def _verifyIdToken(token):
+    """Verify an ID token locally; return (user_id, expires_at) or None."""
+    if not LOCAL_ID_TOKEN_VERIFICATION or users_id_token is None:
+        return None
+    if token.count('.') != 2:
+        # not a JWT, most likely an OAuth access token
+        return None
+    try:
+        payload = users_id_token._verify_signed_jwt_with_certs(
+            token, time.time(), memcache)
+    except Exception as e:
+        logging.debug('Local ID token verification failed: %s', e)
+        return None
+    if payload.get('azp', payload.get('aud')) not in ALLOWED_CLIENT_IDS:
+        return None
+    if not payload.get('sub'):
+        return None
+    return payload['sub'], int(payload.get('exp', 0))
+
+
+@ndb.tasklet
+def _askTokenInfoAsync(token):
+    """Resolve token via the tokeninfo backend; return (user_id, expires_at)."""
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    info = yield _backend.fetch_async(token_type, token)
+    user_id = info.get('user_id', '')
+    expires_at = int(time.time()) + int(info.get('expires_in', IDENTITY_TTL))
+    raise ndb.Return((user_id, expires_at))
+
+
+@ndb.tasklet
+def _lookupAsync(token_key, token):
+    """Resolve token through the shared caches, verifying if needed."""
+    user_id = _local.get(token_key)
+    if user_id:
+        STATS['local_hits'] += 1
+        raise ndb.Return(user_id)
+
+    ctx = ndb.get_context()
+    now = int(time.time())
+    cached = yield ctx.memcache_get(MEMCACHE_IDENTITY_PREFIX + token_key)
+    if cached and cached[1] > now:
+        STATS['memcache_hits'] += 1
+        user_id, expires_at = cached
+        _local.set(token_key, user_id,
+                   min(LOCAL_IDENTITY_TTL, expires_at - now))
+        raise ndb.Return(user_id)
+
+    STATS['misses'] += 1
+    resolved = _verifyIdToken(token)
+    if resolved:
+        STATS['verified'] += 1
+    else:
+        STATS['tokeninfo'] += 1
+        resolved = yield _askTokenInfoAsync(token)
+    user_id, expires_at = resolved
+    ttl = min(IDENTITY_TTL, expires_at - now)
+    if user_id and ttl > 0:
+        yield ctx.memcache_set(MEMCACHE_IDENTITY_PREFIX + token_key,
+                               (user_id, expires_at), time=ttl)
+        _local.set(token_key, user_id, min(LOCAL_IDENTITY_TTL, ttl))
+    raise ndb.Return(user_id)
+
+
+@ndb.tasklet
+def get_user_id_async():
+    """Return a future for the user id owning the current request's
+    bearer token, '' if there is no token or it can't be resolved."""
+    token = _bearerToken()
+    if not token:
+        raise ndb.Return('')
+    token_key = hashlib.sha256(token).hexdigest()
+    memo = _requestMemo()
+    if token_key in memo:
+        STATS['request_hits'] += 1
+        user_id = yield memo[token_key]
+        raise ndb.Return(user_id)
+    # the future is memoized, so concurrent callers share one lookup
+    future = memo[token_key] = _lookupAsync(token_key, token)
+    user_id = yield future
+    if not user_id:
+        memo.pop(token_key, None)
+    raise ndb.Return(user_id)
+
+
+def get_user_id():
+    """Return the user id owning the current request's bearer token,
+    or '' if there is no token or it can't be resolved."""
+    return get_user_id_async().get_result()
+
+
+def stats():
+    """Return a copy of the lookup counters plus the overall hit ratio."""
+    result = dict(STATS)
+    hits = result['request_hits'] + result['local_hits'] + \
+        result['memcache_hits']
+    total = hits + result['misses']
+    result['hit_ratio'] = float(hits) / total if total else 0.0
+    return result
+
+
+def reset():
+    """Clear the instance-local caches and counters (used by tests)."""
+    _local.clear()
+    _request.__dict__.clear()
+    for k in STATS:
+        STATS[k] = 0
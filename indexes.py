@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""indexes.py
+
+Udacity conference server-side Python App Engine composite index usage
+
+$Id$
+
+A datastore pre-call hook works out the composite index each query
+needs, the way the dev_appserver does to fill in index.yaml, and counts
+it along with the aggregates of the instrumented call it runs in (see
+metrics.py). report() sets those counts against the composite indexes
+declared in index.yaml, showing which ones queries actually use and how
+many every write of a kind has to maintain. has_composite() lets the
+query planner in ConferenceApi._getQuery avoid undeclared indexes.
+
+"""
+
+import logging
+import os
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_index
+from google.appengine.datastore import datastore_pb
+
+import metrics
+
+INDEX_FILE = os.path.join(os.path.dirname(__file__), 'index.yaml')
+COUNTER_PREFIX = 'index:'
+
+_DIRECTIONS = {
+    datastore_pb.Query_Order.ASCENDING: 'asc',
+    datastore_pb.Query_Order.DESCENDING: 'desc',
+}
+
+
+def _signature(kind, ancestor, props):
+    """Return the name of a composite index, e.g.
+    'Session(conference, startTime desc)'; props are (name, direction)
+    pairs."""
+    return '%s(%s%s)' % (kind, 'ancestor, ' if ancestor else '',
+        ', '.join(name if direction == 'asc' else '%s desc' % name
+                  for name, direction in props))
+
+
+def _loadDeclared():
+    """Return (kind, ancestor, props) for every index in index.yaml."""
+    with open(INDEX_FILE) as f:
+        definitions = datastore_index.ParseIndexDefinitions(f)
+    declared = []
+    for index in (definitions and definitions.indexes) or []:
+        props = tuple(
+            (prop.name, 'desc' if prop.direction in ('desc', 'descending')
+                        else 'asc')
+            for prop in index.properties or [])
+        declared.append((index.kind, bool(index.ancestor), props))
+    return declared
+
+_declared = _loadDeclared()
+
+
+def has_composite(kind, equality, ordered):
+    """Return whether index.yaml declares a composite index of kind on
+    the properties equality (in any order) followed by ordered, a list
+    of (name, direction) pairs."""
+    n = len(equality)
+    for index_kind, ancestor, props in _declared:
+        if index_kind == kind and not ancestor and \
+                len(props) == n + len(ordered) and \
+                set(name for name, _ in props[:n]) == set(equality) and \
+                props[n:] == tuple(ordered):
+            return True
+    return False
+
+
+def _requiredIndex(query):
+    """Return the name of the composite index query needs, or None."""
+    result = datastore_index.CompositeIndexForQuery(query)
+    required, kind, ancestor, props = result[:4]
+    if not required:
+        return None
+    if hasattr(datastore_index, 'GetRecommendedIndexProperties'):
+        props = datastore_index.GetRecommendedIndexProperties(props)
+    return _signature(kind, ancestor,
+        [(name, _DIRECTIONS.get(direction, 'asc'))
+         for name, direction in props])
+
+
+def _countQuery(service, call, request, response):
+    """apiproxy pre-call hook counting the composite index of queries."""
+    if call != 'RunQuery':
+        return
+    try:
+        index = _requiredIndex(request)
+    except Exception:
+        # never fail a query over accounting
+        logging.exception('Could not work out the index of a query')
+        return
+    if index:
+        metrics.defer_incr(COUNTER_PREFIX + index)
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'index_usage_counter', _countQuery, 'datastore_v3')
+
+
+def report():
+    """Return, by kind, the number of composite indexes a write
+    maintains and, for each of them, the number of queries that used it
+    since the counters were last evicted."""
+    names = [_signature(*index) for index in _declared]
+    counts = metrics.get_counts([COUNTER_PREFIX + name for name in names])
+    kinds = {}
+    for (kind, _, _), name in zip(_declared, names):
+        entry = kinds.setdefault(kind, {'composites': 0, 'queries': {},
+                                        'unused': []})
+        used = counts[COUNTER_PREFIX + name]
+        entry['composites'] += 1
+        entry['queries'][name] = used
+        if not used:
+            entry['unused'].append(name)
+    return kinds
@@ -12,19 +12,40 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.api import users
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import announcements
+import cache
+import export
+import facets
+import featured
+import fulltext
+import identity
+import indexes
+import metrics
+import registration
+import schedule
+import seats
+import speakers
+import sync
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
+    @metrics.instrument('SetAnnouncementHandler.get')
     def get(self):
-        """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        """Reconcile the nearly sold out Announcement with seat counts."""
+        announcements.reconcile()
         self.response.set_status(204)
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
+    @metrics.instrument('SendConfirmationEmailHandler.post')
     def post(self):
         """Send email confirming Conference creation."""
         mail.send_mail(
@@ -38,44 +59,219 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    @metrics.instrument('UpdateOrganizerNameHandler.post')
+    def post(self):
+        """Copy organizer displayName onto their conferences, in batches."""
+        user_id = self.request.get('userId')
+        cursor = ConferenceApi._updateOrganizerDisplayName(
+            user_id, self.request.get('cursor') or None)
+        if cursor:
+            # continue with the next batch in a new task
+            taskqueue.add(params={'userId': user_id, 'cursor': cursor},
+                url='/tasks/update_organizer_name'
+            )
+
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    @metrics.instrument('SyncSeatsHandler.post')
+    def post(self):
+        """Sync Conference.seatsAvailable with its seat shards."""
+        seats.sync_conference(
+            ndb.Key(urlsafe=self.request.get('conferenceKey')))
+
+
+class ProcessRegistrationsHandler(webapp2.RequestHandler):
+    @metrics.instrument('ProcessRegistrationsHandler.post')
+    def post(self):
+        """Settle the queued registrations of one conference."""
+        registration.process(self.request.get('conferenceKey') or None)
+
+    @metrics.instrument('ProcessRegistrationsHandler.get')
+    def get(self):
+        """Settle queued registrations of any conference (cron)."""
+        registration.process()
+        self.response.set_status(204)
+
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    @metrics.instrument('MigrateRegistrationsHandler.get')
+    def get(self):
+        """Start moving Profile.conferenceKeysToAttend to Registrations."""
+        taskqueue.add(url='/tasks/migrate_registrations')
+        self.response.set_status(202)
+
+    @metrics.instrument('MigrateRegistrationsHandler.post')
+    def post(self):
+        """Migrate one batch of Profiles, then chain the next batch."""
+        cursor = registration.migrate(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                url='/tasks/migrate_registrations'
+            )
+
+
+class IndexDocumentHandler(webapp2.RequestHandler):
+    @metrics.instrument('IndexDocumentHandler.post')
+    def post(self):
+        """Update the full-text index entries of Conferences or Sessions."""
+        for key in self.request.get_all('key'):
+            fulltext.index_key(ndb.Key(urlsafe=key))
+
+
+class ReindexDocumentsHandler(webapp2.RequestHandler):
+    @metrics.instrument('ReindexDocumentsHandler.get')
+    def get(self):
+        """Start indexing every Conference and Session (admins only)."""
+        for kind in ('Conference', 'Session'):
+            taskqueue.add(params={'kind': kind},
+                url='/tasks/reindex_documents'
+            )
+        self.response.set_status(202)
+
+    @metrics.instrument('ReindexDocumentsHandler.post')
+    def post(self):
+        """Index one batch of a kind, then chain the next batch."""
+        kind = self.request.get('kind')
+        cursor = fulltext.reindex(kind, self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': cursor},
+                url='/tasks/reindex_documents'
+            )
+
+
+class MigrateSpeakersHandler(webapp2.RequestHandler):
+    @metrics.instrument('MigrateSpeakersHandler.get')
+    def get(self):
+        """Start recording existing Sessions under Speakers (admins only)."""
+        taskqueue.add(url='/tasks/migrate_speakers')
+        self.response.set_status(202)
+
+    @metrics.instrument('MigrateSpeakersHandler.post')
+    def post(self):
+        """Record one batch of Sessions, then chain the next batch."""
+        cursor = speakers.backfill(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                url='/tasks/migrate_speakers'
+            )
+
+
+class MigrateModifiedHandler(webapp2.RequestHandler):
+    @metrics.instrument('MigrateModifiedHandler.get')
+    def get(self):
+        """Start stamping existing Conferences and Sessions with their
+        modification time, for delta sync (admins only)."""
+        for kind in sync.KINDS:
+            taskqueue.add(params={'kind': kind},
+                url='/tasks/migrate_modified'
+            )
+        self.response.set_status(202)
+
+    @metrics.instrument('MigrateModifiedHandler.post')
+    def post(self):
+        """Stamp one batch of a kind, then chain the next batch."""
+        kind = self.request.get('kind')
+        cursor = sync.backfill(kind, self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': cursor},
+                url='/tasks/migrate_modified'
+            )
+
+
+class ExportTaskHandler(webapp2.RequestHandler):
+    @metrics.instrument('ExportTaskHandler.post')
+    def post(self):
+        """Export the next batch of an export job, which chains the next."""
+        export.run(self.request.get('job'))
+
+
+class RebuildScheduleHandler(webapp2.RequestHandler):
+    @metrics.instrument('RebuildScheduleHandler.post')
+    def post(self):
+        """Rebuild the schedule document of a conference."""
+        schedule.rebuild(ndb.Key(urlsafe=self.request.get('conferenceKey')))
+
+
 class getFeaturedSpeaker(webapp2.RequestHandler):
     """ Task Handler for /tasks/get_featured_speaker endpoint"""
+    @metrics.instrument('getFeaturedSpeaker.post')
     def post(self):
-        from google.appengine.ext import ndb
-        from google.appengine.api import memcache
-        from models import Session
-
-        key = ndb.Key(urlsafe=self.request.get('conferenceKey'))
-        # check if featured speaker, if true use memcache
-        featured_sessions = Session.query(Session.conference == key).filter(Session.speaker == self.request.get('speaker'))
-        if featured_sessions.count() != 1:
-            mem_key = self.request.get('conferenceKey') + ':featured'
-            print mem_key
-            if memcache.get(mem_key) is None:
-                # key: '{webKey}:featured', add to memcache
-                sessions = [{'speaker': self.request.get('speaker'), 'sessions': [f.name for f in featured_sessions]}]
-                memcache.add(mem_key, sessions, 36000)
-            else:
-                # key: '{webKey}:featured', set memcache
-                state = list(memcache.get(mem_key))
-                in_list = False
-                for s in state:
-                    if s['speaker'] == self.request.get('speaker'):
-                        # speaker is already in memcache object, append to sessions list
-                        in_list = True
-                        s['sessions'] = [f.name for f in featured_sessions]
-                        break
-                if not in_list:
-                    # speaker is not in memcache object, append speaker to list
-                    state.append({'speaker': self.request.get('speaker'), 'sessions': [f.name for f in featured_sessions]})
-
-                memcache.set(mem_key, state)
+        """Recompute whether the speaker of a new session is featured."""
+        featured.update_speaker(self.request.get('conferenceKey'),
+                                self.request.get('speaker'))
 
 
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load what instances hold in memory before serving requests."""
+        facets.warm()
+        self.response.set_status(204)
+
+
+class MetricsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show per-method latency and RPC aggregates (admins only)."""
+        if not users.is_current_user_admin():
+            self.abort(403)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'methods': metrics.report(),
+            'counters': metrics.counters(),
+            'identity': identity.stats(),
+            'caches': cache.stats(),
+        }, indent=2, sort_keys=True))
+
+
+class IndexUsageHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show which composite indexes queries use (admins only)."""
+        if not users.is_current_user_admin():
+            self.abort(403)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(indexes.report(), indent=2,
+                                       sort_keys=True))
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show the progress of export ?job=..., or start an export of
+        ?format=ndjson|csv (admins only)."""
+        if not users.is_current_user_admin():
+            self.abort(403)
+        job_id = self.request.get('job')
+        if job_id:
+            result = export.status(job_id)
+            if result is None:
+                self.abort(404)
+        else:
+            try:
+                job = export.start(self.request.get('format') or 'ndjson')
+            except ValueError as e:
+                self.abort(400, detail=str(e))
+            result = export.status(job.key.id())
+            self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(result, indent=2, sort_keys=True))
 
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/process_registrations', ProcessRegistrationsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/get_featured_speaker', getFeaturedSpeaker),
+    ('/tasks/index_document', IndexDocumentHandler),
+    ('/tasks/rebuild_schedule', RebuildScheduleHandler),
+    ('/tasks/reindex_documents', ReindexDocumentsHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/process_registrations', ProcessRegistrationsHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/migrate_speakers', MigrateSpeakersHandler),
+    ('/tasks/migrate_modified', MigrateModifiedHandler),
+    ('/tasks/export', ExportTaskHandler),
+    ('/_ah/warmup', WarmupHandler),
+    ('/_admin/metrics', MetricsHandler),
+    ('/_admin/indexes', IndexUsageHandler),
+    ('/_admin/export', ExportHandler),
 ], debug=True)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""metrics.py
+
+Udacity conference server-side Python App Engine request instrumentation
+
+$Id$
+
+instrument() wraps an API method or task handler and records, per call,
+its wall time and the number of RPCs it issued to each App Engine
+service (counted by an apiproxy pre-call hook). Records are folded into
+memcache counters (a latency histogram per method plus RPC totals by
+service) with a single offset_multi, and a sample of them is logged as
+structured JSON. report() reads the aggregate back for /_admin/metrics,
+together with the plain event Counters.
+
+transactional() stands in for ndb.transactional (and
+transactional_tasklet() for ndb.transactional_tasklet) and counts, per
+transaction, its calls, the retries after collisions, the calls that
+still failed and the milliseconds spent in it, so contention shows up
+among the Counters.
+
+"""
+
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_METRICS_PREFIX = 'metrics:'
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SERVICES = ('datastore_v3', 'memcache', 'urlfetch', 'taskqueue')
+LOG_SAMPLE_RATE = 0.01
+TRANSACTION_COUNTERS = ('calls', 'retries', 'failures', 'ms')
+
+_request = threading.local()
+_names = set()      # every instrumented name, filled in at import time
+_counters = set()   # every Counter name, idem
+
+
+def _countRpc(service, call, request, response):
+    """apiproxy pre-call hook counting the RPCs of the current call."""
+    rpcs = getattr(_request, 'rpcs', None)
+    if rpcs is not None:
+        rpcs[service] = rpcs.get(service, 0) + 1
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'metrics_rpc_counter', _countRpc)
+
+
+def log_sample(event, **fields):
+    """Log event with fields as one JSON line, for LOG_SAMPLE_RATE of
+    the calls."""
+    if random.random() < LOG_SAMPLE_RATE:
+        fields['event'] = event
+        logging.info(json.dumps(fields, default=str, sort_keys=True))
+
+
+def _key(name, *parts):
+    return MEMCACHE_METRICS_PREFIX + ':'.join((name,) + parts)
+
+
+def _bucket(elapsed_ms):
+    for bound in LATENCY_BUCKETS_MS:
+        if elapsed_ms <= bound:
+            return str(bound)
+    return 'inf'
+
+
+def _record(name, elapsed_ms, rpcs, deferred, failed):
+    """Fold one call into the memcache aggregates and maybe log it."""
+    deltas = {
+        _key(name, 'calls'): 1,
+        _key(name, 'ms'): int(elapsed_ms),
+        _key(name, 'le', _bucket(elapsed_ms)): 1,
+    }
+    if failed:
+        deltas[_key(name, 'errors')] = 1
+    for service, count in rpcs.iteritems():
+        deltas[_key(name, 'rpc', service)] = count
+    for counter, count in deferred.iteritems():
+        deltas[_key(counter, 'count')] = count
+    memcache.offset_multi(deltas, initial_value=0)
+    log_sample('request', method=name, ms=int(elapsed_ms), rpcs=rpcs,
+               failed=failed)
+
+
+def _timed(name, fn, args, kwargs):
+    if getattr(_request, 'rpcs', None) is not None:
+        # already inside an instrumented call, which accounts for this one
+        return fn(*args, **kwargs)
+    _request.rpcs = {}
+    _request.deferred = {}
+    failed = False
+    start = time.time()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed_ms = (time.time() - start) * 1000
+        rpcs, _request.rpcs = _request.rpcs, None
+        deferred, _request.deferred = _request.deferred, None
+        try:
+            _record(name, elapsed_ms, rpcs, deferred, failed)
+        except Exception:
+            logging.exception('Could not record metrics for %s', name)
+
+
+def instrument(fn_or_name):
+    """Decorator recording wall time and RPC counts of every call.
+
+    Used bare, the function name is the metric name (API methods, below
+    @endpoints.method); handlers pass an explicit name instead:
+    @instrument('SetAnnouncementHandler.get').
+    """
+    def decorate(fn, name):
+        _names.add(name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return _timed(name, fn, args, kwargs)
+        return wrapper
+
+    if callable(fn_or_name):
+        return decorate(fn_or_name, fn_or_name.__name__)
+    return lambda fn: decorate(fn, fn_or_name)
+
+
+class Counter(object):
+    """Counter -- named event counter kept in memcache, e.g. cache hits."""
+
+    def __init__(self, name):
+        self.name = name
+        _counters.add(name)
+
+    def incr(self, delta=1):
+        memcache.incr(_key(self.name, 'count'), delta, initial_value=0)
+
+
+def defer_incr(name, delta=1):
+    """Add delta to counter name along with the aggregates of the current
+    instrumented call, in the same memcache RPC; for counting from RPC
+    hooks. Outside of instrumented calls, nothing is counted."""
+    deferred = getattr(_request, 'deferred', None)
+    if deferred is not None:
+        deferred[name] = deferred.get(name, 0) + delta
+
+
+def _transactionCounters(name):
+    counter = dict((part, 'txn:%s:%s' % (name, part))
+                   for part in TRANSACTION_COUNTERS)
+    _counters.update(counter.values())
+    return counter
+
+
+def transactional(name, **options):
+    """Decorator running the function in ndb.transactional(**options),
+    counted under the Counters 'txn:<name>:calls', ':retries',
+    ':failures' (collisions that exhausted the retries) and ':ms'. Like
+    defer_incr, it counts within instrumented calls only."""
+    counter = _transactionCounters(name)
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            attempts = []
+
+            @ndb.transactional(**options)
+            def attempt():
+                if attempts:
+                    defer_incr(counter['retries'])
+                attempts.append(True)
+                return fn(*args, **kwargs)
+
+            defer_incr(counter['calls'])
+            start = time.time()
+            try:
+                return attempt()
+            except datastore_errors.TransactionFailedError:
+                defer_incr(counter['failures'])
+                raise
+            finally:
+                defer_incr(counter['ms'], int((time.time() - start) * 1000))
+        return wrapper
+    return decorate
+
+
+def transactional_tasklet(name, **options):
+    """Decorator like transactional(), for tasklets: the function runs in
+    ndb.transactional_tasklet(**options) and calls return a future, so
+    that the transaction doesn't block the event loop."""
+    counter = _transactionCounters(name)
+
+    def decorate(fn):
+        tasklet = ndb.tasklet(fn)
+
+        @functools.wraps(fn)
+        @ndb.tasklet
+        def wrapper(*args, **kwargs):
+            attempts = []
+
+            @ndb.transactional_tasklet(**options)
+            def attempt():
+                if attempts:
+                    defer_incr(counter['retries'])
+                attempts.append(True)
+                result = yield tasklet(*args, **kwargs)
+                raise ndb.Return(result)
+
+            defer_incr(counter['calls'])
+            start = time.time()
+            try:
+                result = yield attempt()
+            except datastore_errors.TransactionFailedError:
+                defer_incr(counter['failures'])
+                raise
+            finally:
+                defer_incr(counter['ms'], int((time.time() - start) * 1000))
+            raise ndb.Return(result)
+        return wrapper
+    return decorate
+
+
+def get_counts(names):
+    """Return {name: count} for the counters names."""
+    values = memcache.get_multi([_key(name, 'count') for name in names])
+    return dict((name, values.get(_key(name, 'count'), 0)) for name in names)
+
+
+def counters():
+    """Return {name: count} for every Counter."""
+    return get_counts(list(_counters))
+
+
+def report():
+    """Return {name: aggregate} for every instrumented name that was
+    called, with call and error counts, mean latency, the latency
+    histogram and RPC totals by service."""
+    buckets = [str(bound) for bound in LATENCY_BUCKETS_MS] + ['inf']
+    keys = []
+    for name in _names:
+        keys.extend([_key(name, 'calls'), _key(name, 'ms'),
+                     _key(name, 'errors')])
+        keys.extend(_key(name, 'le', bucket) for bucket in buckets)
+        keys.extend(_key(name, 'rpc', service) for service in SERVICES)
+    values = memcache.get_multi(keys)
+
+    result = {}
+    for name in sorted(_names):
+        calls = values.get(_key(name, 'calls'), 0)
+        if not calls:
+            continue
+        result[name] = {
+            'calls': calls,
+            'errors': values.get(_key(name, 'errors'), 0),
+            'mean_ms': values.get(_key(name, 'ms'), 0) / calls,
+            'histogram_ms': [(bucket, values.get(_key(name, 'le', bucket), 0))
+                             for bucket in buckets],
+            'rpcs': dict((service, values.get(_key(name, 'rpc', service), 0))
+                         for service in SERVICES),
+        }
+    return result
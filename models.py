@@ -27,7 +27,8 @@ class Profile(ndb.Model):
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionKeysWishlist = ndb.StringProperty(repeated=True)
+    sessionKeysWishlist = ndb.StringProperty(repeated=True)    # legacy, websafe keys
+    sessionWishlist = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -55,6 +56,17 @@ class FeaturedSpeakerForm(messages.Message):
     sessions = messages.StringField(2, repeated=True)
 
 
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- Speaker outbound form message"""
+    name = messages.StringField(1)
+    sessionCount = messages.IntegerField(2, variant=messages.Variant.INT32)
+
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple Speaker outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
+
+
 class FeaturedSpeakerMessage(messages.Message):
     """FeaturedSpeakerMessage - outbound message for featured speakers"""
     featured = messages.MessageField(FeaturedSpeakerForm, 1, repeated=True)
@@ -72,6 +84,18 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False) # copy of Profile.displayName
+    seatShards      = ndb.IntegerProperty(indexed=False) # number of SeatShards, see seats.py
+    modified        = ndb.DateTimeProperty(auto_now=True) # see sync.py
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        _bury(key, future)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- slice of the seats still available for a Conference"""
+    seats = ndb.IntegerProperty(default=0, indexed=False)
 
 
 class Session(ndb.Model):
@@ -86,6 +110,11 @@ class Session(ndb.Model):
     startTime = ndb.TimeProperty()
     highlights = ndb.StringProperty(repeated=True)                                    # one or more arguments for the session
     conference = ndb.KeyProperty(kind='Conference')                                   # the conference to which the session is related
+    modified = ndb.DateTimeProperty(auto_now=True)                                    # last write, see sync.py
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        _bury(key, future)
 
     @classmethod
     def get_sessions_by_conference(cls, conference_key):
@@ -98,6 +127,94 @@ class Session(ndb.Model):
         return cls.query(cls.speaker == speaker_name)
 
 
+class AnnouncementIndex(ndb.Model):
+    """AnnouncementIndex -- conferences that are nearly sold out; see
+    announcements.py"""
+    conferences = ndb.JsonProperty()    # {websafe Conference key: name}
+
+
+class FeaturedSpeakers(ndb.Model):
+    """FeaturedSpeakers -- featured speakers of a Conference, keyed by the
+    websafe Conference key; see featured.py"""
+    speakers    = ndb.JsonProperty()    # [{'speaker': name, 'sessions': [names]}]
+    version     = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class SpeakerSessions(ndb.Model):
+    """SpeakerSessions -- sessions a Speaker gives in one Conference"""
+    conference  = ndb.KeyProperty(kind='Conference')
+    sessions    = ndb.KeyProperty(kind='Session', repeated=True)
+
+
+class Speaker(ndb.Model):
+    """Speaker -- person giving Sessions, keyed by normalized name; see
+    speakers.py"""
+    name        = ndb.StringProperty(indexed=False)   # as first written
+    conferences = ndb.LocalStructuredProperty(SpeakerSessions, repeated=True)
+
+    def session_keys(self, conference_key=None):
+        """Returns the keys of the sessions in a Conference, or in all"""
+        return [key for entry in self.conferences
+                if conference_key is None or entry.conference == conference_key
+                for key in entry.sessions]
+
+
+class ConferenceSchedule(ndb.Model):
+    """ConferenceSchedule -- protojson ScheduleForm of a Conference, keyed
+    by the websafe Conference key; see schedule.py"""
+    document    = ndb.TextProperty()
+    version     = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ExportJob(ndb.Model):
+    """ExportJob -- progress of a bulk export, keyed by job id; see export.py"""
+    format      = ndb.StringProperty(indexed=False)     # 'ndjson' or 'csv'
+    status      = ndb.StringProperty(default='RUNNING', indexed=False)
+    kind        = ndb.StringProperty(indexed=False)     # kind being exported
+    cursor      = ndb.StringProperty(indexed=False)     # of its next batch
+    chunks      = ndb.JsonProperty()    # {kind: number of chunks written}
+    rows        = ndb.IntegerProperty(default=0, indexed=False)
+    created     = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+    finished    = ndb.DateTimeProperty(indexed=False)
+
+
+class Tombstone(ndb.Model):
+    """Tombstone -- marks a deleted Conference or Session for delta sync;
+    child of the deleted key, so it joins the deleting transaction"""
+    kind        = ndb.StringProperty()
+    deleted     = ndb.DateTimeProperty(auto_now=True)
+
+
+def _bury(key, future):
+    """Leave a Tombstone for key, once its delete succeeded."""
+    if future.get_exception() is None:
+        Tombstone(key=ndb.Key(Tombstone, key.kind(), parent=key),
+                  kind=key.kind()).put()
+
+
+class Registration(ndb.Model):
+    """Registration -- Profile attending a Conference; child of the Profile,
+    keyed by the websafe Conference key"""
+    conference  = ndb.KeyProperty(kind='Conference')
+    created     = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class SeatClaims(ndb.Model):
+    """SeatClaims -- queued registrations of a Conference holding a seat
+    they haven't been settled with yet, keyed by the websafe Conference
+    key; see registration.py"""
+    tickets     = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class RegistrationTicket(ndb.Model):
+    """RegistrationTicket -- state of a queued registration request"""
+    userId      = ndb.StringProperty(indexed=False)
+    conference  = ndb.KeyProperty(kind='Conference', indexed=False)
+    status      = ndb.StringProperty(default='PENDING', indexed=False)
+    message     = ndb.StringProperty(indexed=False)
+    created     = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
     name            = messages.StringField(1)
@@ -126,14 +243,58 @@ class SessionForm(messages.Message):
     sessionKey = messages.StringField(8)
 
 
+class ScheduleDayForm(messages.Message):
+    """ScheduleDayForm -- Sessions of one day, by start time"""
+    date = messages.StringField(1)
+    sessions = messages.MessageField(SessionForm, 2, repeated=True)
+
+
+class ScheduleForm(messages.Message):
+    """ScheduleForm -- Sessions of a Conference by day, outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    version = messages.IntegerField(2)
+    days = messages.MessageField(ScheduleDayForm, 3, repeated=True)
+
+
+class SessionBatchForm(messages.Message):
+    """SessionBatchForm -- Sessions to create at once, inbound form message"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+
+
+class SessionResultForm(messages.Message):
+    """SessionResultForm -- outcome of one item of a SessionBatchForm"""
+    index = messages.IntegerField(1, variant=messages.Variant.INT32)
+    created = messages.BooleanField(2)
+    sessionKey = messages.StringField(3)
+    error = messages.StringField(4)
+
+
+class SessionResultForms(messages.Message):
+    """SessionResultForms -- outcome of a SessionBatchForm"""
+    items = messages.MessageField(SessionResultForm, 1, repeated=True)
+    created = messages.IntegerField(2, variant=messages.Variant.INT32)
+
+
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
 
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Sessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+
+class ChangesForm(messages.Message):
+    """ChangesForm -- page of the Conferences or Sessions changed since a
+    watermark outbound form message"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions = messages.MessageField(SessionForm, 2, repeated=True)
+    deleted = messages.StringField(3, repeated=True)    # websafe keys
+    nextCursor = messages.StringField(4)
+    watermark = messages.StringField(5)     # 'since' of the next sync
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -153,6 +314,19 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- state of a queued registration request"""
+    PENDING = 1
+    REGISTERED = 2
+    REJECTED = 3
+
+class RegistrationStatusForm(messages.Message):
+    """RegistrationStatusForm -- queued registration outbound form message"""
+    requestId = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status = messages.EnumField('RegistrationStatus', 3)
+    message = messages.StringField(4)
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -162,4 +336,7 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    fields = messages.StringField(4)    # see projections.py
 
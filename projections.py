@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""projections.py
+
+Udacity conference server-side Python App Engine partial responses
+
+$Id$
+
+List endpoints take a 'fields' parameter: a comma-separated list of the
+form fields the client wants, or 'summary' for the few fields list
+views show. parse_fields() checks it; the key field is always returned.
+When every selected field is an indexed, single-valued property, the
+list query runs as a projection on those properties, so the datastore
+answers it from the index alone and descriptions and highlights are
+never read. A projection needs a composite index on its properties;
+without one, the query falls back to whole entities, and the instance
+remembers not to try that projection again.
+
+Cursors belong to the field selection they were returned for.
+
+"""
+
+import logging
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+import metrics
+
+SUMMARY = 'summary'
+SUMMARY_FIELDS = {
+    ConferenceForm: ('name', 'city', 'startDate', 'endDate', 'seatsAvailable'),
+    SessionForm: ('name', 'speaker', 'startDate', 'startTime', 'typeOfSession'),
+}
+KEY_FIELDS = {
+    ConferenceForm: 'websafeKey',
+    SessionForm: 'sessionKey',
+}
+MODELS = {
+    ConferenceForm: Conference,
+    SessionForm: Session,
+}
+
+PROJECTION_FALLBACKS = metrics.Counter('projections:fallbacks')
+
+_unindexed = set()      # (kind, projection, shape) lacking an index
+
+
+def parse_fields(fields, message_cls):
+    """Return the set of message_cls fields selected by fields, or None
+    for all of them; raise ValueError naming unknown fields."""
+    if not fields:
+        return None
+    names = set()
+    for name in fields.split(','):
+        name = name.strip()
+        if name == SUMMARY:
+            names.update(SUMMARY_FIELDS[message_cls])
+        elif name:
+            names.add(name)
+    unknown = names - set(field.name for field in message_cls.all_fields())
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    names.add(KEY_FIELDS[message_cls])
+    return frozenset(names)
+
+
+def projection(message_cls, names, equality=()):
+    """Return the properties to project on for the message_cls fields
+    names, or None when the entities have to be read whole: for all
+    fields, for properties that are repeated, unindexed or not stored,
+    or compared for equality by the query."""
+    if names is None:
+        return None
+    model_cls = MODELS[message_cls]
+    props = []
+    for name in sorted(names - set([KEY_FIELDS[message_cls]])):
+        prop = model_cls._properties.get(name)
+        if prop is None or not prop._indexed or prop._repeated or \
+                name in equality:
+            return None
+        props.append(name)
+    return tuple(props) or None
+
+
+@ndb.tasklet
+def run_async(message_cls, names, fn, shape, equality=()):
+    """Return a future for the result of fn(projection=...), the future
+    of a query of message_cls entities projected on the fields names,
+    or of fn() when the projection isn't possible or lacks an index.
+    shape names the query (filters and orders) for remembering which
+    projections lack an index; equality lists the properties it compares
+    for equality."""
+    props = projection(message_cls, names, equality)
+    key = (MODELS[message_cls]._get_kind(), props, shape)
+    if props and key not in _unindexed:
+        try:
+            result = yield fn(projection=props)
+            raise ndb.Return(result)
+        except datastore_errors.NeedIndexError:
+            logging.warning('No index for projection %s of %s', props, shape)
+            _unindexed.add(key)
+            PROJECTION_FALLBACKS.incr()
+    result = yield fn()
+    raise ndb.Return(result)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+"""registration.py
+
+Udacity conference server-side Python App Engine conference registrations
+
+$Id$
+
+A registration is a Registration entity, child of the attendee's Profile
+and keyed by the websafe Conference key: membership is a single get, and
+both "conferences of a user" and "attendees of a conference" are
+keys-only queries. Profiles registered before the Registration kind
+existed still list conferences in Profile.conferenceKeysToAttend until
+migrate() has moved them over.
+
+requestRegistration only records a RegistrationTicket and adds a task,
+tagged with the conference key, to the 'registrations' pull queue. A
+worker leases the tasks of one conference at a time and claims the seats
+of the whole batch in a single transaction, so a burst of registrations
+contends for the seat shards a handful of times rather than once per
+request. Clients poll the ticket for the outcome.
+
+"""
+
+import json
+import logging
+import time
+import uuid
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import Registration
+from models import RegistrationTicket
+from models import SeatClaims
+import metrics
+import seats
+
+REGISTRATION_QUEUE = 'registrations'
+LEASE_SECONDS = 60
+BATCH_SIZE = 100
+MAX_BATCHES = 20            # batches settled per worker run
+BATCH_DELAY = 2             # seconds a burst is left to accumulate
+MIGRATION_BATCH_SIZE = 100
+
+# - - - Registration kind - - - - - - - - - - - - - - - - - - -
+
+def registration_key(p_key, conf_key):
+    """Return the key of the Registration of profile p_key for conf_key."""
+    return ndb.Key(Registration, conf_key.urlsafe(), parent=p_key)
+
+
+def conference_keys(prof):
+    """Return the keys of the conferences Profile prof is registered for."""
+    keys = Registration.query(ancestor=prof.key).fetch(keys_only=True)
+    wscks = [key.id() for key in keys]
+    wscks.extend(wsck for wsck in prof.conferenceKeysToAttend
+                 if wsck not in wscks)
+    return [ndb.Key(urlsafe=wsck) for wsck in wscks]
+
+
+def attendee_keys(conf_key):
+    """Return the Profile keys of the attendees of conf_key."""
+    keys = Registration.query(Registration.conference == conf_key).fetch(
+        keys_only=True)
+    return [key.parent() for key in keys]
+
+
+def migrate(cursor=None):
+    """Move one batch of Profiles from conferenceKeysToAttend to
+    Registration entities; return the cursor of the next batch, or None
+    when done. Registration keys are deterministic, so re-running a batch
+    is harmless."""
+    start = Cursor(urlsafe=cursor) if cursor else None
+    p_keys, next_cursor, more = Profile.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=start, keys_only=True)
+
+    @metrics.transactional('registration.migrate')
+    def _move(p_key):
+        # a Profile and its Registrations share one entity group
+        prof = p_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return
+        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
+        ndb.put_multi([Registration(key=registration_key(p_key, conf_key),
+                                    conference=conf_key)
+                       for conf_key in conf_keys])
+        prof.conferenceKeysToAttend = []
+        prof.put()
+
+    for p_key in p_keys:
+        _move(p_key)
+    return next_cursor.urlsafe() if more and next_cursor else None
+
+# - - - queued registrations - - - - - - - - - - - - - - - - -
+
+def enqueue(user_id, conf_key):
+    """Record a pending registration of user_id for conf_key; return
+    the RegistrationTicket to poll."""
+    ticket = RegistrationTicket(id=uuid.uuid4().hex, userId=user_id,
+                                conference=conf_key)
+    ticket.put()
+    wsck = conf_key.urlsafe()
+    taskqueue.Queue(REGISTRATION_QUEUE).add(taskqueue.Task(
+        payload=json.dumps({'ticket': ticket.key.id(), 'userId': user_id}),
+        method='PULL', tag=wsck))
+    _scheduleWorker(wsck)
+    return ticket
+
+
+def _scheduleWorker(wsck):
+    """Enqueue a worker run for the conference, one per BATCH_DELAY."""
+    try:
+        taskqueue.add(params={'conferenceKey': wsck},
+            url='/tasks/process_registrations',
+            name='regbatch-%s-%d' % (wsck, int(time.time() / BATCH_DELAY)),
+            countdown=BATCH_DELAY
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def process(wsck=None):
+    """Lease and settle batches of queued registrations, those of
+    conference wsck or, if None, of whichever conference queued first.
+    Returns the number of requests settled."""
+    queue = taskqueue.Queue(REGISTRATION_QUEUE)
+    settled = 0
+    for _ in range(MAX_BATCHES):
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, BATCH_SIZE, tag=wsck)
+        if not tasks:
+            break
+        _settle(tasks[0].tag, [json.loads(task.payload) for task in tasks])
+        queue.delete_tasks(tasks)
+        settled += len(tasks)
+    return settled
+
+
+@metrics.transactional('registration.claim', xg=True)
+def _claim(conf, ticket_ids):
+    """Claim seats for the tickets ticket_ids (in queue order) and record
+    the tickets granted one in the conference's SeatClaims, in the same
+    transaction as the seat shards. Tickets already recorded there kept
+    their seat from an earlier attempt and don't claim another. Return the
+    set of ticket_ids holding a seat."""
+    key = ndb.Key(SeatClaims, conf.key.urlsafe())
+    claims = key.get() or SeatClaims(key=key)
+    held = set(claims.tickets) & set(ticket_ids)
+    wanting = [t for t in ticket_ids if t not in held]
+    granted = seats.claim_seats(conf, len(wanting))
+    if granted:
+        claims.tickets.extend(wanting[:granted])
+        claims.put()
+    return held | set(wanting[:granted])
+
+
+@metrics.transactional('registration.grant', xg=True)
+def _grant(ticket_key, conf_key):
+    """Register the user of a ticket holding a seat, unless they are
+    registered already; write both in one transaction, checked against
+    the Registration itself. Return the ticket."""
+    ticket = ticket_key.get()
+    if ticket.status != 'PENDING':
+        return ticket
+    p_key = ndb.Key(Profile, ticket.userId)
+    r_key = registration_key(p_key, conf_key)
+    prof, reg = ndb.get_multi([p_key, r_key])
+    if not prof:
+        _reject([ticket], 'No profile for user.')
+        ticket.put()
+    elif reg or conf_key.urlsafe() in prof.conferenceKeysToAttend:
+        _reject([ticket], 'You have already registered for this conference')
+        ticket.put()
+    else:
+        ticket.status = 'REGISTERED'
+        ndb.put_multi([Registration(key=r_key, conference=conf_key), ticket])
+    return ticket
+
+
+@metrics.transactional('registration.release', xg=True)
+def _release(conf, tickets):
+    """Drop the settled tickets from the conference's SeatClaims, giving
+    back the seats of those that were rejected. Where tickets lists a
+    ticket twice, the last copy counts."""
+    claims = ndb.Key(SeatClaims, conf.key.urlsafe()).get()
+    if not claims:
+        return
+    settled = dict((t.key.id(), t) for t in tickets if t.status != 'PENDING')
+    kept = [t for t in claims.tickets if t not in settled]
+    if len(kept) == len(claims.tickets):
+        return
+    for t in claims.tickets:
+        if t in settled and settled[t].status == 'REJECTED':
+            seats.release_seat(conf)
+    if kept:
+        claims.tickets = kept
+        claims.put()
+    else:
+        claims.key.delete()
+
+
+def _settle(wsck, requests):
+    """Register as many of requests (in queue order) for conference wsck
+    as there are seats, and record the outcome on their tickets.
+
+    The seats of a batch are claimed in one transaction, which also
+    records the tickets granted a seat in the conference's SeatClaims;
+    each of those is then registered in a transaction of its own that
+    checks the Registration, and the SeatClaims entry is dropped last,
+    giving back the seats of users found registered meanwhile. A batch
+    that fails part way is retried once its lease expires: tickets no
+    longer PENDING are skipped and tickets in SeatClaims keep their seat,
+    so no seat is sold twice or lost.
+    """
+    all_tickets = [t for t in ndb.get_multi(
+        [ndb.Key(RegistrationTicket, r['ticket']) for r in requests]) if t]
+    tickets = [t for t in all_tickets if t.status == 'PENDING']
+    conf = ndb.Key(urlsafe=wsck).get()
+    if not conf:
+        _reject(tickets, 'No conference found with key: %s' % wsck)
+        ndb.put_multi(tickets)
+        return
+    conf = seats.ensure_sharded(conf)
+    if not tickets:
+        # a retried batch, settled but for its SeatClaims entry
+        _release(conf, all_tickets)
+        return
+
+    p_keys = list(set(ndb.Key(Profile, t.userId) for t in tickets))
+    profiles = dict((p.key.id(), p) for p in ndb.get_multi(p_keys) if p)
+    regs = ndb.get_multi([registration_key(key, conf.key) for key in p_keys])
+    registered = set(reg.key.parent().id() for reg in regs if reg)
+    rejected = []
+    wanting = []
+    for ticket in tickets:
+        prof = profiles.get(ticket.userId)
+        if not prof:
+            _reject([ticket], 'No profile for user.')
+        elif ticket.userId in registered or \
+                wsck in prof.conferenceKeysToAttend or \
+                any(t.userId == ticket.userId for t in wanting):
+            _reject([ticket], 'You have already registered for this conference')
+        else:
+            wanting.append(ticket)
+            continue
+        rejected.append(ticket)
+
+    held = _claim(conf, [t.key.id() for t in wanting])
+    settled = []
+    for ticket in wanting:
+        if ticket.key.id() in held:
+            settled.append(_grant(ticket.key, conf.key))
+        else:
+            _reject([ticket], 'There are no seats available.')
+            rejected.append(ticket)
+    ndb.put_multi(rejected)
+    _release(conf, all_tickets + settled)
+    logging.info('Settled %d registrations for %s, %d granted', len(tickets),
+                 wsck, sum(1 for t in settled if t.status == 'REGISTERED'))
+
+
+def _reject(tickets, message):
+    for ticket in tickets:
+        ticket.status = 'REJECTED'
+        ticket.message = message
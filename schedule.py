@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Udacity conference server-side Python App Engine conference schedules
+
+$Id$
+
+The schedule of a conference, all of its sessions grouped by date and
+ordered by start time, is built once into a ScheduleForm and kept,
+protojson-encoded, in a ConferenceSchedule entity whose version grows
+with every rebuild, mirrored in a TwoTierCache. Reading a schedule is a
+cache hit; the entity is only read after eviction. When sessions change,
+rebuild_later() has the document rebuilt by /tasks/rebuild_schedule, at
+most once every REBUILD_DELAY seconds per conference; the delay also
+gives the session query time to see the new sessions.
+
+"""
+
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+from cache import TwoTierCache
+from models import ConferenceSchedule
+from models import ScheduleDayForm
+from models import ScheduleForm
+from models import Session
+from models import SessionForm
+import converters
+import metrics
+
+SCHEDULE_TTL = 36000
+SCHEDULE_LOCAL_TTL = 10
+REBUILD_DELAY = 5
+
+_schedules = TwoTierCache('schedule', local_ttl=SCHEDULE_LOCAL_TTL,
+                          ttl=SCHEDULE_TTL)
+
+
+def _build(conf_key):
+    """Return the protojson-encoded ScheduleForm of conference conf_key."""
+    sessions = Session.query(Session.conference == conf_key).order(
+        Session.startDate, Session.startTime).fetch()
+    days = []
+    for session in sessions:
+        date = str(session.startDate)
+        if not days or days[-1].date != date:
+            days.append(ScheduleDayForm(date=date))
+        days[-1].sessions.append(converters.to_message(session, SessionForm))
+    return protojson.encode_message(
+        ScheduleForm(websafeConferenceKey=conf_key.urlsafe(), days=days))
+
+
+@metrics.transactional('schedule.store')
+def _store(conf_key, document):
+    key = ndb.Key(ConferenceSchedule, conf_key.urlsafe())
+    state = key.get() or ConferenceSchedule(key=key)
+    state.document = document
+    state.version += 1
+    state.put()
+    return state
+
+
+def rebuild(conf_key):
+    """Rebuild and cache the schedule of conf_key; return the
+    ConferenceSchedule."""
+    state = _store(conf_key, _build(conf_key))
+    _schedules.set_versioned(conf_key.urlsafe(), state.version, state.document)
+    return state
+
+
+def rebuild_later(conf_key):
+    """Enqueue a rebuild of the schedule of conf_key, at most one per
+    REBUILD_DELAY seconds."""
+    wsck = conf_key.urlsafe()
+    try:
+        taskqueue.add(params={'conferenceKey': wsck},
+            url='/tasks/rebuild_schedule',
+            name='schedule-%s-%d' % (wsck, int(time.time() / REBUILD_DELAY)),
+            countdown=REBUILD_DELAY
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def get_schedule(conf_key):
+    """Return the ScheduleForm of conference conf_key, building it on
+    first use; None if there is no such conference."""
+    wsck = conf_key.urlsafe()
+    cached = _schedules.get(wsck)
+    if cached is None:
+        state = ndb.Key(ConferenceSchedule, wsck).get()
+        if state:
+            _schedules.set_versioned(wsck, state.version, state.document)
+        elif conf_key.get():
+            state = rebuild(conf_key)
+        else:
+            return None
+        cached = (state.version, state.document)
+    form = protojson.decode_message(ScheduleForm, cached[1])
+    form.version = cached[0]
+    return form
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat inventory
+
+$Id$
+
+The seats still available for a conference are spread over SeatShard
+root entities, so concurrent registrations for a popular conference
+land in different entity groups instead of all rewriting the Conference.
+The live figure is the sum of the shards, cached in memcache;
+Conference.seatsAvailable is a snapshot synced at most every
+SYNC_INTERVAL seconds so it can still be used in queries.
+
+"""
+
+import logging
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import SeatShard
+import announcements
+import cache
+import metrics
+
+NUM_SHARDS = 10
+MAX_SHARD_ATTEMPTS = 3      # shards read per seat claim
+SYNC_INTERVAL = 10          # seconds between Conference.seatsAvailable syncs
+SEATS_TTL = 60
+MEMCACHE_SEATS_PREFIX = 'seats:'
+
+
+def _shardKeys(conf_key, num_shards):
+    """Return the keys of the SeatShards of conference conf_key."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i)) for i in range(num_shards)]
+
+
+def _cacheKey(conf_key):
+    return MEMCACHE_SEATS_PREFIX + conf_key.urlsafe()
+
+
+def create_shards(conf_key, seats, num_shards=NUM_SHARDS):
+    """Return (unsaved) SeatShards splitting seats evenly over num_shards."""
+    base, extra = divmod(max(seats or 0, 0), num_shards)
+    return [SeatShard(key=key, seats=base + (1 if i < extra else 0))
+            for i, key in enumerate(_shardKeys(conf_key, num_shards))]
+
+
+@metrics.transactional('seats.shardConference', xg=True)
+def _shardConference(conf_key):
+    conf = conf_key.get()
+    if conf and not conf.seatShards:
+        conf.seatShards = NUM_SHARDS
+        ndb.put_multi(create_shards(conf_key, conf.seatsAvailable) + [conf])
+    return conf
+
+
+def ensure_sharded(conf):
+    """Move the seats of a conference created before sharding onto
+    SeatShards; return the (possibly updated) Conference."""
+    if conf.seatShards:
+        return conf
+    return _shardConference(conf.key)
+
+# - - - live counts - - - - - - - - - - - - - - - - - - - - - -
+
+@ndb.non_transactional
+def get_seats_available_multi(confs):
+    """Return {conference key: seats available} for confs, from memcache
+    where possible and by summing the shards otherwise. Projected
+    Conferences lack seatShards, so the seatsAvailable snapshot stands
+    in for the shard sum."""
+    result = {}
+    sharded = {}
+    for conf in confs:
+        if conf._projection or conf.seatShards:
+            sharded[_cacheKey(conf.key)] = conf
+        else:
+            result[conf.key] = conf.seatsAvailable
+    if not sharded:
+        return result
+
+    cached = memcache.get_multi(sharded.keys())
+    missing = []
+    for cache_key, conf in sharded.items():
+        if cache_key in cached:
+            result[conf.key] = cached[cache_key]
+        elif conf._projection:
+            result[conf.key] = conf.seatsAvailable
+        else:
+            missing.append(conf)
+
+    if missing:
+        shard_keys = [_shardKeys(conf.key, conf.seatShards) for conf in missing]
+        shards = ndb.get_multi([key for keys in shard_keys for key in keys])
+        fresh = {}
+        for conf in missing:
+            seats = sum(shard.seats for shard in shards[:conf.seatShards] if shard)
+            shards = shards[conf.seatShards:]
+            result[conf.key] = fresh[_cacheKey(conf.key)] = seats
+        memcache.set_multi(fresh, time=SEATS_TTL)
+    return result
+
+
+def get_seats_available(conf):
+    """Return the live number of seats available for conf."""
+    return get_seats_available_multi([conf])[conf.key]
+
+
+@ndb.tasklet
+def get_seats_available_async(conf_key, conf_future):
+    """Return a future for the live number of seats available for the
+    conference conf_key, None if there is none. memcache is read while
+    conf_future, the get of the Conference, is still outstanding."""
+    ctx = ndb.get_context()
+    cached, conf = yield ctx.memcache_get(_cacheKey(conf_key)), conf_future
+    if conf is None or not conf.seatShards:
+        raise ndb.Return(conf and conf.seatsAvailable)
+    if cached is not None:
+        raise ndb.Return(cached)
+    shards = yield ndb.get_multi_async(_shardKeys(conf_key, conf.seatShards))
+    seats = sum(shard.seats for shard in shards if shard)
+    yield ctx.memcache_set(_cacheKey(conf_key), seats, time=SEATS_TTL)
+    raise ndb.Return(seats)
+
+
+@ndb.non_transactional
+@ndb.tasklet
+def _shardsWithSeatsAsync(conf):
+    """Return a future for the keys of conf's shards that currently hold
+    seats."""
+    keys = _shardKeys(conf.key, conf.seatShards)
+    shards = yield ndb.get_multi_async(keys)
+    raise ndb.Return([key for key, shard in zip(keys, shards)
+                      if shard and shard.seats > 0])
+
+# - - - claims - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _afterChange(conf, delta):
+    """Apply a committed seat change to memcache and the announcement,
+    and schedule a sync."""
+    if delta < 0:
+        available = memcache.decr(_cacheKey(conf.key), -delta)
+    else:
+        available = memcache.incr(_cacheKey(conf.key), delta)
+    if available is None:
+        available = get_seats_available(conf)
+    announcements.seats_changed(conf, available)
+    # cached queryConferences pages follow with the sync, at most every
+    # SYNC_INTERVAL seconds, rather than with every seat
+    schedule_sync(conf.key)
+
+
+@ndb.tasklet
+def claim_seat_async(conf):
+    """Take one seat from a random shard of conf holding seats; meant to
+    run inside the caller's (xg) transaction. Returns a future for
+    False when no seat could be claimed.
+
+    Candidate shards are picked from a non-transactional read; at most
+    MAX_SHARD_ATTEMPTS of them are read transactionally, so a shard is
+    only ever decremented while it is known to hold a seat. That read
+    may be stale, so when none of them has a seat left every other
+    shard is read transactionally before conf is reported sold out.
+    """
+    candidates = yield _shardsWithSeatsAsync(conf)
+    random.shuffle(candidates)
+    tried = candidates[:MAX_SHARD_ATTEMPTS]
+    for key in tried:
+        shard = yield key.get_async()
+        if shard and shard.seats > 0:
+            yield _takeSeat(conf, shard)
+            raise ndb.Return(True)
+    rest = [key for key in _shardKeys(conf.key, conf.seatShards)
+            if key not in tried]
+    random.shuffle(rest)
+    for shard in (yield ndb.get_multi_async(rest)):
+        if shard and shard.seats > 0:
+            yield _takeSeat(conf, shard)
+            raise ndb.Return(True)
+    raise ndb.Return(False)
+
+
+@ndb.tasklet
+def _takeSeat(conf, shard):
+    shard.seats -= 1
+    yield shard.put_async()
+    ndb.get_context().call_on_commit(lambda: _afterChange(conf, -1))
+
+
+def claim_seat(conf):
+    """Synchronous claim_seat_async()."""
+    return claim_seat_async(conf).get_result()
+
+
+@ndb.tasklet
+def release_seat_async(conf):
+    """Give one seat back to a random shard of conf; meant to run inside
+    the caller's (xg) transaction."""
+    key = random.choice(_shardKeys(conf.key, conf.seatShards))
+    shard = (yield key.get_async()) or SeatShard(key=key)
+    shard.seats += 1
+    yield shard.put_async()
+    ndb.get_context().call_on_commit(lambda: _afterChange(conf, 1))
+
+
+def release_seat(conf):
+    """Synchronous release_seat_async()."""
+    release_seat_async(conf).get_result()
+
+
+@metrics.transactional('seats.claim_seats', xg=True)
+def claim_seats(conf, count):
+    """Take up to count seats from conf's shards in one transaction, for
+    batched registrations; return the number of seats taken."""
+    if count <= 0:
+        return 0
+    shards = [shard for shard in
+              ndb.get_multi(_shardKeys(conf.key, conf.seatShards)) if shard]
+    taken = 0
+    changed = []
+    for shard in sorted(shards, key=lambda shard: -shard.seats):
+        take = min(shard.seats, count - taken)
+        if take <= 0:
+            break
+        shard.seats -= take
+        taken += take
+        changed.append(shard)
+    if changed:
+        ndb.put_multi(changed)
+        ndb.get_context().call_on_commit(
+            lambda: _afterChange(conf, -taken))
+    return taken
+
+
+def adjust_seats(conf_key, num_shards, delta):
+    """Add (delta > 0) or withdraw (delta < 0) seats, e.g. after
+    maxAttendees changed. Withdrawals stop at zero available seats."""
+    keys = _shardKeys(conf_key, num_shards)
+    random.shuffle(keys)
+
+    @metrics.transactional('seats.adjust_seats')
+    def _adjust(key, wanted):
+        shard = key.get() or SeatShard(key=key)
+        change = max(wanted, -shard.seats)
+        shard.seats += change
+        shard.put()
+        return change
+
+    if delta > 0:
+        _adjust(keys[0], delta)
+    else:
+        for key in keys:
+            if delta == 0:
+                break
+            delta -= _adjust(key, delta)
+    memcache.delete(_cacheKey(conf_key))
+    schedule_sync(conf_key)
+
+# - - - Conference.seatsAvailable snapshot - - - - - - - - - -
+
+def schedule_sync(conf_key):
+    """Enqueue a sync of Conference.seatsAvailable, at most one per
+    conference every SYNC_INTERVAL seconds."""
+    wsck = conf_key.urlsafe()
+    try:
+        taskqueue.add(params={'conferenceKey': wsck},
+            url='/tasks/sync_seats',
+            name='seatsync-%s-%d' % (wsck, int(time.time() / SYNC_INTERVAL)),
+            countdown=SYNC_INTERVAL
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def sync_conference(conf_key):
+    """Write the sum of the shards back to Conference.seatsAvailable."""
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return
+    shards = ndb.get_multi(_shardKeys(conf_key, conf.seatShards))
+    seats = sum(shard.seats for shard in shards if shard)
+    memcache.set(_cacheKey(conf_key), seats, SEATS_TTL)
+
+    @metrics.transactional('seats.sync_conference')
+    def _write():
+        conf = conf_key.get()
+        if conf.seatsAvailable != seats:
+            conf.seatsAvailable = seats
+            conf.put()
+            return True
+        return False
+
+    if _write():
+        # queryConferences may filter on the snapshot, and cached pages
+        # show seats available
+        cache.invalidate(Conference._get_kind())
+    logging.debug('Synced %s seats available: %d', conf_key.urlsafe(), seats)
@@ -16,3 +16,6 @@ WEB_CLIENT_ID = '***************'
 ANDROID_CLIENT_ID = '***************'
 IOS_CLIENT_ID = '***************'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Cache queryConferences result pages in memcache
+QUERY_CACHE_ENABLED = True
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Udacity conference server-side Python App Engine speakers
+
+$Id$
+
+Session.speaker is free text; a Speaker entity is keyed by its
+normalized form (case-folded, whitespace collapsed), so "Jane Doe" and
+"jane  doe" are one speaker. Each Speaker lists, per conference, the
+keys of the sessions it gives, maintained as sessions are written:
+looking up a speaker's sessions is a single get, and speakers can be
+looked up by prefix over the key index.
+
+"""
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Session
+from models import Speaker
+from models import SpeakerSessions
+import metrics
+
+BACKFILL_BATCH_SIZE = 100
+
+
+def normalize(name):
+    """Return the normalized form of a speaker name."""
+    return u' '.join((name or u'').lower().split())
+
+
+def speaker_key(name):
+    return ndb.Key(Speaker, normalize(name))
+
+
+@metrics.transactional('speakers.addSessions')
+def _addSessions(name, conf_key, session_keys):
+    key = speaker_key(name)
+    speaker = key.get() or Speaker(key=key, name=name)
+    for entry in speaker.conferences:
+        if entry.conference == conf_key:
+            break
+    else:
+        entry = SpeakerSessions(conference=conf_key)
+        speaker.conferences.append(entry)
+    added = [s_key for s_key in session_keys if s_key not in entry.sessions]
+    if added:
+        entry.sessions.extend(added)
+        speaker.put()
+    return speaker
+
+
+def add_sessions(sessions):
+    """Record Sessions under their speakers, one transaction per speaker
+    and conference. Recording a session twice is harmless."""
+    grouped = {}
+    for session in sessions:
+        group = grouped.setdefault(
+            (normalize(session.speaker), session.conference),
+            (session.speaker, []))
+        group[1].append(session.key)
+    for (_, conf_key), (name, s_keys) in grouped.items():
+        _addSessions(name, conf_key, s_keys)
+
+
+def session_keys(name, conf_key=None):
+    """Return the keys of the sessions given by speaker name, in conference
+    conf_key or in all conferences."""
+    speaker = speaker_key(name).get()
+    return speaker.session_keys(conf_key) if speaker else []
+
+
+def find(prefix, limit):
+    """Return the Speakers whose normalized name starts with prefix."""
+    prefix = normalize(prefix)
+    keys = Speaker.query(Speaker.key >= ndb.Key(Speaker, prefix),
+                         Speaker.key < ndb.Key(Speaker, prefix + u'\ufffd')
+                         ).fetch(limit, keys_only=True)
+    return [speaker for speaker in ndb.get_multi(keys) if speaker]
+
+
+def backfill(cursor=None):
+    """Record one batch of Sessions written before Speakers existed;
+    return the cursor of the next batch, or None when done."""
+    start = Cursor(urlsafe=cursor) if cursor else None
+    sessions, next_cursor, more = Session.query().fetch_page(
+        BACKFILL_BATCH_SIZE, start_cursor=start)
+    add_sessions(sessions)
+    return next_cursor.urlsafe() if more and next_cursor else None
@@ -346,6 +346,11 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     $scope.pagination = $scope.pagination || {};
     $scope.pagination.currentPage = 0;
     $scope.pagination.pageSize = 20;
+    /**
+     * Holds the cursor of the next server page of queryConferences, if any.
+     * @type {string}
+     */
+    $scope.pagination.nextCursor = null;
     /**
      * Returns the number of the pages in the pagination.
      *
@@ -425,10 +430,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param cursor the cursor of the page to append, omitted to start over.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (cursor) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if (cursor) {
+            sendFilters.cursor = cursor;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,7 +469,11 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!cursor) {
+                            $scope.conferences = [];
+                            $scope.pagination.currentPage = 0;
+                        }
+                        $scope.pagination.nextCursor = resp.nextCursor || null;
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
@@ -468,6 +483,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             });
     }
 
+    /**
+     * Fetches the next server page of conferences and shows it.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.pagination.nextCursor) {
+            $scope.queryConferencesAll($scope.pagination.nextCursor);
+            $scope.pagination.currentPage = $scope.pagination.numberOfPages();
+        }
+    };
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""sync.py
+
+Udacity conference server-side Python App Engine delta sync
+
+$Id$
+
+Conferences and Sessions keep the time of their last write in an
+auto_now 'modified' property, and deleting one leaves a Tombstone (see
+models.py). changes() pages through the entities of a kind modified
+after a client's watermark, in order of modification, then through the
+Tombstones of the kind buried after it. Every page carries the
+watermark to sync from next time: the time the sync started less
+SYNC_SKEW seconds, as writes reach the indexes a little after their
+timestamp and instance clocks drift. A client may see an entity twice,
+but doesn't miss one.
+
+Entities written before 'modified' existed only show up once backfill()
+has stamped them.
+
+"""
+
+import base64
+import json
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Conference
+from models import Session
+from models import Tombstone
+import metrics
+
+SYNC_SKEW = 60              # seconds a watermark trails the sync
+BACKFILL_BATCH_SIZE = 100
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+KINDS = dict((model._get_kind(), model) for model in (Conference, Session))
+
+_MODIFIED = 'modified'
+_DELETED = 'deleted'
+
+
+def format_watermark(when):
+    return when.strftime(WATERMARK_FORMAT)
+
+
+def parse_watermark(watermark):
+    """Return the datetime of watermark; raise ValueError if invalid."""
+    try:
+        return datetime.strptime(watermark, WATERMARK_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid watermark: %s' % watermark)
+
+
+def _encodeToken(phase, position, watermark):
+    return base64.urlsafe_b64encode(json.dumps(
+        [phase, position.urlsafe() if position else None, watermark]))
+
+
+def _decodeToken(token):
+    try:
+        phase, position, watermark = json.loads(
+            base64.urlsafe_b64decode(str(token)))
+        if phase not in (_MODIFIED, _DELETED):
+            raise ValueError(phase)
+        return (phase, Cursor(urlsafe=position) if position else None,
+                watermark)
+    except Exception:
+        raise ValueError('Invalid cursor: %s' % token)
+
+
+def changes(kind, since, page_size, cursor=None):
+    """Return (entities, deleted keys, next cursor, watermark) for a page
+    of the changes to kind ('Conference' or 'Session') after the
+    watermark since, or of all of them when since is None. cursor is the
+    one returned with the previous page. Raises ValueError for unknown
+    kinds and invalid watermarks or cursors."""
+    model = KINDS.get(kind)
+    if model is None:
+        raise ValueError('Unknown kind: %s' % kind)
+    after = parse_watermark(since) if since else None
+    if cursor:
+        phase, position, watermark = _decodeToken(cursor)
+    else:
+        phase, position = _MODIFIED, None
+        watermark = format_watermark(
+            datetime.utcnow() - timedelta(seconds=SYNC_SKEW))
+
+    entities, deleted, more = [], [], True
+    if phase == _MODIFIED:
+        query = model.query()
+        if after:
+            query = query.filter(model.modified > after)
+        entities, position, more = query.order(model.modified).fetch_page(
+            page_size, start_cursor=position)
+        if not more:
+            # the Tombstones come next, on this page if there is room
+            phase, position, more = _DELETED, None, True
+    if phase == _DELETED and len(entities) < page_size:
+        query = Tombstone.query(Tombstone.kind == kind)
+        if after:
+            query = query.filter(Tombstone.deleted > after)
+        tombstones, position, more = query.order(Tombstone.deleted).fetch_page(
+            page_size - len(entities), start_cursor=position, keys_only=True)
+        deleted = [key.parent() for key in tombstones]
+
+    next_cursor = None
+    if more:
+        next_cursor = _encodeToken(phase, position, watermark)
+    return entities, deleted, next_cursor, watermark
+
+
+@metrics.transactional('sync.stamp')
+def _stamp(key):
+    entity = key.get()
+    if entity and entity.modified is None:
+        entity.put()
+
+
+def backfill(kind, cursor=None):
+    """Stamp one batch of the entities of kind written before 'modified'
+    existed; return the cursor of the next batch, or None when done."""
+    start = Cursor(urlsafe=cursor) if cursor else None
+    keys, next_cursor, more = KINDS[kind].query().fetch_page(
+        BACKFILL_BATCH_SIZE, start_cursor=start, keys_only=True)
+    for key in keys:
+        _stamp(key)
+    return next_cursor.urlsafe() if more and next_cursor else None
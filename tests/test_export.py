@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""test_export.py -- bulk export jobs, written to a LocalStorage"""
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Registration
+from models import Session
+import export
+from tests import testbase
+
+MAX_RUNS = 20
+
+
+class ExportTest(testbase.TestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(export.set_storage, export._storage)
+        export.set_storage(export.LocalStorage(self.root))
+        self.addCleanup(setattr, export, 'EXPORT_BATCH_SIZE',
+                        export.EXPORT_BATCH_SIZE)
+        export.EXPORT_BATCH_SIZE = 2
+
+        self.conf_keys = [Conference(name='Conf %d' % i, city='Paris').put()
+                          for i in range(3)]
+        Session(name='Keynote', speaker='Jane Doe',
+                conference=self.conf_keys[0]).put()
+        Registration(key=ndb.Key(Registration, self.conf_keys[0].urlsafe(),
+                                 parent=ndb.Key(Profile, 'alice')),
+                     conference=self.conf_keys[0]).put()
+
+    def runJob(self, fmt):
+        job_id = export.start(fmt).key.id()
+        self.assertEqual(1, len(self.tasks('/tasks/export')))
+        for _ in range(MAX_RUNS):
+            if export.status(job_id)['status'] != 'RUNNING':
+                break
+            export.run(job_id)
+        return job_id
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    def testNdjson(self):
+        job_id = self.runJob('ndjson')
+        status = export.status(job_id)
+        self.assertEqual('DONE', status['status'])
+        self.assertEqual(5, status['rows'])
+        self.assertEqual({'Conference': 2, 'Session': 1, 'Registration': 1},
+                         status['chunks'])
+
+        manifest = json.loads(self.read('%s/manifest.json' % job_id))
+        self.assertEqual(5, manifest['rows'])
+        self.assertEqual([
+            '%s/conference-00000.ndjson' % job_id,
+            '%s/conference-00001.ndjson' % job_id,
+            '%s/session-00000.ndjson' % job_id,
+            '%s/registration-00000.ndjson' % job_id,
+        ], manifest['chunks'])
+
+        confs = [json.loads(line) for name in manifest['chunks'][:2]
+                 for line in self.read(name).splitlines()]
+        self.assertEqual(sorted(key.urlsafe() for key in self.conf_keys),
+                         sorted(conf['key'] for conf in confs))
+        reg = json.loads(self.read(manifest['chunks'][3]))
+        self.assertEqual('alice', reg['userId'])
+        self.assertEqual(self.conf_keys[0].urlsafe(), reg['conference'])
+
+    def testCsv(self):
+        job_id = self.runJob('csv')
+        rows = list(csv.reader(
+            self.read('%s/session-00000.csv' % job_id).splitlines()))
+        self.assertEqual(list(export.COLUMNS[1][1]), rows[0])
+        self.assertEqual('Keynote', rows[1][2])
+        self.assertEqual('', rows[1][5])    # no startDate
+
+    def testRunAfterDone(self):
+        job_id = self.runJob('ndjson')
+        export.run(job_id)
+        self.assertEqual(5, export.status(job_id)['rows'])
+
+    def testUnknownFormat(self):
+        self.assertRaises(ValueError, export.start, 'xml')
+        self.assertIsNone(export.status('nope'))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""test_facets.py -- the in-memory conference facet index"""
+
+from models import Conference
+import facets
+from tests import testbase
+
+
+class FacetIndexTest(testbase.TestCase):
+
+    def setUp(self):
+        super(FacetIndexTest, self).setUp()
+        self.addCleanup(setattr, facets, '_index', facets._index)
+        facets._index = facets._FacetIndex()
+        self.keys = [
+            Conference(name='A', city='Paris', topics=['Python', 'Go'],
+                       month=3, maxAttendees=100).put(),
+            Conference(name='B', city='Rome', topics=[],
+                       month=5, maxAttendees=50).put(),
+            Conference(name='C', city='Paris', month=7).put(),
+        ]
+
+    def query(self, *filters):
+        return facets.query([{'field': f, 'operator': op, 'value': v}
+                             for f, op, v in filters], 10)[0]
+
+    def testBitmap(self):
+        self.assertEqual(0, facets._bitmap([]))
+        self.assertEqual(1 | 1 << 9 | 1 << 64, facets._bitmap([64, 0, 9]))
+
+    def testConferencesWithoutTopics(self):
+        a, b, c = self.keys
+        self.assertEqual([a, b, c], self.query())
+        self.assertEqual([b, c], self.query(('city', '!=', 'Lyon'),
+                                            ('month', '>', 4)))
+        self.assertEqual([a], self.query(('topics', '=', 'Go')))
+        self.assertEqual([a, b], self.query(('month', '<', 6),
+                                            ('maxAttendees', '>=', 50)))
+
+    def testWarmAndChanges(self):
+        facets.warm()
+        loaded_at = facets._index.loaded_at
+        self.assertIsNotNone(loaded_at)
+        facets.warm()
+        self.assertEqual(loaded_at, facets._index.loaded_at)
+
+        a, b, c = self.keys
+        conf = c.get()
+        conf.topics = ['Go']
+        conf.put()
+        facets.record_change(c)
+        b.delete()
+        facets.record_change(b)
+        facets._index.checked_at = 0
+        self.assertEqual([a, c], self.query(('topics', '=', 'Go')))
+        self.assertEqual([a, c], self.query())
+
+    def testReloadWhenBehind(self):
+        facets.warm()
+        d = Conference(name='D', city='Oslo', month=1).put()
+        # the change log entry was lost
+        facets.record_change(d)
+        facets.memcache.flush_all()
+        facets._index.seq = 5
+        facets._index.checked_at = 0
+        self.assertEqual([d], self.query(('city', '=', 'Oslo')))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""test_featured.py -- featured speakers, from Sessions to the cache"""
+
+import threading
+from datetime import date
+from datetime import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FeaturedSpeakers
+from models import Session
+import featured
+import speakers
+from tests import testbase
+
+TASK_ATTEMPTS = 10
+
+
+class FeaturedTest(testbase.TestCase):
+
+    def setUp(self):
+        super(FeaturedTest, self).setUp()
+        self.conf_key = Conference(name='PyCon').put()
+        self.wsck = self.conf_key.urlsafe()
+
+    def addSessions(self, speaker, *names):
+        # keyed by name, so that a retried task puts the same Session
+        sessions = [Session(id=name, name=name, speaker=speaker,
+                            conference=self.conf_key,
+                            startDate=date(2026, 5, 1), startTime=time(9))
+                    for name in names]
+        ndb.put_multi(sessions)
+        speakers.add_sessions(sessions)
+        return sessions
+
+    def runParallel(self, calls):
+        """Run each (fn, args) of calls in a thread of its own, like tasks
+        on several instances, retrying those whose transaction failed."""
+        errors = []
+
+        def task(fn, args):
+            for _ in range(TASK_ATTEMPTS):
+                try:
+                    return fn(*args)
+                except datastore_errors.TransactionFailedError:
+                    pass
+                except Exception as e:
+                    errors.append(e)
+                    return
+            errors.append('%s%r kept failing' % (fn.__name__, args))
+
+        threads = [threading.Thread(target=task, args=call) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+    def testOneSessionIsNotFeatured(self):
+        self.addSessions('Jane Doe', 'Intro')
+        featured.update_speaker(self.wsck, 'jane doe')
+        self.assertEqual([], featured.get_featured(self.wsck))
+
+    def testUpdateSpeaker(self):
+        self.addSessions('Jane Doe', 'Intro', 'Advanced')
+        featured.update_speaker(self.wsck, 'jane doe')
+        expected = [{'speaker': 'Jane Doe',
+                     'sessions': ['Intro', 'Advanced']}]
+        self.assertEqual(expected, featured.get_featured(self.wsck))
+        state = ndb.Key(FeaturedSpeakers, self.wsck).get()
+        self.assertEqual(1, state.version)
+        self.assertEqual(expected, state.speakers)
+
+        # rebuilt from the entity once evicted from both tiers
+        memcache.flush_all()
+        self.reset_caches()
+        self.assertEqual(expected, featured.get_featured(self.wsck))
+
+    def testSpeakerDropped(self):
+        sessions = self.addSessions('Jane Doe', 'Intro', 'Advanced')
+        featured.update_speaker(self.wsck, 'jane doe')
+        sessions[1].key.delete()
+        speaker = speakers.speaker_key('jane doe').get()
+        speaker.conferences[0].sessions.remove(sessions[1].key)
+        speaker.put()
+        featured.update_speaker(self.wsck, 'jane doe')
+        self.reset_caches()
+        self.assertEqual([], featured.get_featured(self.wsck))
+
+    def testStaleVersionIsNotCached(self):
+        self.addSessions('Jane Doe', 'Intro', 'Advanced')
+        featured.update_speaker(self.wsck, 'jane doe')
+        featured._featured.set_versioned(self.wsck, 0, [])
+        self.reset_caches()
+        self.assertEqual(1, len(featured.get_featured(self.wsck)))
+
+    def testParallelUpdates(self):
+        names = ['Speaker %d' % i for i in range(6)]
+        for name in names:
+            self.addSessions(name, name + ' Intro', name + ' Advanced')
+        self.runParallel([(featured.update_speaker, (self.wsck, name))
+                          for name in names])
+        self.reset_caches()
+        self.assertEqual(sorted(names), sorted(
+            entry['speaker'] for entry in featured.get_featured(self.wsck)))
+        self.assertEqual(
+            len(names), ndb.Key(FeaturedSpeakers, self.wsck).get().version)
+
+    def testParallelSessionsOfOneSpeaker(self):
+        # each task adds a session, then updates the speaker, like
+        # createSession and its /tasks/get_featured_speaker task; the
+        # update committed last must see every session
+        self.addSessions('Jane Doe', 'Session 0')
+        names = ['Session %d' % i for i in range(1, 6)]
+
+        def addAndUpdate(name):
+            self.addSessions('Jane Doe', name)
+            featured.update_speaker(self.wsck, 'jane doe')
+
+        self.runParallel([(addAndUpdate, (name,)) for name in names])
+        self.reset_caches()
+        entries = featured.get_featured(self.wsck)
+        self.assertEqual(1, len(entries))
+        self.assertEqual(['Session 0'] + names,
+                         sorted(entries[0]['sessions']))
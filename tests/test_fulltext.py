@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""test_fulltext.py -- full-text indexing and search, in process"""
+
+from models import Conference
+from models import Session
+import fulltext
+from tests import testbase
+
+
+class InProcessBackendTest(testbase.TestCase):
+
+    def setUp(self):
+        super(InProcessBackendTest, self).setUp()
+        self.backend = fulltext.InProcessBackend()
+        self.backend.put('idx', 'a', {'name': u'Python on App Engine',
+                                      'description': u'python python'})
+        self.backend.put('idx', 'b', {'name': u'Python tips'})
+        self.backend.put('idx', 'c', {'name': u'Go on App Engine'})
+
+    def search(self, query, limit=10, cursor=None):
+        words, prefixes = fulltext.parse_query(query)
+        return self.backend.search('idx', words, prefixes, limit, cursor)
+
+    def testAllWordsMustMatch(self):
+        self.assertEqual(['a', 'c'], sorted(self.search(u'app engine')[0]))
+        self.assertEqual(['a'], self.search(u'python engine')[0])
+        self.assertEqual([], self.search(u'python java')[0])
+
+    def testRanking(self):
+        # 'a' says python three times
+        self.assertEqual(['a', 'b'], self.search(u'PYTHON')[0])
+
+    def testPrefixes(self):
+        self.assertEqual(['a', 'b'], self.search(u'pyth*')[0])
+        self.assertEqual(['a', 'c'], sorted(self.search(u'en* app')[0]))
+        self.assertRaises(ValueError, fulltext.parse_query, u'p*')
+        self.assertRaises(ValueError, fulltext.parse_query, u' ')
+
+    def testPages(self):
+        page, cursor = self.search(u'on', limit=1)
+        self.assertEqual('1', cursor)
+        rest, cursor = self.search(u'on', limit=1, cursor=cursor)
+        self.assertIsNone(cursor)
+        self.assertEqual(['a', 'c'], sorted(page + rest))
+        self.assertRaises(ValueError, self.search, u'on', 1, 'x')
+
+    def testPutReplaces(self):
+        self.backend.put('idx', 'b', {'name': u'Go tips'})
+        self.assertEqual(['a'], self.search(u'python')[0])
+        self.assertEqual(['b', 'c'], sorted(self.search(u'go')[0]))
+
+    def testDelete(self):
+        self.backend.delete('idx', 'a')
+        self.backend.delete('idx', 'a')
+        self.assertEqual(['c'], self.search(u'engine')[0])
+        self.backend.delete('idx', 'b')
+        self.assertEqual([], self.search(u'pyth*')[0])
+        self.assertNotIn('python', self.backend._index('idx')['terms'])
+
+
+class SearchApiBackendTest(testbase.TestCase):
+
+    def setUp(self):
+        super(SearchApiBackendTest, self).setUp()
+        self.backend = fulltext.SearchApiBackend()
+        self.backend.put(fulltext.CONFERENCE_INDEX, 'a', {
+            'name': u'Python Conference', 'description': u'talks and sprints'})
+        self.backend.put(fulltext.CONFERENCE_INDEX, 'b', {
+            'name': u'Conf of Go', 'description': None})
+
+    def search(self, query):
+        words, prefixes = fulltext.parse_query(query)
+        return sorted(self.backend.search(
+            fulltext.CONFERENCE_INDEX, words, prefixes, 10)[0])
+
+    def testQueryString(self):
+        self.assertEqual(
+            u'(name:"conf" OR description:"conf") prefixes:"pyth"',
+            self.backend.query_string(
+                fulltext.CONFERENCE_INDEX, [u'conf'], [u'pyth']))
+
+    def testWholeWordsMatchContentOnly(self):
+        # 'conf' is a prefix of 'conference', but only 'b' has the word
+        self.assertEqual(['b'], self.search(u'conf'))
+        self.assertEqual(['a'], self.search(u'sprints'))
+        self.assertEqual(['a'], self.search(u'python talks'))
+        self.assertEqual([], self.search(u'pyth'))
+
+    def testPrefixes(self):
+        self.assertEqual(['a', 'b'], self.search(u'conf*'))
+        self.assertEqual(['a'], self.search(u'conf* pyth*'))
+
+
+class IndexTest(testbase.TestCase):
+
+    def setUp(self):
+        super(IndexTest, self).setUp()
+        self.addCleanup(fulltext.set_backend, fulltext._backend)
+        fulltext.set_backend(fulltext.InProcessBackend())
+
+    def testIndexKey(self):
+        conf_key = Conference(name='PyCon', description='All Python').put()
+        session_key = Session(name='Keynote', speaker='Jane Doe',
+                              highlights=['python 3'], conference=conf_key).put()
+        fulltext.index_key(conf_key)
+        fulltext.index_key(session_key)
+        self.assertEqual(([conf_key], None), fulltext.search_keys(
+            fulltext.CONFERENCE_INDEX, u'python', 10))
+        self.assertEqual(([session_key], None), fulltext.search_keys(
+            fulltext.SESSION_INDEX, u'jane pyth*', 10))
+
+        conf_key.delete()
+        fulltext.index_key(conf_key)
+        self.assertEqual(([], None), fulltext.search_keys(
+            fulltext.CONFERENCE_INDEX, u'python', 10))
+
+    def testEnqueueAndReindex(self):
+        keys = [Conference(name='Conf %d' % i).put() for i in range(3)]
+        fulltext.enqueue_multi(keys)
+        self.assertEqual(1, len(self.tasks('/tasks/index_document')))
+        self.assertIsNone(fulltext.reindex('Conference'))
+        found, _ = fulltext.search_keys(fulltext.CONFERENCE_INDEX, u'conf', 10)
+        self.assertEqual(sorted(keys), sorted(found))
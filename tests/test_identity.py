@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""test_identity.py -- bearer token to user id, through every tier"""
+
+import os
+import time
+
+from google.appengine.api import memcache
+
+from settings import WEB_CLIENT_ID
+import identity
+from tests import testbase
+
+ACCESS_TOKEN = 'ya29.access-token'
+ID_TOKEN = 'header.payload.signature'
+
+
+class FakeUsersIdToken(object):
+    """Stands in for endpoints.users_id_token's certificate check."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.calls = 0
+
+    def _verify_signed_jwt_with_certs(self, token, now, cache):
+        self.calls += 1
+        if self.payload is None:
+            raise ValueError('Invalid token signature')
+        return dict(self.payload)
+
+
+class IdentityTest(testbase.TestCase):
+
+    def setUp(self):
+        super(IdentityTest, self).setUp()
+        identity.reset()
+        self.addCleanup(identity.reset)
+        self.backend = identity.StubTokenInfo({
+            ACCESS_TOKEN: {'user_id': 'alice', 'expires_in': 3600},
+            ID_TOKEN: {'user_id': 'bob', 'expires_in': 3600},
+        })
+        self.addCleanup(identity.set_tokeninfo_backend,
+                        identity.set_tokeninfo_backend(self.backend))
+        self.requests = 0
+
+    def patch(self, name, value):
+        self.addCleanup(setattr, identity, name, getattr(identity, name))
+        setattr(identity, name, value)
+
+    def request(self, token):
+        """Start serving a new request, with token as its bearer token."""
+        self.requests += 1
+        os.environ['REQUEST_LOG_ID'] = str(self.requests)
+        if token:
+            os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        else:
+            os.environ.pop('HTTP_AUTHORIZATION', None)
+
+    def assertStats(self, **expected):
+        stats = identity.stats()
+        self.assertEqual(expected, dict((name, stats[name])
+                                        for name in expected))
+
+    def testNoToken(self):
+        self.request(None)
+        self.assertEqual('', identity.get_user_id())
+        self.assertStats(misses=0, tokeninfo=0, hit_ratio=0.0)
+
+    def testTiers(self):
+        self.request(ACCESS_TOKEN)
+        self.assertEqual('alice', identity.get_user_id())
+        self.assertStats(misses=1, tokeninfo=1, verified=0)
+        self.assertEqual(1, self.backend.calls)
+
+        # same request: the memo
+        self.assertEqual('alice', identity.get_user_id())
+        self.assertStats(request_hits=1)
+
+        # next request on this instance: the local LRU
+        self.request(ACCESS_TOKEN)
+        self.assertEqual('alice', identity.get_user_id())
+        self.assertStats(local_hits=1)
+
+        # another instance: memcache
+        identity._local.clear()
+        self.request(ACCESS_TOKEN)
+        self.assertEqual('alice', identity.get_user_id())
+        self.assertStats(memcache_hits=1, misses=1,
+                         request_hits=1, local_hits=1, hit_ratio=0.75)
+        self.assertEqual(1, self.backend.calls)
+
+    def testConcurrentCallsShareOneLookup(self):
+        self.request(ACCESS_TOKEN)
+        futures = [identity.get_user_id_async() for _ in range(3)]
+        self.assertEqual(['alice'] * 3, [f.get_result() for f in futures])
+        self.assertEqual(1, self.backend.calls)
+        self.assertStats(misses=1, request_hits=2)
+
+    def testRawTokenNotStored(self):
+        self.request(ACCESS_TOKEN)
+        identity.get_user_id()
+        self.assertIsNone(memcache.get(
+            identity.MEMCACHE_IDENTITY_PREFIX + ACCESS_TOKEN))
+
+    def testExpiredMemcacheEntry(self):
+        self.request(ACCESS_TOKEN)
+        identity.get_user_id()
+        key = identity.MEMCACHE_IDENTITY_PREFIX + \
+            identity.hashlib.sha256(ACCESS_TOKEN).hexdigest()
+        memcache.set(key, ('alice', int(time.time()) - 1))
+        identity._local.clear()
+        self.request(ACCESS_TOKEN)
+        self.assertEqual('alice', identity.get_user_id())
+        self.assertStats(memcache_hits=0, misses=2, tokeninfo=2)
+
+    def testUnresolvedTokenNotCached(self):
+        self.request('unknown')
+        self.assertEqual('', identity.get_user_id())
+        self.assertEqual('', identity.get_user_id())
+        self.assertEqual(2, self.backend.calls)
+        self.assertStats(misses=2, request_hits=0)
+
+    def testLocalVerification(self):
+        certs = FakeUsersIdToken({'azp': WEB_CLIENT_ID, 'sub': 'carol',
+                                  'exp': int(time.time()) + 3600})
+        self.patch('users_id_token', certs)
+        self.request(ID_TOKEN)
+        self.assertEqual('carol', identity.get_user_id())
+        self.assertStats(verified=1, tokeninfo=0)
+        self.assertEqual(0, self.backend.calls)
+
+        # access tokens aren't JWTs, and go straight to tokeninfo
+        self.request(ACCESS_TOKEN)
+        self.assertEqual('alice', identity.get_user_id())
+        self.assertEqual(1, certs.calls)
+
+    def testLocalVerificationFallsBack(self):
+        for payload in (None, {'azp': 'someone-else', 'sub': 'carol'}):
+            identity.reset()
+            memcache.flush_all()
+            self.patch('users_id_token', FakeUsersIdToken(payload))
+            self.request(ID_TOKEN)
+            self.assertEqual('bob', identity.get_user_id())
+            self.assertStats(verified=0, tokeninfo=1)
+
+    def testLocalVerificationOff(self):
+        certs = FakeUsersIdToken({'azp': WEB_CLIENT_ID, 'sub': 'carol'})
+        self.patch('users_id_token', certs)
+        self.patch('LOCAL_ID_TOKEN_VERIFICATION', False)
+        self.request(ID_TOKEN)
+        self.assertEqual('bob', identity.get_user_id())
+        self.assertEqual(0, certs.calls)
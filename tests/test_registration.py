@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""test_registration.py -- queued registrations, settled in batches"""
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Registration
+from models import RegistrationTicket
+from models import SeatClaims
+import registration
+import seats
+from tests import testbase
+
+
+class Crash(Exception):
+    pass
+
+
+class SettleTest(testbase.TestCase):
+
+    def setUp(self):
+        super(SettleTest, self).setUp()
+        self.conf = seats.ensure_sharded(
+            Conference(name='PyCon', maxAttendees=2, seatsAvailable=2).put().get())
+        self.wsck = self.conf.key.urlsafe()
+        self.users = ['alice', 'bob', 'carol']
+        ndb.put_multi([Profile(id=user) for user in self.users])
+
+    def patch(self, name, fn):
+        original = getattr(registration, name)
+        setattr(registration, name, fn)
+        self.addCleanup(setattr, registration, name, original)
+        return original
+
+    def enqueue(self, users):
+        return [registration.enqueue(user, self.conf.key).key.id()
+                for user in users]
+
+    def seatsLeft(self):
+        shards = ndb.get_multi(seats._shardKeys(self.conf.key, self.conf.seatShards))
+        return sum(shard.seats for shard in shards if shard)
+
+    def statuses(self, ticket_ids):
+        return [t.status for t in ndb.get_multi(
+            [ndb.Key(RegistrationTicket, t) for t in ticket_ids])]
+
+    def registered(self):
+        return sorted(key.parent().id() for key in
+                      Registration.query().fetch(keys_only=True))
+
+    def assertSettled(self):
+        self.assertIsNone(ndb.Key(SeatClaims, self.wsck).get())
+        self.assertEqual(2 - len(self.registered()), self.seatsLeft())
+
+    def testSettle(self):
+        tickets = self.enqueue(self.users)
+        self.assertEqual(3, registration.process(self.wsck))
+        self.assertEqual(['REGISTERED', 'REGISTERED', 'REJECTED'],
+                         self.statuses(tickets))
+        self.assertEqual(['alice', 'bob'], self.registered())
+        self.assertSettled()
+
+    def testRetryAfterClaim(self):
+        # the batch fails once its seats are claimed; the retry must
+        # neither claim them again nor lose them
+        tickets = self.enqueue(self.users)
+        grant = self.patch('_grant', lambda *args: _raise(Crash()))
+        requests = [{'ticket': t} for t in tickets]
+        self.assertRaises(Crash, registration._settle, self.wsck, requests)
+        self.assertEqual(0, self.seatsLeft())
+        self.patch('_grant', grant)
+        registration._settle(self.wsck, requests)
+        self.assertEqual(['REGISTERED', 'REGISTERED', 'REJECTED'],
+                         self.statuses(tickets))
+        self.assertSettled()
+
+    def testRetryAfterGrant(self):
+        # the batch fails before dropping its SeatClaims entry
+        tickets = self.enqueue(self.users)
+        release = self.patch('_release', lambda *args: _raise(Crash()))
+        requests = [{'ticket': t} for t in tickets]
+        self.assertRaises(Crash, registration._settle, self.wsck, requests)
+        self.patch('_release', release)
+        registration._settle(self.wsck, requests)
+        self.assertEqual(['REGISTERED', 'REGISTERED', 'REJECTED'],
+                         self.statuses(tickets))
+        self.assertSettled()
+
+    def testRegisteredMeanwhile(self):
+        # alice registers by another path between the batch's checks
+        # and its grants: she must not get a second seat
+        tickets = self.enqueue(['alice', 'bob'])
+        claim = registration._claim
+
+        def claimAndRegister(conf, ticket_ids):
+            Registration(key=registration.registration_key(
+                ndb.Key(Profile, 'alice'), conf.key), conference=conf.key).put()
+            return claim(conf, ticket_ids)
+        self.patch('_claim', claimAndRegister)
+        registration.process(self.wsck)
+        self.assertEqual(['REJECTED', 'REGISTERED'], self.statuses(tickets))
+        self.assertEqual(['alice', 'bob'], self.registered())
+        # alice's Registration was put outside the seat inventory
+        self.assertEqual(1, self.seatsLeft())
+        self.assertIsNone(ndb.Key(SeatClaims, self.wsck).get())
+
+
+def _raise(e):
+    raise e
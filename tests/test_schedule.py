@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""test_schedule.py -- conference schedules, built, cached and rebuilt"""
+
+from datetime import date
+from datetime import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+import schedule
+from tests import testbase
+
+
+class ScheduleTest(testbase.TestCase):
+
+    def setUp(self):
+        super(ScheduleTest, self).setUp()
+        self.conf_key = Conference(name='PyCon').put()
+        ndb.put_multi([
+            Session(name='Keynote', speaker='Jane Doe',
+                    conference=self.conf_key,
+                    startDate=date(2026, 5, 1), startTime=time(9)),
+            Session(name='Closing', speaker='John Roe',
+                    conference=self.conf_key,
+                    startDate=date(2026, 5, 2), startTime=time(17)),
+            Session(name='Intro', speaker='John Roe',
+                    conference=self.conf_key,
+                    startDate=date(2026, 5, 1), startTime=time(11)),
+        ])
+
+    def names(self, form):
+        return [[s.name for s in day.sessions] for day in form.days]
+
+    def testGetSchedule(self):
+        form = schedule.get_schedule(self.conf_key)
+        self.assertEqual(self.conf_key.urlsafe(), form.websafeConferenceKey)
+        self.assertEqual(1, form.version)
+        self.assertEqual(['2026-05-01', '2026-05-02'],
+                         [day.date for day in form.days])
+        self.assertEqual([['Keynote', 'Intro'], ['Closing']], self.names(form))
+
+        # served from the cache, then from the entity once evicted
+        self.assertEqual(1, schedule.get_schedule(self.conf_key).version)
+        memcache.flush_all()
+        self.reset_caches()
+        form = schedule.get_schedule(self.conf_key)
+        self.assertEqual(1, form.version)
+        self.assertEqual([['Keynote', 'Intro'], ['Closing']], self.names(form))
+
+    def testRebuild(self):
+        schedule.get_schedule(self.conf_key)
+        Session(name='Lunch', speaker='Chef', conference=self.conf_key,
+                startDate=date(2026, 5, 1), startTime=time(12)).put()
+        schedule.rebuild(self.conf_key)
+        self.reset_caches()
+        form = schedule.get_schedule(self.conf_key)
+        self.assertEqual(2, form.version)
+        self.assertEqual([['Keynote', 'Intro', 'Lunch'], ['Closing']],
+                         self.names(form))
+
+    def testNoConference(self):
+        self.conf_key.delete()
+        self.assertIsNone(schedule.get_schedule(self.conf_key))
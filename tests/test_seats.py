@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""test_seats.py -- claiming seats from the shards of a conference"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+import cache
+import seats
+from tests import testbase
+
+
+class ClaimSeatTest(testbase.TestCase):
+
+    def setUp(self):
+        super(ClaimSeatTest, self).setUp()
+        # one seat, moved to the last shard
+        self.conf = seats.ensure_sharded(Conference(
+            name='PyCon', maxAttendees=1, seatsAvailable=1).put().get())
+        self.keys = seats._shardKeys(self.conf.key, self.conf.seatShards)
+        first, last = ndb.get_multi([self.keys[0], self.keys[-1]])
+        first.seats, last.seats = 0, 1
+        ndb.put_multi([first, last])
+
+    @ndb.transactional(xg=True)
+    def claim(self):
+        return seats.claim_seat(self.conf)
+
+    def seatsLeft(self):
+        return sum(shard.seats for shard in ndb.get_multi(self.keys) if shard)
+
+    def testStaleCandidates(self):
+        # the non-transactional read saw seats in shards that have none
+        original = seats._shardsWithSeatsAsync
+        self.addCleanup(setattr, seats, '_shardsWithSeatsAsync', original)
+        stale = ndb.Future()
+        stale.set_result(self.keys[:seats.MAX_SHARD_ATTEMPTS])
+        seats._shardsWithSeatsAsync = lambda conf: stale
+
+        self.assertTrue(self.claim())
+        self.assertEqual(0, self.seatsLeft())
+        self.assertFalse(self.claim())
+
+    def testClaimKeepsQueryCache(self):
+        # the sync invalidates cached queryConferences pages, not the claim
+        generation_key = Conference._get_kind() + ':gen'
+        cache.invalidate(Conference._get_kind())
+        generation = memcache.get(generation_key)
+        self.assertTrue(self.claim())
+        self.assertEqual(generation, memcache.get(generation_key))
+        self.assertEqual(1, len(self.tasks('/tasks/sync_seats')))
+        seats.sync_conference(self.conf.key)
+        self.assertEqual(generation + 1, memcache.get(generation_key))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""testbase.py
+
+Udacity conference server-side Python App Engine test harness
+
+$Id$
+
+Every TestCase runs against fresh testbed stubs: a strongly consistent
+datastore, memcache, task queues (from queue.yaml), urlfetch,
+app_identity and search. Module-level state that outlives a request on
+a real instance, the local tier of every TwoTierCache, is dropped
+between tests.
+
+Run from the application directory, with the App Engine SDK in
+APPENGINE_SDK (or already on the path):
+
+    python -m unittest discover -s tests -t .
+
+"""
+
+import os
+import sys
+import unittest
+
+if os.environ.get('APPENGINE_SDK'):
+    sys.path.insert(0, os.environ['APPENGINE_SDK'])
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.ext import vendor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+vendor.add(os.path.join(ROOT, 'lib'))
+
+import cache
+import metrics
+
+
+def activate():
+    """Activate and return a Testbed with fresh stubs, and forget what
+    this instance caches."""
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_urlfetch_stub()
+    bed.init_app_identity_stub()
+    bed.init_search_stub()
+    # the Testbed brings its own apiproxy, without metrics' RPC counter
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'metrics_rpc_counter', metrics._countRpc)
+    ndb.get_context().clear_cache()
+    reset_caches()
+    return bed
+
+
+def reset_caches():
+    """Forget what this instance holds in every TwoTierCache."""
+    for c in cache._CACHES.values():
+        c._local.clear()
+        c._generation_expires = 0
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = activate()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def reset_caches(self):
+        reset_caches()
+
+    def tasks(self, url, queue='default'):
+        """Return the tasks enqueued for url on queue."""
+        return self.taskqueue.get_filtered_tasks(url=url, queue_names=[queue])